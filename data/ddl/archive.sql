@@ -0,0 +1,18 @@
+CREATE TABLE IF NOT EXISTS archived_years (
+    year INTEGER PRIMARY KEY,
+    file_name TEXT NOT NULL,           -- アーカイブ先のSQLiteファイル名
+    transaction_count INTEGER NOT NULL,
+    archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS archived_totals (
+    month TEXT NOT NULL,               -- YYYY-MM
+    account_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    total REAL NOT NULL,               -- 支出は負数、収入は正数
+    count INTEGER NOT NULL,
+    unconverted INTEGER NOT NULL DEFAULT 0, -- 換算レートがなく合計に含めていない件数
+    PRIMARY KEY(month, account_id, category_id),
+    FOREIGN KEY(account_id) REFERENCES accounts(account_id),
+    FOREIGN KEY(category_id) REFERENCES categories(category_id)
+);
@@ -0,0 +1,29 @@
+CREATE TABLE IF NOT EXISTS budgets (
+    budget_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    scope_type TEXT NOT NULL,          -- category, account, tag
+    scope_id INTEGER NOT NULL,         -- category_id, account_id または tag_id
+    period TEXT NOT NULL DEFAULT 'month', -- month, year
+    amount REAL NOT NULL,              -- 予算額（正数）
+    alert_threshold REAL DEFAULT 0.8,  -- 予算額に対する割合で警告
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(scope_type, scope_id, period)
+);
+
+CREATE TABLE IF NOT EXISTS budget_counters (
+    budget_id INTEGER NOT NULL,
+    period_key TEXT NOT NULL,          -- YYYY-MM（月予算）または YYYY（年予算）
+    category_id INTEGER NOT NULL,      -- 返金は同じカテゴリの支出からのみ差し引く
+    spent REAL NOT NULL DEFAULT 0,     -- 支出カテゴリの取引の合計（正数、返金は差し引く）
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(budget_id, period_key, category_id),
+    FOREIGN KEY(budget_id) REFERENCES budgets(budget_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS budget_alerts (
+    budget_id INTEGER NOT NULL,
+    period_key TEXT NOT NULL,
+    alert_level TEXT NOT NULL DEFAULT 'ok', -- 最後に通知した状態（ok, warning, over）
+    PRIMARY KEY(budget_id, period_key),
+    FOREIGN KEY(budget_id) REFERENCES budgets(budget_id) ON DELETE CASCADE
+);
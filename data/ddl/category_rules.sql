@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS category_rules (
+    rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_id INTEGER NOT NULL,      -- 一致したときに設定するカテゴリ
+    match_type TEXT NOT NULL,          -- keyword, regex, amount（金額・口座の条件のみ）
+    pattern TEXT,                      -- キーワードまたは正規表現（品目名・説明・メモに対して）
+    min_amount REAL,                   -- 金額の下限（含む）
+    max_amount REAL,                   -- 金額の上限（含む）
+    account_id INTEGER,                -- 指定した口座の取引のみ
+    priority INTEGER DEFAULT 100,      -- 小さいほど優先
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(category_id) REFERENCES categories(category_id),
+    FOREIGN KEY(account_id) REFERENCES accounts(account_id)
+);
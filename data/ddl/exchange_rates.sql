@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS exchange_rates (
+    currency TEXT NOT NULL,            -- 換算元の通貨（USDなど）
+    base_currency TEXT NOT NULL,       -- 換算先の通貨
+    rate_date TEXT NOT NULL,           -- YYYY-MM-DD
+    rate REAL NOT NULL,                -- 1 currency = rate base_currency
+    PRIMARY KEY(currency, base_currency, rate_date)
+);
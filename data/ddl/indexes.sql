@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS idx_transactions_log_id ON transactions(log_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_transaction_date ON transactions(transaction_date);
+CREATE INDEX IF NOT EXISTS idx_transaction_tags_tag_id ON transaction_tags(tag_id);
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS materialized_components (
+    name TEXT PRIMARY KEY,             -- SQLコンポーネント名
+    table_name TEXT NOT NULL,          -- 結果を保存するテーブル
+    partition_type TEXT,               -- month, account または NULL（常に全体を再計算）
+    partition_column TEXT,             -- 結果の中でパーティションを表す列
+    sql_hash TEXT,                     -- 保存時のSQLと設定のハッシュ（変更検知用）
+    row_count INTEGER,
+    dirty INTEGER NOT NULL DEFAULT 0,  -- 差分更新に失敗した（次の読み取りで全体の再計算を予約する）
+    refreshed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
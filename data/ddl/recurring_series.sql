@@ -0,0 +1,31 @@
+CREATE TABLE IF NOT EXISTS recurring_series (
+    series_key TEXT PRIMARY KEY,       -- account_id:正規化した品目名
+    account_id INTEGER NOT NULL,
+    normalized_name TEXT NOT NULL,
+    display_name TEXT,                 -- 最後に見た品目名（表示用）
+    dates TEXT NOT NULL,               -- 直近の取引日のJSON配列
+    amounts TEXT NOT NULL,             -- 直近の金額のJSON配列
+    occurrences INTEGER NOT NULL,
+    period TEXT,                       -- monthly, yearly または NULL（周期なし）
+    interval_days REAL,
+    average_amount REAL,
+    last_date DATETIME,
+    next_expected_date DATETIME,
+    confidence REAL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(account_id) REFERENCES accounts(account_id)
+);
+
+CREATE TABLE IF NOT EXISTS recurring_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_transaction_id INTEGER NOT NULL DEFAULT 0  -- ここまでの取引は処理済み
+);
+
+CREATE TABLE IF NOT EXISTS recurring_dirty (
+    series_key TEXT PRIMARY KEY,       -- 処理済みの取引が変更・削除された系列（次の更新で再計算）
+    account_id INTEGER NOT NULL,
+    normalized_name TEXT NOT NULL
+);
+
+-- 系列の再計算で口座の取引だけを読む
+CREATE INDEX IF NOT EXISTS idx_transactions_account_id ON transactions(account_id);
@@ -9,6 +9,7 @@ CREATE TABLE transactions (
     transaction_date DATETIME NOT NULL,
     memo TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    amount_reporting REAL,            -- 報告通貨に換算した金額（レートがない場合はNULL）
     FOREIGN KEY(account_id) REFERENCES accounts(account_id),
     FOREIGN KEY(category_id) REFERENCES categories(category_id),
     FOREIGN KEY(log_id) REFERENCES data_logs(log_id)
@@ -3,15 +3,29 @@
 
 import os
 import json
+import asyncio
 import uvicorn
 import socket
 import signal
 import sys
 from typing import Dict, List, Optional, Union
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from pydantic import BaseModel
 import db_access
+import job_queue
+import csv_watcher
+import materialized
+import chat_context
+import recurring
+import categorizer
+import maintenance
+import archive
+import compact_ledger
+import change_feed
+import budgets
+import currency
 
 
 import logging
@@ -57,6 +71,18 @@ LOGGING_CONFIG = {
 # Create FastAPI application
 app = FastAPI(title="Kakeibo API Server")
 
+# Route each request to a ledger, from the "ledger" query parameter or the X-Ledger header (default ledger otherwise)
+@app.middleware("http")
+async def select_ledger(request: Request, call_next):
+    name = request.query_params.get("ledger") or request.headers.get("X-Ledger") or db_access.DEFAULT_LEDGER
+    try:
+        if not db_access.ledgers.exists(name):
+            return JSONResponse(status_code=404, content={"detail": f"Ledger '{name}' does not exist"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    with db_access.ledgers.use(name):
+        return await call_next(request)
+
 # Add CORS middleware to allow requests from the Tauri frontend
 app.add_middleware(
     CORSMiddleware,
@@ -122,12 +148,108 @@ class Transaction(BaseModel):
     memo: Optional[str] = None
     tags: Optional[List[int]] = None
 
+class CategoryRule(BaseModel):
+    category_id: int
+    match_type: str = "keyword"
+    pattern: Optional[str] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    account_id: Optional[int] = None
+    priority: int = 100
+
+class Recategorize(BaseModel):
+    only_uncategorized: bool = True
+    batch_size: int = 1000
+
+class ChatMessage(BaseModel):
+    message: str
+    limit: int = 200
+
+class TransactionItem(BaseModel):
+    account_id: int
+    category_id: int
+    amount: float
+    transaction_date: str
+    item_name: Optional[str] = None
+    description: Optional[str] = None
+    memo: Optional[str] = None
+    tags: Optional[List[int]] = None
+
+class TransactionUpdate(BaseModel):
+    transaction_id: int
+    account_id: Optional[int] = None
+    category_id: Optional[int] = None
+    amount: Optional[float] = None
+    transaction_date: Optional[str] = None
+    item_name: Optional[str] = None
+    description: Optional[str] = None
+    memo: Optional[str] = None
+    tags: Optional[List[int]] = None
+
+class BulkTransactions(BaseModel):
+    transactions: List[TransactionItem]
+
+class BulkTransactionUpdates(BaseModel):
+    transactions: List[TransactionUpdate]
+
+class TransactionIds(BaseModel):
+    transaction_ids: List[int]
+
+class Ledger(BaseModel):
+    name: str
+
+class SQLComponentRun(BaseModel):
+    name: str
+    env_vars: Dict[str, str] = {}
+    max_points: Optional[int] = None
+
+class SQLComponentBatch(BaseModel):
+    components: List[SQLComponentRun]
+
+class Budget(BaseModel):
+    name: str
+    scope_type: str
+    scope_id: int
+    amount: float
+    period: str = "month"
+    alert_threshold: Optional[float] = 0.8
+
+class BudgetUpdate(BaseModel):
+    name: Optional[str] = None
+    amount: Optional[float] = None
+    alert_threshold: Optional[float] = None
+
 class SQLComponent(BaseModel):
     name: str
     sql: str
     description: Optional[str] = None
     environment_variables: Optional[Dict[str, str]] = None
 
+# Start the optional CSV folder watcher over the CSV folders of all ledgers
+# (KAKEIBO_WATCH_CSV=1; it polls unless watchdog is installed, "polling" forces polling)
+@app.on_event("startup")
+async def start_csv_watcher():
+    watch_mode = os.environ.get("KAKEIBO_WATCH_CSV", "").lower()
+    if watch_mode in ("1", "true", "yes", "polling"):
+        csv_watcher.watcher.start(use_polling=(watch_mode == "polling"))
+
+@app.on_event("shutdown")
+async def stop_csv_watcher():
+    if csv_watcher.watcher.running:
+        csv_watcher.watcher.stop()
+
+# Start the optional maintenance scheduler (KAKEIBO_MAINTENANCE_HOURS=24 snapshots and optimizes once a day)
+@app.on_event("startup")
+async def start_maintenance_scheduler():
+    interval_hours = os.environ.get("KAKEIBO_MAINTENANCE_HOURS")
+    if interval_hours:
+        maintenance.scheduler.start(float(interval_hours))
+
+@app.on_event("shutdown")
+async def stop_maintenance_scheduler():
+    if maintenance.scheduler.running:
+        maintenance.scheduler.stop()
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -142,7 +264,7 @@ async def init_database():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Execute custom SQL
+# Execute custom SQL (read-only: on the query connection, writes and ATTACH are rejected)
 @app.post("/execute_sql")
 async def execute_sql(sqldict: dict):
     #logging.debug(f"Received SQL for execution: {sqldict}")
@@ -207,6 +329,52 @@ async def delete_category(category_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Get all categorization rules
+@app.get("/category_rules")
+async def get_category_rules():
+    try:
+        return categorizer.categorizer.get_rules()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Add new categorization rule
+@app.post("/category_rules")
+async def add_category_rule(rule: CategoryRule):
+    try:
+        return categorizer.categorizer.add_rule(
+            rule.category_id,
+            rule.match_type,
+            rule.pattern,
+            rule.min_amount,
+            rule.max_amount,
+            rule.account_id,
+            rule.priority
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Delete categorization rule
+@app.delete("/category_rules/{rule_id}")
+async def delete_category_rule(rule_id: int):
+    try:
+        return categorizer.categorizer.delete_rule(rule_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Re-categorize existing transactions with the rules (queued as a background job)
+@app.post("/category_rules/apply")
+async def apply_category_rules(recategorize: Recategorize):
+    try:
+        key = "uncategorized" if recategorize.only_uncategorized else "all"
+        job = job_queue.jobs.submit("recategorize", key, lambda job: categorizer.categorizer.recategorize(
+            recategorize.only_uncategorized,
+            recategorize.batch_size,
+            progress_callback=lambda rows: job_queue.jobs.report_progress(job, rows)
+        ))
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Get all tags
 @app.get("/tags")
 async def get_tags():
@@ -260,7 +428,36 @@ async def add_transaction(transaction: Transaction):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Get CSV files
+# Add transactions in bulk
+@app.post("/transactions/bulk")
+async def add_transactions(bulk: BulkTransactions):
+    try:
+        result = db_access.add_transactions([transaction.model_dump() for transaction in bulk.transactions])
+        return json.loads(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Update transactions in bulk (only the fields given are changed)
+@app.put("/transactions/bulk")
+async def update_transactions(bulk: BulkTransactionUpdates):
+    try:
+        result = db_access.update_transactions(
+            [transaction.model_dump(exclude_unset=True) for transaction in bulk.transactions]
+        )
+        return json.loads(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Delete transactions in bulk
+@app.post("/transactions/bulk/delete")
+async def delete_transactions(ids: TransactionIds):
+    try:
+        result = db_access.delete_transactions(ids.transaction_ids)
+        return json.loads(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get CSV files (in the CSV folder of the current ledger)
 @app.get("/csv_files")
 async def get_csv_files():
     try:
@@ -270,15 +467,287 @@ async def get_csv_files():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Load CSV file
+# Load CSV file (queued as a background import job)
 @app.post("/csv_files/{filename}")
 async def load_csv_file(filename: str):
     try:
-        result = db_access.load_csv_file(filename)
+        job = job_queue.jobs.submit_import(filename)
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get CSV folder watcher status
+@app.get("/csv_watcher")
+async def get_csv_watcher_status():
+    try:
+        return csv_watcher.watcher.status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Start the CSV folder watcher
+@app.post("/csv_watcher/start")
+async def start_csv_watcher_endpoint(use_polling: bool = False):
+    try:
+        csv_watcher.watcher.start(use_polling=use_polling)
+        return {"success": True, **csv_watcher.watcher.status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Stop the CSV folder watcher
+@app.post("/csv_watcher/stop")
+async def stop_csv_watcher_endpoint():
+    try:
+        csv_watcher.watcher.stop()
+        return {"success": True, **csv_watcher.watcher.status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get all background jobs
+@app.get("/jobs")
+async def get_jobs():
+    try:
+        return [job.to_dict() for job in job_queue.jobs.list_jobs()]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get a background job's status
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
+# Stream a background job's progress as server-sent events
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    job = job_queue.jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    async def event_stream():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"data: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                if job.finished:
+                    break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+# Stream the change events of the current ledger (or of all ledgers) as server-sent events.
+# Reconnecting clients send Last-Event-ID (EventSource does this itself) to get the events they missed.
+@app.get("/changes")
+async def stream_changes(request: Request, all_ledgers: bool = False, last_event_id: Optional[int] = None):
+    header_id = request.headers.get("Last-Event-ID")
+    if last_event_id is None and header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+    subscriber = change_feed.feed.subscribe(
+        None if all_ledgers else db_access.current_ledger.get(), last_event_id
+    )
+
+    async def event_stream():
+        try:
+            # The id of the first message lets EventSource resume from here after a reconnect
+            connected = {"type": "connected", "id": subscriber.start_id}
+            yield f"retry: 3000\nid: {subscriber.start_id}\ndata: {json.dumps(connected)}\n\n"
+            while not await request.is_disconnected():
+                message = await subscriber.get(timeout=15)
+                if message is None:
+                    # Keep proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                event_id = f"id: {message['id']}\n" if "id" in message else ""
+                yield f"{event_id}data: {json.dumps(message, ensure_ascii=False)}\n\n"
+        finally:
+            change_feed.feed.unsubscribe(subscriber)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Get the number of change feed subscribers and the last event id
+@app.get("/changes/status")
+async def get_change_feed_status():
+    try:
+        return change_feed.get_change_feed_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get import logs
+@app.get("/data_logs")
+async def get_data_logs():
+    try:
+        data_logs = db_access.get_data_logs()
+        return json.loads(data_logs)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Undo an import (optionally moving its file back from data/dust to data/csv)
+@app.delete("/data_logs/{log_id}")
+async def delete_data_log(log_id: int, restore_file: bool = False):
+    try:
+        result = db_access.delete_data_log(log_id, restore_file)
         return json.loads(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Get all ledgers
+@app.get("/ledgers")
+async def get_ledgers():
+    try:
+        return db_access.ledgers.list_ledgers()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Create a new, empty ledger
+@app.post("/ledgers")
+async def create_ledger(ledger: Ledger):
+    try:
+        db_access.ledgers.create(ledger.name)
+        return {"success": True, "name": ledger.name}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get all budgets
+@app.get("/budgets")
+async def get_budgets():
+    try:
+        return budgets.tracker.get_budgets()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Add a budget for a category, account or tag
+@app.post("/budgets")
+async def add_budget(budget: Budget):
+    try:
+        return budgets.tracker.add_budget(
+            budget.name,
+            budget.scope_type,
+            budget.scope_id,
+            budget.amount,
+            budget.period,
+            budget.alert_threshold
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get the spend of every budget for a month (the current month by default), with alerts
+@app.get("/budgets/status")
+async def get_budget_status(month: Optional[str] = None):
+    try:
+        return budgets.get_budget_status(month)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Recompute the budget counters from the transactions (runs as a background job)
+@app.post("/budgets/reconcile")
+async def reconcile_budgets(budget_id: Optional[int] = None):
+    try:
+        key = str(budget_id) if budget_id is not None else "all"
+        job = job_queue.jobs.submit("budget_reconcile", key, lambda job: budgets.reconcile_budgets(budget_id))
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Change the name, amount or alert threshold of a budget
+@app.put("/budgets/{budget_id}")
+async def update_budget(budget_id: int, budget: BudgetUpdate):
+    try:
+        return budgets.tracker.update_budget(budget_id, budget.name, budget.amount, budget.alert_threshold)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Delete a budget
+@app.delete("/budgets/{budget_id}")
+async def delete_budget(budget_id: int):
+    try:
+        return budgets.tracker.delete_budget(budget_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get the reporting currency, the loaded exchange rates and the rate CSV files in data/rates
+@app.get("/exchange_rates")
+async def get_exchange_rates():
+    try:
+        return currency.get_currency_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Convert all transactions to the reporting currency again (runs as a background job)
+@app.post("/exchange_rates/refresh")
+async def refresh_conversions():
+    try:
+        job = job_queue.jobs.submit("rates", "refresh", lambda job: currency.refresh_conversions())
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Load an exchange rate CSV file from data/rates (runs as a background job)
+@app.post("/exchange_rates/{filename}")
+async def load_exchange_rates(filename: str):
+    try:
+        job = job_queue.jobs.submit("rates", filename, lambda job: currency.load_rates(filename))
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get the archived years and their totals
+@app.get("/archive")
+async def get_archive_status():
+    try:
+        return archive.get_archive_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Move a closed year into its own archive file (runs as a background job)
+@app.post("/archive/{year}")
+async def archive_year(year: int):
+    try:
+        job = job_queue.jobs.submit("archive", str(year), lambda job: archive.archive_year(db_access.db, year))
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Move an archived year back into the main database (runs as a background job)
+@app.post("/archive/{year}/restore")
+async def restore_archived_year(year: int):
+    try:
+        job = job_queue.jobs.submit("restore", str(year), lambda job: archive.restore_year(db_access.db, year))
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get database size, fragmentation and snapshots
+@app.get("/maintenance")
+async def get_maintenance_status():
+    try:
+        return maintenance.get_maintenance_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Take a snapshot of the database into data/backup (runs as a background job)
+@app.post("/maintenance/snapshot")
+async def take_snapshot(pages_per_step: int = 256, keep: int = 10):
+    try:
+        job = maintenance.submit_snapshot(db_access.db, pages_per_step, keep)
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Run ANALYZE / PRAGMA optimize / incremental vacuum (runs as a background job)
+@app.post("/maintenance/optimize")
+async def optimize_database(analyze: bool = False, vacuum_pages: Optional[int] = None,
+                            enable_incremental_vacuum: bool = False):
+    try:
+        job = maintenance.submit_optimize(db_access.db, analyze, vacuum_pages, enable_incremental_vacuum)
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Get all SQL components
 @app.get("/sql_components")
 async def get_sql_components():
@@ -323,15 +792,85 @@ async def delete_sql_component(name: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Run several SQL components concurrently in one request (e.g. all dashboard tiles)
+# Plain def: it blocks until the components finish, so FastAPI runs it in its thread pool
+@app.post("/sql_components/run_batch")
+def run_sql_components(batch: SQLComponentBatch):
+    try:
+        result = db_access.run_sql_components([run.model_dump() for run in batch.components])
+        # Already JSON; returned as is instead of being parsed and serialized again
+        return Response(content=result, media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Run SQL component
 @app.post("/sql_components/{name}/run")
-async def run_sql_component(name: str, env_vars: Dict[str, str] = {}):
+async def run_sql_component(name: str, env_vars: Dict[str, str] = {}, max_points: Optional[int] = None):
     try:
-        result = db_access.run_sql_component(name, env_vars)
+        result = db_access.run_sql_component(name, env_vars, max_points)
         return json.loads(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Fully refresh a materialized SQL component
+@app.post("/sql_components/{name}/refresh")
+async def refresh_sql_component(name: str):
+    try:
+        return materialized.refresh_sql_component(name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get transaction totals grouped by e.g. month,category (from the in-memory ledger)
+@app.get("/analytics/totals")
+async def get_totals(group_by: str = "month,category", start: Optional[str] = None, end: Optional[str] = None,
+                     category_type: Optional[str] = None, account_id: Optional[int] = None):
+    try:
+        dimensions = [dimension for dimension in group_by.split(",") if dimension]
+        return compact_ledger.get_totals(dimensions, start, end, category_type, account_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get size and memory use of the in-memory ledger
+@app.get("/analytics/ledger")
+async def get_ledger_stats():
+    try:
+        return compact_ledger.get_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get detected recurring transactions (subscriptions, fixed costs)
+@app.get("/recurring")
+async def get_recurring(period: Optional[str] = None, min_confidence: float = 0.0, limit: int = 100):
+    try:
+        return recurring.get_recurring(period, min_confidence, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Rebuild recurring transaction detection from scratch (runs as a background job)
+@app.post("/recurring/rebuild")
+async def rebuild_recurring():
+    try:
+        job = job_queue.jobs.submit("recurring_rebuild", "all", lambda job: recurring.rebuild_recurring())
+        return {"success": True, "job_id": job.job_id, "status": job.status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Get the ledger context for a chat message
+@app.post("/chat/context")
+async def get_chat_context(chat_message: ChatMessage):
+    try:
+        return chat_context.get_chat_context(chat_message.message, chat_message.limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Answer a chat message (local stub model, works offline)
+@app.post("/chat")
+async def chat(chat_message: ChatMessage):
+    try:
+        return chat_context.chat(chat_message.message, chat_message.limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     # Register signal handlers for graceful shutdown
     signal.signal(signal.SIGINT, handle_exit)
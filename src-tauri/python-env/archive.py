@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+import os
+import re
+import datetime
+import contextlib
+
+import db_access
+
+# Date literals in a query, e.g. '2023', '2023-04', '2023-04-01' or '2023-%'
+_DATE_LITERAL_RE = re.compile(r"'(\d{4})((?:-\d{2}){0,2})([^']*)'")
+# What comes right before or after a date literal
+_OPERATOR_BEFORE_RE = re.compile(r"(>=|<=|<>|!=|==|=|<|>|\bBETWEEN|\bAND|\bLIKE|\bGLOB)\s*$", re.IGNORECASE)
+_OPERATOR_AFTER_RE = re.compile(r"^\s*(>=|<=|<>|!=|==|=|<|>)")
+# Words making the conditions more than one range; the bounds are not worked out then
+_UNBOUNDED_RE = re.compile(r"\b(OR|NOT)\b", re.IGNORECASE)
+# Operators with the literal on the left, seen from the column
+_FLIPPED = {">=": "<=", "<=": ">=", "<": ">", ">": "<", "=": "=", "==": "=="}
+
+
+def get_archive_path(db, year):
+    """Get the SQLite file holding an archived year of a ledger."""
+    return db.db_path.parent / 'archive' / f"{db.name}_{year}.sqlite"
+
+
+def _ensure_schema(db):
+    db.ensure_schema('archive.sql')
+    # Added after archived_totals was introduced
+    db.ensure_column('archived_totals', 'unconverted', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def get_archived_years(db):
+    """Get the archived years of a ledger, oldest first."""
+    _ensure_schema(db)
+    return db.execute_query("SELECT * FROM archived_years ORDER BY year")
+
+
+def _year_range(year):
+    return f"{year}-01-01", f"{year + 1}-01-01"
+
+
+def _columns(cursor, schema, table):
+    cursor.execute(f"PRAGMA {schema}.table_info({table})")
+    return [row['name'] for row in cursor.fetchall()]
+
+
+def archive_year(db, year):
+    """Move the transactions of a closed year into their own SQLite file.
+
+    The rows are copied to data/db/archive/{ledger}_{year}.sqlite first and
+    removed from the main database in a second transaction, together with
+    adding their monthly totals to archived_totals. (With WAL, one
+    transaction over attached databases is not atomic across the files.)
+    Both steps can be repeated safely, e.g. to archive rows added to the
+    year later.
+
+    Args:
+        db (DatabaseManager): The ledger
+        year (int): The year to archive; must be before the current year
+
+    Returns:
+        dict: Result of the operation
+    """
+    year = int(year)
+    if year >= datetime.date.today().year:
+        return {"success": False, "error": f"Only closed years can be archived ({year} is not over yet)"}
+
+    _ensure_schema(db)
+    start, end = _year_range(year)
+    in_year = "transaction_date >= ? AND transaction_date < ?"
+    path = get_archive_path(db, year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    conn = db.connect()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) AS count FROM main.transactions WHERE {in_year}", (start, end))
+    count = cursor.fetchone()['count']
+    if count == 0:
+        return {"success": False, "error": f"No transactions in {year}"}
+
+    # Step 1: copy into the archive file
+    cursor.execute("ATTACH DATABASE ? AS archive_target", (str(path),))
+    try:
+        try:
+            cursor.execute("BEGIN TRANSACTION")
+            cursor.execute("CREATE TABLE IF NOT EXISTS archive_target.transactions AS SELECT * FROM main.transactions WHERE 0")
+            cursor.execute("CREATE TABLE IF NOT EXISTS archive_target.transaction_tags AS SELECT * FROM main.transaction_tags WHERE 0")
+            cursor.execute("""
+            CREATE INDEX IF NOT EXISTS archive_target.idx_transactions_transaction_date
+            ON transactions(transaction_date)
+            """)
+
+            columns = ', '.join(_columns(cursor, 'archive_target', 'transactions'))
+            cursor.execute(f"""
+            INSERT INTO archive_target.transactions ({columns})
+            SELECT {columns} FROM main.transactions
+            WHERE {in_year}
+              AND transaction_id NOT IN (SELECT transaction_id FROM archive_target.transactions)
+            """, (start, end))
+            cursor.execute(f"""
+            INSERT INTO archive_target.transaction_tags (transaction_id, tag_id)
+            SELECT tt.transaction_id, tt.tag_id FROM main.transaction_tags tt
+            WHERE tt.transaction_id IN (SELECT transaction_id FROM main.transactions WHERE {in_year})
+              AND NOT EXISTS (
+                SELECT 1 FROM archive_target.transaction_tags a
+                WHERE a.transaction_id = tt.transaction_id AND a.tag_id = tt.tag_id
+              )
+            """, (start, end))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cursor.execute("DETACH DATABASE archive_target")
+
+    # Step 2: keep the totals and remove the rows from the main database
+    try:
+        cursor.execute("BEGIN TRANSACTION")
+        cursor.execute(f"""
+        INSERT INTO archived_totals (month, account_id, category_id, total, count, unconverted)
+        SELECT strftime('%Y-%m', transaction_date), account_id, category_id,
+               COALESCE(SUM(amount_reporting), 0), COUNT(amount_reporting), COUNT(*) - COUNT(amount_reporting)
+        FROM main.transactions
+        WHERE {in_year}
+        GROUP BY 1, 2, 3
+        ON CONFLICT(month, account_id, category_id) DO UPDATE SET
+            total = total + excluded.total,
+            count = count + excluded.count,
+            unconverted = unconverted + excluded.unconverted
+        """, (start, end))
+        cursor.execute(f"""
+        DELETE FROM main.transaction_tags
+        WHERE transaction_id IN (SELECT transaction_id FROM main.transactions WHERE {in_year})
+        """, (start, end))
+        cursor.execute(f"DELETE FROM main.transactions WHERE {in_year}", (start, end))
+        cursor.execute("""
+        INSERT INTO archived_years (year, file_name, transaction_count) VALUES (?, ?, ?)
+        ON CONFLICT(year) DO UPDATE SET
+            transaction_count = transaction_count + excluded.transaction_count,
+            archived_at = CURRENT_TIMESTAMP
+        """, (year, path.name, count))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # No months or account ids: the rows did not change, they moved, and listeners
+    # refreshing the touched months over the main database only would lose them
+    db.notify_change({"type": "year_archived", "year": year, "count": count})
+    return {"success": True, "year": year, "transactions_archived": count, "file_name": path.name}
+
+
+def restore_year(db, year):
+    """Move an archived year back into the main database and delete its archive file.
+
+    Args:
+        db (DatabaseManager): The ledger
+        year (int): The archived year
+
+    Returns:
+        dict: Result of the operation
+    """
+    year = int(year)
+    _ensure_schema(db)
+    if not db.execute_query("SELECT year FROM archived_years WHERE year = ?", (year,)):
+        return {"success": False, "error": f"{year} is not archived"}
+    path = get_archive_path(db, year)
+
+    conn = db.connect()
+    cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS archive_source", (str(path),))
+    try:
+        try:
+            cursor.execute("BEGIN TRANSACTION")
+            # Columns added to transactions after the year was archived are left at their defaults
+            archived_columns = set(_columns(cursor, 'archive_source', 'transactions'))
+            columns = ', '.join(c for c in _columns(cursor, 'main', 'transactions') if c in archived_columns)
+            cursor.execute(f"""
+            INSERT INTO main.transactions ({columns})
+            SELECT {columns} FROM archive_source.transactions
+            WHERE transaction_id NOT IN (SELECT transaction_id FROM main.transactions)
+            """)
+            count = cursor.rowcount
+            cursor.execute("""
+            INSERT OR IGNORE INTO main.transaction_tags (transaction_id, tag_id)
+            SELECT transaction_id, tag_id FROM archive_source.transaction_tags
+            """)
+            cursor.execute("DELETE FROM archived_totals WHERE month LIKE ?", (f"{year}-%",))
+            cursor.execute("DELETE FROM archived_years WHERE year = ?", (year,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cursor.execute("DETACH DATABASE archive_source")
+
+    os.remove(path)
+    db.notify_change({"type": "year_restored", "year": year, "count": count})
+    return {"success": True, "year": year, "transactions_restored": count}
+
+
+def _bounds(sql):
+    """Work out the first and last year the date conditions of a query can match.
+
+    Each date literal has to be compared with a comparison operator, BETWEEN
+    or LIKE; the lower bounds (>, >=, the start of BETWEEN) give the first
+    year and the upper bounds (<, <=, the end of BETWEEN) the last, and an
+    equality or LIKE bounds both. A bound that is missing is open.
+
+    Returns:
+        tuple: (first year or None, last year or None), or None if the
+            conditions cannot be worked out (e.g. OR, NOT, <> or a date in a function call)
+    """
+    if _UNBOUNDED_RE.search(sql):
+        return None
+    lower, upper = [], []
+    between = False
+    for match in _DATE_LITERAL_RE.finditer(sql):
+        year, rest = int(match.group(1)), match.group(2) + match.group(3)
+        before = _OPERATOR_BEFORE_RE.search(sql[:match.start()])
+        after = _OPERATOR_AFTER_RE.match(sql[match.end():])
+        keyword = before.group(1).upper() if before else None
+        if keyword == "BETWEEN":
+            lower.append(year)
+            between = True
+            continue
+        if keyword == "AND" and between:
+            upper.append(year)
+            between = False
+            continue
+        if keyword in ("LIKE", "GLOB"):
+            operator = "="
+        elif before and keyword != "AND":
+            operator = before.group(1)
+        elif after:
+            operator = _FLIPPED.get(after.group(1))
+        else:
+            return None
+        if operator in ("=", "=="):
+            lower.append(year)
+            upper.append(year)
+        elif operator in (">", ">="):
+            lower.append(year)
+        elif operator == "<=":
+            upper.append(year)
+        elif operator == "<":
+            # < '2024-01-01' ends in 2023
+            upper.append(year - 1 if rest in ("", "-01", "-01-01") else year)
+        else:
+            return None
+    first, last = (min(lower) if lower else None), (max(upper) if upper else None)
+    if first is not None and last is not None and first > last:
+        return None
+    return first, last
+
+
+def route(component, sql):
+    """Decide which archived years a query has to see.
+
+    Components declaring "history": true always see the full history.
+    Otherwise the date conditions in the SQL (after environment variables
+    are filled in) decide: `transaction_date >= '2023-04-01'` needs the
+    archived years from 2023 on, `transaction_date < '2023-01-01'` the ones
+    up to 2022 and a BETWEEN the years in between. A query without date
+    literals reads only the main database; one whose date conditions
+    cannot be worked out (see _bounds) sees every archived year.
+
+    Args:
+        component (dict): The SQL component
+        sql (str): The SQL to run
+
+    Returns:
+        list: The archived years to attach
+    """
+    archived = [row['year'] for row in get_archived_years(db_access.db)]
+    if not archived or component.get("history"):
+        return archived
+    if not _DATE_LITERAL_RE.search(sql):
+        return []
+    bounds = _bounds(sql)
+    if bounds is None:
+        return archived
+    first, last = bounds
+    return [year for year in archived
+            if (first is None or year >= first) and (last is None or year <= last)]
+
+
+@contextlib.contextmanager
+def history(db, years, read_only=False):
+    """Make `transactions` and `transaction_tags` include archived years, on this thread's connection.
+
+    The archive files are attached and temp views of the same names, which
+    resolve before the main tables, combine them with the main database.
+    Must be entered outside of a transaction.
+
+    Args:
+        db (DatabaseManager): The ledger
+        years (list): Archived years to include; an empty list changes nothing
+        read_only (bool): Set up the read-only query connection instead (see DatabaseManager.connect_read_only)
+    """
+    if not years:
+        yield
+        return
+
+    conn = db.connect_read_only() if read_only else db.connect()
+    cursor = conn.cursor()
+    aliases = []
+    try:
+        # The query itself still may not ATTACH or create anything
+        with db.unrestricted():
+            for year in years:
+                alias = f"archive_{int(year)}"
+                cursor.execute(f"ATTACH DATABASE ? AS {alias}", (str(get_archive_path(db, year)),))
+                aliases.append(alias)
+
+            for table in ("transactions", "transaction_tags"):
+                columns = _columns(cursor, 'main', table)
+                selects = [f"SELECT {', '.join(columns)} FROM main.{table}"]
+                for alias in aliases:
+                    archived_columns = set(_columns(cursor, alias, table))
+                    selects.append("SELECT " + ', '.join(
+                        column if column in archived_columns else f"NULL AS {column}" for column in columns
+                    ) + f" FROM {alias}.{table}")
+                cursor.execute(f"CREATE TEMP VIEW {table} AS\n" + "\nUNION ALL\n".join(selects))
+        yield
+    finally:
+        with db.unrestricted():
+            cursor.execute("DROP VIEW IF EXISTS temp.transactions")
+            cursor.execute("DROP VIEW IF EXISTS temp.transaction_tags")
+            for alias in aliases:
+                cursor.execute(f"DETACH DATABASE {alias}")
+
+
+def get_archive_status():
+    try:
+        db = db_access.db
+        years = get_archived_years(db)
+        totals = db.execute_query("""
+        SELECT substr(month, 1, 4) AS year, SUM(total) AS total, SUM(count) AS count,
+               SUM(unconverted) AS unconverted
+        FROM archived_totals GROUP BY 1 ORDER BY 1
+        """)
+        return {"success": True, "archived_years": years, "totals": totals}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
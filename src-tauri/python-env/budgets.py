@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+import re
+import datetime
+import threading
+
+import db_access
+import archive
+
+SCOPE_TYPES = {"category": "categories", "account": "accounts", "tag": "tags"}
+PERIODS = ("month", "year")
+
+# Alert levels, in increasing order
+LEVELS = ("ok", "warning", "over")
+
+_MONTH_RE = re.compile(r'^\d{4}-\d{2}$')
+
+
+def _counter_select(where, params, sign=1, budget_id=None):
+    """Build the SELECT of (budget_id, period_key, category_id, spent, count) for the transactions matching a WHERE clause.
+
+    Only expenses count: transactions in expense categories (imported rows
+    without a category are put in the expense or income 未分類 category by
+    the sign of their amount). Spent is the negated sum of
+    the amounts in the reporting currency per category, so a refund only
+    reduces the spend of its own category, and income or transfers on an
+    account or tag budget do not reduce it at all; `sign` -1 gives the
+    amounts to take off the counters. Transactions without a rate
+    (amount_reporting NULL) are left out rather than counted in their own currency.
+    """
+    budget_filter = "AND budget_id = ?" if budget_id is not None else ""
+    sql = f"""
+    WITH t AS (
+        SELECT transaction_id, transaction_date, amount_reporting AS amount, account_id, category_id
+        FROM transactions
+        WHERE ({where}) AND amount_reporting IS NOT NULL
+          AND category_id IN (SELECT category_id FROM categories WHERE type = 'expense')
+    )
+    SELECT budget_id,
+           CASE period WHEN 'year' THEN strftime('%Y', transaction_date)
+                       ELSE strftime('%Y-%m', transaction_date) END AS period_key,
+           category_id,
+           ? * -SUM(amount) AS spent,
+           ? * COUNT(*) AS count
+    FROM (
+        SELECT b.budget_id, b.period, t.transaction_date, t.category_id, t.amount
+        FROM t JOIN budgets b ON (b.scope_type = 'category' AND b.scope_id = t.category_id)
+                              OR (b.scope_type = 'account' AND b.scope_id = t.account_id)
+        UNION ALL
+        SELECT b.budget_id, b.period, t.transaction_date, t.category_id, t.amount
+        FROM t JOIN transaction_tags tt ON tt.transaction_id = t.transaction_id
+               JOIN budgets b ON b.scope_type = 'tag' AND b.scope_id = tt.tag_id
+    )
+    WHERE 1 {budget_filter}
+    GROUP BY 1, 2, 3
+    """
+    return sql, list(params) + [sign, sign] + ([budget_id] if budget_id is not None else [])
+
+
+def _level(spent, amount, alert_threshold):
+    if spent >= amount:
+        return "over"
+    if alert_threshold is not None and spent >= amount * alert_threshold:
+        return "warning"
+    return "ok"
+
+
+class BudgetTracker:
+    """Budgets per category, account or tag, with running spend counters.
+
+    budget_counters holds the spend of every budget, period and category
+    (budget_alerts the last reported level of a budget and period). A write
+    hook keeps it current in the same database transaction as the writes
+    to transactions, so the status of a budget is one lookup instead of a
+    sum over the period's transactions. reconcile() recomputes the
+    counters from the transactions (including archived years).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+
+    def _has_budgets(self, cursor):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'budgets'")
+        if cursor.fetchone() is None:
+            return False
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM budgets)")
+        return bool(cursor.fetchone()[0])
+
+    # Counters
+
+    def apply(self, cursor, where, params, sign):
+        """Write hook: add (sign 1) or take off (sign -1) the spend of the transactions matching a WHERE clause."""
+        if not self._has_budgets(cursor):
+            return
+        sql, sql_params = _counter_select(where, params, sign)
+        cursor.execute(f"""
+        INSERT INTO budget_counters (budget_id, period_key, category_id, spent, count)
+        {sql}
+        ON CONFLICT(budget_id, period_key, category_id) DO UPDATE SET
+            spent = spent + excluded.spent,
+            count = count + excluded.count
+        """, sql_params)
+
+    def reconcile(self, budget_id=None):
+        """Recompute the counters (of one budget, or all) from the transactions.
+
+        Archived years are included, so their spend is kept.
+
+        Args:
+            budget_id (int): The budget to recompute (None for all)
+
+        Returns:
+            dict: The number of counters and the ones that were off ("drift")
+        """
+        self.db.ensure_schema('budgets.sql')
+        years = [row['year'] for row in archive.get_archived_years(self.db)]
+        budget_filter = "WHERE budget_id = ?" if budget_id is not None else ""
+        budget_params = (budget_id,) if budget_id is not None else ()
+
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        with archive.history(self.db, years):
+            try:
+                # IMMEDIATE keeps writes (and their hooks) out until the counters are replaced
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(f"""
+                SELECT budget_id, period_key, category_id, spent, count FROM budget_counters {budget_filter}
+                """, budget_params)
+                old = {(row['budget_id'], row['period_key'], row['category_id']): (row['spent'], row['count'])
+                       for row in cursor.fetchall()}
+
+                sql, params = _counter_select("1", (), 1, budget_id)
+                cursor.execute(sql, params)
+                new = {(row['budget_id'], row['period_key'], row['category_id']): (row['spent'], row['count'])
+                       for row in cursor.fetchall()}
+
+                drift = []
+                for key in sorted(set(old) | set(new)):
+                    old_spent, old_count = old.get(key, (0, 0))
+                    new_spent, new_count = new.get(key, (0, 0))
+                    if abs(old_spent - new_spent) > 0.005 or old_count != new_count:
+                        drift.append({"budget_id": key[0], "period_key": key[1], "category_id": key[2],
+                                      "spent_before": old_spent, "spent": new_spent,
+                                      "count_before": old_count, "count": new_count})
+
+                cursor.execute(f"DELETE FROM budget_counters {budget_filter}", budget_params)
+                cursor.executemany("""
+                INSERT INTO budget_counters (budget_id, period_key, category_id, spent, count)
+                VALUES (?, ?, ?, ?, ?)
+                """, [key + (spent, count) for key, (spent, count) in new.items()])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return {"success": True, "counters": len(new), "drift": drift}
+
+    # Budgets
+
+    def get_budgets(self):
+        self.db.ensure_schema('budgets.sql')
+        return self.db.execute_query("""
+        SELECT b.*,
+               CASE b.scope_type
+                   WHEN 'category' THEN (SELECT name FROM categories WHERE category_id = b.scope_id)
+                   WHEN 'account' THEN (SELECT name FROM accounts WHERE account_id = b.scope_id)
+                   WHEN 'tag' THEN (SELECT name FROM tags WHERE tag_id = b.scope_id)
+               END AS scope_name
+        FROM budgets b
+        ORDER BY b.scope_type, b.name
+        """)
+
+    def add_budget(self, name, scope_type, scope_id, amount, period="month", alert_threshold=0.8):
+        """Add a budget and compute its counters from the existing transactions.
+
+        Args:
+            name (str): Display name
+            scope_type (str): category, account or tag
+            scope_id (int): The category_id, account_id or tag_id
+            amount (float): The budget per period (positive)
+            period (str): month or year
+            alert_threshold (float): Share of the amount from which the budget is reported as "warning"
+
+        Returns:
+            dict: Result of the operation
+        """
+        if scope_type not in SCOPE_TYPES:
+            return {"success": False, "error": f"scope_type must be one of {', '.join(SCOPE_TYPES)}"}
+        if period not in PERIODS:
+            return {"success": False, "error": f"period must be one of {', '.join(PERIODS)}"}
+        if amount is None or amount <= 0:
+            return {"success": False, "error": "amount must be positive"}
+        if alert_threshold is not None and not 0 < alert_threshold <= 1:
+            return {"success": False, "error": "alert_threshold must be between 0 and 1"}
+
+        self.db.ensure_schema('budgets.sql')
+        table = SCOPE_TYPES[scope_type]
+        if not self.db.execute_query(f"SELECT 1 FROM {table} WHERE {scope_type}_id = ?", (scope_id,)):
+            return {"success": False, "error": f"{scope_type} {scope_id} not found"}
+        try:
+            budget_id = self.db.insert_record("budgets", {
+                "name": name,
+                "scope_type": scope_type,
+                "scope_id": scope_id,
+                "period": period,
+                "amount": amount,
+                "alert_threshold": alert_threshold
+            })
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        result = self.reconcile(budget_id)
+        self.db.notify_change({"type": "budget_added", "table": "budgets", "budget_id": budget_id})
+        return {"success": True, "budget_id": budget_id, "counters": result["counters"]}
+
+    def update_budget(self, budget_id, name=None, amount=None, alert_threshold=None):
+        """Change the name, amount or alert threshold of a budget (the counters stay valid)."""
+        if amount is not None and amount <= 0:
+            return {"success": False, "error": "amount must be positive"}
+        if alert_threshold is not None and not 0 < alert_threshold <= 1:
+            return {"success": False, "error": "alert_threshold must be between 0 and 1"}
+        fields = {key: value for key, value in
+                  (("name", name), ("amount", amount), ("alert_threshold", alert_threshold)) if value is not None}
+        if not fields:
+            return {"success": True, "updated": 0}
+
+        self.db.ensure_schema('budgets.sql')
+        assignments = ', '.join(f"{field} = ?" for field in fields)
+        try:
+            updated = self.db.execute_update(f"UPDATE budgets SET {assignments} WHERE budget_id = ?",
+                                             list(fields.values()) + [budget_id])
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        if not updated:
+            return {"success": False, "error": f"Budget not found: {budget_id}"}
+        self.db.notify_change({"type": "budget_updated", "table": "budgets", "budget_id": budget_id})
+        return {"success": True, "updated": updated}
+
+    def delete_budget(self, budget_id):
+        self.db.ensure_schema('budgets.sql')
+        try:
+            # The counters go with it (ON DELETE CASCADE)
+            deleted = self.db.delete_record("budgets", "budget_id", budget_id)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        if deleted:
+            self.db.notify_change({"type": "budget_deleted", "table": "budgets", "budget_id": budget_id})
+        return {"success": True}
+
+    # Status
+
+    def status(self, month=None):
+        """Get the spend of every budget in the period containing a month.
+
+        Reads the counters of each budget's categories, however many
+        transactions the period has. A category whose refunds exceed its
+        expenses counts as 0, so it does not hide spend in the others.
+
+        Args:
+            month (str): YYYY-MM (the current month by default); year budgets use its year
+
+        Returns:
+            dict: The budgets with spent, remaining, ratio and level (ok, warning or over),
+                and the budgets at warning or over as "alerts"
+        """
+        month = month or datetime.date.today().strftime('%Y-%m')
+        if not _MONTH_RE.match(month):
+            raise ValueError(f"Invalid month '{month}' (expected YYYY-MM)")
+        year = month[:4]
+
+        budgets = self.get_budgets()
+        counters = {
+            (row['budget_id'], row['period_key']): row
+            for row in self.db.execute_query(
+                """
+                SELECT budget_id, period_key, SUM(MAX(spent, 0)) AS spent, SUM(count) AS count
+                FROM budget_counters WHERE period_key IN (?, ?)
+                GROUP BY budget_id, period_key
+                """,
+                (month, year)
+            )
+        }
+
+        for budget in budgets:
+            budget["period_key"] = year if budget["period"] == "year" else month
+            counter = counters.get((budget["budget_id"], budget["period_key"]))
+            budget["spent"] = counter["spent"] if counter else 0.0
+            budget["count"] = counter["count"] if counter else 0
+            budget["remaining"] = budget["amount"] - budget["spent"]
+            budget["ratio"] = round(budget["spent"] / budget["amount"], 4) if budget["amount"] else None
+            budget["level"] = _level(budget["spent"], budget["amount"], budget["alert_threshold"])
+
+        return {
+            "month": month,
+            "budgets": budgets,
+            "alerts": [budget for budget in budgets if budget["level"] != "ok"]
+        }
+
+    def on_change(self, event):
+        """Change listener: report budgets that reached their alert threshold or went over.
+
+        The last reported level is kept per budget and period, so each crossing is
+        reported once (and again after spend dropped below it).
+        """
+        months = event.get("months") or []
+        if not months:
+            return
+        conn = self.db.connect()
+        with self._lock:
+            if not self._has_budgets(conn.cursor()):
+                return
+            keys = sorted(set(months) | {month[:4] for month in months})
+            placeholders = ', '.join(['?' for _ in keys])
+            rows = self.db.execute_query(f"""
+            SELECT c.budget_id, c.period_key, SUM(MAX(c.spent, 0)) AS spent,
+                   COALESCE(a.alert_level, 'ok') AS alert_level, b.name, b.amount, b.alert_threshold
+            FROM budget_counters c JOIN budgets b ON b.budget_id = c.budget_id
+            LEFT JOIN budget_alerts a ON a.budget_id = c.budget_id AND a.period_key = c.period_key
+            WHERE c.period_key IN ({placeholders})
+            GROUP BY c.budget_id, c.period_key
+            """, keys)
+
+            alerts = []
+            changed = []
+            for row in rows:
+                level = _level(row['spent'], row['amount'], row['alert_threshold'])
+                if level == row['alert_level']:
+                    continue
+                changed.append((row['budget_id'], row['period_key'], level))
+                if LEVELS.index(level) > LEVELS.index(row['alert_level']):
+                    alerts.append({
+                        "type": "budget_alert",
+                        "table": "budgets",
+                        "budget_id": row['budget_id'],
+                        "name": row['name'],
+                        "period_key": row['period_key'],
+                        "level": level,
+                        "spent": row['spent'],
+                        "amount": row['amount']
+                    })
+            if changed:
+                conn.executemany("""
+                INSERT INTO budget_alerts (budget_id, period_key, alert_level) VALUES (?, ?, ?)
+                ON CONFLICT(budget_id, period_key) DO UPDATE SET alert_level = excluded.alert_level
+                """, changed)
+                conn.commit()
+
+        for alert in alerts:
+            self.db.notify_change(alert)
+
+
+# Create a global instance for easy access
+tracker = db_access.PerLedger(BudgetTracker)
+db_access.db.add_write_hook(lambda cursor, where, params, sign: tracker.apply(cursor, where, params, sign))
+db_access.db.add_change_listener(lambda event: tracker.on_change(event))
+
+
+def _migrate_counters(db):
+    """Replace budget counters of the layout without categories (they are recomputed, alert levels start over)."""
+    columns = db.execute_query("PRAGMA table_info(budget_counters)")
+    if not columns or 'category_id' in {column['name'] for column in columns}:
+        return
+    conn = db.connect()
+    conn.execute("DROP TABLE budget_counters")
+    conn.commit()
+    db.ensure_schema('budgets.sql')
+    tracker.get(db.name).reconcile()
+
+
+db_access.db.add_initializer(_migrate_counters)
+
+
+def get_budget_status(month=None):
+    try:
+        return {"success": True, **tracker.status(month)}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def reconcile_budgets(budget_id=None):
+    try:
+        return tracker.reconcile(budget_id)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
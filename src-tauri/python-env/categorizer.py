@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+import re
+import threading
+import unicodedata
+from collections import deque
+
+import db_access
+
+UNCATEGORIZED_NAME = db_access.UNCATEGORIZED_NAME
+
+MATCH_TYPES = ("keyword", "regex", "amount")
+
+# Backreferences (\1, \g<1>, (?P=name)) and named groups: in the combined alternation the
+# group numbers shift and names can clash, so these regexes are matched on their own
+_STANDALONE_REGEX_RE = re.compile(r'\\(?:[1-9]|g<)|\(\?P[<=]')
+# Runs of non-ASCII characters in a regex; the regex syntax itself is all ASCII, so these are literals
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]+')
+
+
+def normalize_text(text):
+    """Normalize text for matching (full-width/half-width and case insensitive)."""
+    return unicodedata.normalize('NFKC', text or "").lower()
+
+
+def normalize_pattern(pattern):
+    """Normalize the literals of a regex like normalize_text, so it matches normalized text.
+
+    Only the non-ASCII characters change (ｶｰﾄﾞ becomes カード, ２０２４ becomes
+    2024). Any that turn into a regex metacharacter, like （ into (, are
+    escaped to stay literals. Case is left to re.IGNORECASE.
+    """
+    return _NON_ASCII_RE.sub(lambda match: re.escape(unicodedata.normalize('NFKC', match.group())), pattern)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: finds every keyword occurring in a text in one pass."""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._built = False
+
+    def add(self, keyword, value):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(value)
+        self._built = False
+
+    def build(self):
+        # Breadth-first, so a state's failure link is final before its children use it
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+        self._built = True
+
+    def find(self, text):
+        """Get the values of all keywords occurring in text."""
+        if not self._built:
+            self.build()
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                found.update(self._output[state])
+        return found
+
+
+class CompiledRules:
+    """All categorization rules compiled for matching many rows.
+
+    Keywords go into one Aho-Corasick automaton and regexes into one
+    alternation, so each row is scanned once however many rules there are.
+    Regexes with backreferences or named groups are matched one by one.
+    Amount and account conditions are checked only for the rules whose text
+    pattern matched. Like the text, keywords and the literals of regexes
+    are NFKC-normalized.
+    """
+
+    def __init__(self, rules):
+        self.rules = {rule['rule_id']: rule for rule in rules}
+        self.automaton = KeywordAutomaton()
+        self.always = []  # rules without a text pattern
+        regex_rules = []
+
+        for rule in rules:
+            if rule['match_type'] == 'keyword' and rule['pattern']:
+                self.automaton.add(normalize_text(rule['pattern']), rule['rule_id'])
+            elif rule['match_type'] == 'regex' and rule['pattern']:
+                regex_rules.append(rule)
+            else:
+                self.always.append(rule['rule_id'])
+        self.automaton.build()
+
+        # Higher priority first, so at a given position the preferred rule is the one that matches
+        regex_rules.sort(key=lambda rule: (rule['priority'], rule['rule_id']))
+        patterns = {rule['rule_id']: normalize_pattern(rule['pattern']) for rule in regex_rules}
+        self.regexes = {rule_id: re.compile(pattern, re.IGNORECASE) for rule_id, pattern in patterns.items()}
+        self.standalone = [rule_id for rule_id, pattern in patterns.items() if _STANDALONE_REGEX_RE.search(pattern)]
+        combinable = [rule_id for rule_id in patterns if rule_id not in self.standalone]
+        try:
+            # Lookahead so that matches can overlap
+            self.combined = re.compile(
+                '|'.join(f"(?=(?P<r{rule_id}>{patterns[rule_id]}))" for rule_id in combinable),
+                re.IGNORECASE
+            ) if combinable else None
+        except re.error:
+            # e.g. a pattern with inline flags; fall back to one regex per rule
+            self.combined = None
+
+    def _accepts(self, rule, account_id, amount):
+        if rule['account_id'] is not None and rule['account_id'] != account_id:
+            return False
+        if rule['min_amount'] is not None and amount < rule['min_amount']:
+            return False
+        if rule['max_amount'] is not None and amount > rule['max_amount']:
+            return False
+        return True
+
+    def _best(self, rule_ids, account_id, amount):
+        candidates = [self.rules[rule_id] for rule_id in rule_ids]
+        candidates = [rule for rule in candidates if self._accepts(rule, account_id, amount)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda rule: (rule['priority'], rule['rule_id']))
+
+    def match(self, account_id, amount, *texts):
+        """Find the best rule for a transaction.
+
+        Args:
+            account_id (int): The account of the transaction
+            amount (float): The amount of the transaction
+            *texts (str): item_name, description, memo, ...
+
+        Returns:
+            dict: The matching rule with the highest priority, or None
+        """
+        text = normalize_text(' '.join(filter(None, texts)))
+        matched = self.automaton.find(text)
+        matched.update(self.always)
+
+        if self.combined is not None:
+            regex_matched = set()
+            for found in self.combined.finditer(text):
+                regex_matched.update(int(name[1:]) for name, value in found.groupdict().items() if value is not None)
+            regex_matched.update(rule_id for rule_id in self.standalone if self.regexes[rule_id].search(text))
+            # Only the highest priority regex is reported per position; if one of those fails its
+            # amount/account condition, a lower priority one at the same position may still apply
+            if any(not self._accepts(self.rules[rule_id], account_id, amount) for rule_id in regex_matched):
+                regex_matched = {rule_id for rule_id, regex in self.regexes.items() if regex.search(text)}
+        else:
+            regex_matched = {rule_id for rule_id, regex in self.regexes.items() if regex.search(text)}
+
+        return self._best(matched | regex_matched, account_id, amount)
+
+    def categorize(self, account_id, amount, *texts):
+        """Get the category_id for a transaction, or None if no rule matches."""
+        rule = self.match(account_id, amount, *texts)
+        return rule['category_id'] if rule else None
+
+
+class Categorizer:
+    """Categorization rules stored in category_rules, compiled once and reused until they change."""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._compiled = None
+
+    def compile(self):
+        """Get the compiled rules. Must not be called inside a transaction the first time (creates the table)."""
+        with self._lock:
+            if self._compiled is None:
+                self.db.ensure_schema('category_rules.sql')
+                rules = self.db.execute_query("SELECT * FROM category_rules")
+                self._compiled = CompiledRules(rules)
+            return self._compiled
+
+    def invalidate(self):
+        with self._lock:
+            self._compiled = None
+
+    def get_rules(self):
+        self.db.ensure_schema('category_rules.sql')
+        return self.db.execute_query("""
+        SELECT r.*, c.name AS category_name, c.type AS category_type
+        FROM category_rules r
+        JOIN categories c ON r.category_id = c.category_id
+        ORDER BY r.priority, r.rule_id
+        """)
+
+    def add_rule(self, category_id, match_type="keyword", pattern=None, min_amount=None,
+                 max_amount=None, account_id=None, priority=100):
+        if match_type not in MATCH_TYPES:
+            return {"success": False, "error": f"match_type must be one of {', '.join(MATCH_TYPES)}"}
+        if match_type in ("keyword", "regex") and not pattern:
+            return {"success": False, "error": f"pattern is required for {match_type} rules"}
+        if match_type == "regex":
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                return {"success": False, "error": f"Invalid regular expression: {str(e)}"}
+
+        self.db.ensure_schema('category_rules.sql')
+        try:
+            rule_id = self.db.insert_record("category_rules", {
+                "category_id": category_id,
+                "match_type": match_type,
+                "pattern": pattern,
+                "min_amount": min_amount,
+                "max_amount": max_amount,
+                "account_id": account_id,
+                "priority": priority
+            })
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        self.invalidate()
+        return {"success": True, "rule_id": rule_id}
+
+    def delete_rule(self, rule_id):
+        self.db.ensure_schema('category_rules.sql')
+        try:
+            self.db.delete_record("category_rules", "rule_id", rule_id)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        self.invalidate()
+        return {"success": True}
+
+    def recategorize(self, only_uncategorized=True, batch_size=1000, progress_callback=None):
+        """Rewrite category_id of existing transactions from the rules, in batches.
+
+        Args:
+            only_uncategorized (bool): Only touch transactions in the 未分類 categories
+            batch_size (int): Number of transactions read and updated per transaction
+            progress_callback (callable): Optional function called with the number of rows processed so far
+
+        Returns:
+            dict: Result of the operation
+        """
+        compiled = self.compile()
+        conn = self.db.connect()
+        cursor = conn.cursor()
+
+        where = "t.transaction_id > ?"
+        if only_uncategorized:
+            where += " AND t.category_id IN (SELECT category_id FROM categories WHERE name = ?)"
+
+        rows_processed = 0
+        rows_updated = 0
+        months = set()
+        account_ids = set()
+        last_transaction_id = 0
+
+        while True:
+            params = [last_transaction_id] + ([UNCATEGORIZED_NAME] if only_uncategorized else [])
+            cursor.execute(f"""
+            SELECT t.transaction_id, t.account_id, t.category_id, t.amount, t.item_name, t.description,
+                   t.memo, strftime('%Y-%m', t.transaction_date) AS month
+            FROM transactions t
+            WHERE {where}
+            ORDER BY t.transaction_id
+            LIMIT ?
+            """, params + [batch_size])
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for row in rows:
+                category_id = compiled.categorize(row['account_id'], row['amount'],
+                                                  row['item_name'], row['description'], row['memo'])
+                if category_id is not None and category_id != row['category_id']:
+                    updates.append((category_id, row['transaction_id']))
+                    months.add(row['month'])
+                    account_ids.add(row['account_id'])
+
+            if updates:
+                try:
+                    # IMMEDIATE: the write hooks read before the UPDATE writes, and a deferred
+                    # transaction fails with "database is locked" if an import commits in between
+                    cursor.execute("BEGIN IMMEDIATE")
+                    updated_ids = [transaction_id for _, transaction_id in updates]
+                    self.db.run_write_hooks_ids(cursor, updated_ids, -1)
+                    cursor.executemany("UPDATE transactions SET category_id = ? WHERE transaction_id = ?", updates)
+                    self.db.run_write_hooks_ids(cursor, updated_ids, 1)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+            rows_processed += len(rows)
+            rows_updated += len(updates)
+            last_transaction_id = rows[-1]['transaction_id']
+            if progress_callback:
+                progress_callback(rows_processed)
+
+        if rows_updated:
+            self.db.notify_change({
+                "type": "recategorized",
+                "months": sorted(months),
+                "account_ids": sorted(account_ids)
+            })
+        return {"success": True, "rows_processed": rows_processed, "rows_updated": rows_updated}
+
+
+# Create a global instance for easy access
+categorizer = db_access.PerLedger(Categorizer)
+db_access.db.set_categorizer(lambda: categorizer.compile())
+
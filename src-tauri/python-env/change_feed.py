@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+
+import db_access
+
+# Tables whose changes are published; SQL components reading them are listed in each event
+TABLES = ("transactions", "accounts", "categories", "tags", "budgets")
+
+# Longest list of transaction ids sent with an event; larger writes (imports) only send the count
+MAX_TRANSACTION_IDS = 100
+
+
+class _Subscriber:
+    def __init__(self, loop, ledger, queue_size):
+        self.loop = loop
+        self.ledger = ledger
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.start_id = None
+
+    def put(self, message):
+        # Runs on the event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # The client is too slow; it gets a reset and has to reload everything
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "reset", "reason": "overflow"})
+
+    async def get(self, timeout=None):
+        """Wait for the next message (None after `timeout` seconds without one)."""
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message["type"] == "reset":
+            self.overflowed = False
+        return message
+
+
+class ChangeFeed:
+    """Publish the change events of all ledgers to connected clients.
+
+    Change listeners run on the thread that did the write (an API worker
+    thread, the job queue, the CSV watcher), so each event is handed to the
+    subscribers' asyncio queues with loop.call_soon_threadsafe. Events are
+    numbered, and the most recent ones are kept so a client reconnecting
+    with the last id it saw gets what it missed; if that is no longer
+    available it gets a "reset" event instead.
+    """
+
+    def __init__(self, history=500, queue_size=1000):
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_id = 0
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, event):
+        """Number an event and send it to the subscribers of its ledger.
+
+        Args:
+            event (dict): The change event (see DatabaseManager.add_change_listener)
+
+        Returns:
+            dict: The message sent to clients
+        """
+        message = _to_message(event)
+        with self._lock:
+            self._last_id += 1
+            message["id"] = self._last_id
+            self._history.append(message)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            if subscriber.ledger is not None and subscriber.ledger != message["ledger"]:
+                continue
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, message)
+            except RuntimeError:
+                # The event loop is closed
+                self.unsubscribe(subscriber)
+        return message
+
+    def subscribe(self, ledger=None, last_event_id=None):
+        """Start receiving events. Must be called on the event loop that reads them.
+
+        Args:
+            ledger (str): Only events of this ledger (None for all ledgers)
+            last_event_id (int): The last event id the client saw; the events after it are replayed
+
+        Returns:
+            _Subscriber: Read messages with its get(); pass it to unsubscribe when done
+        """
+        subscriber = _Subscriber(asyncio.get_running_loop(), ledger, self.queue_size)
+        with self._lock:
+            if last_event_id is not None and last_event_id < self._last_id:
+                missed = [message for message in self._history if message["id"] > last_event_id]
+                if not missed or missed[0]["id"] != last_event_id + 1:
+                    subscriber.put({"type": "reset", "reason": "history"})
+                else:
+                    for message in missed:
+                        if ledger is None or message["ledger"] == ledger:
+                            subscriber.put(message)
+            subscriber.start_id = self._last_id
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def status(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "last_id": self._last_id,
+                "history": len(self._history)
+            }
+
+
+# The names of the components reading each table, kept until a component is saved or deleted
+_components_by_table = {}
+_components_lock = threading.Lock()
+_components_generation = 0
+
+
+def _components_reading(table):
+    """Get the names of the SQL components whose SQL mentions a table."""
+    with _components_lock:
+        names = _components_by_table.get(table)
+        generation = _components_generation
+    if names is not None:
+        return list(names)
+
+    pattern = re.compile(rf"\b{table}\b", re.IGNORECASE)
+    names = []
+    for item in db_access.get_sql_components():
+        result = db_access.get_sql_component(item["name"])
+        if result.get("success") and pattern.search(result["component"].get("sql") or ""):
+            names.append(item["name"])
+    names.sort()
+    with _components_lock:
+        # Not kept if a component changed while the files were read
+        if generation == _components_generation:
+            _components_by_table[table] = names
+    return list(names)
+
+
+def _forget_components(name):
+    global _components_generation
+    with _components_lock:
+        _components_generation += 1
+        _components_by_table.clear()
+
+
+def _to_message(event):
+    message = {key: value for key, value in event.items() if key != "transaction_ids"}
+    message["ledger"] = db_access.current_ledger.get()
+    message["table"] = event.get("table", "transactions")
+    message["time"] = time.time()
+    transaction_ids = event.get("transaction_ids")
+    if transaction_ids is not None:
+        message["count"] = len(transaction_ids)
+        if len(transaction_ids) <= MAX_TRANSACTION_IDS:
+            message["transaction_ids"] = transaction_ids
+    months = event.get("months")
+    if months:
+        message["first_month"], message["last_month"] = months[0], months[-1]
+    try:
+        message["components"] = _components_reading(message["table"])
+    except Exception as e:
+        print(f"Error listing components for {event.get('type')}: {str(e)}")
+    return message
+
+
+# Create a global instance for easy access
+feed = ChangeFeed()
+db_access.db.add_change_listener(lambda event: feed.publish(event), tables=TABLES)
+db_access.add_component_listener(_forget_components)
+
+
+def get_change_feed_status():
+    try:
+        return {"success": True, **feed.status()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+import re
+import math
+import time
+import threading
+from collections import defaultdict
+
+import db_access
+import recurring
+import compact_ledger
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+# Hiragana, katakana and kanji runs; Japanese has no spaces, so these are indexed as character bigrams
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]+')
+
+
+def tokenize(text):
+    """Split text into index tokens: lowercase ASCII words plus CJK character bigrams."""
+    if not text:
+        return []
+    text = text.lower()
+    tokens = _WORD_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class ChatContextEngine:
+    """Compact ledger context for the AI chat.
+
+    Keeps precomputed summaries (monthly totals per category, top merchants,
+    recurring payments) and an in-memory BM25 keyword index over the text of
+    each transaction, so a chat turn can fetch the most relevant rows without
+    dumping the ledger through /execute_sql.
+    """
+
+    def __init__(self, db, summary_months=12, top_merchants=20):
+        self.db = db
+        self.summary_months = summary_months
+        self.top_merchants = top_merchants
+        self._lock = threading.Lock()
+        self._summaries = None
+        # token -> {transaction_id: term frequency}
+        self._postings = None
+        self._doc_lengths = {}
+        # transaction_id -> (month, set of tokens), to take a row out of the postings again
+        self._documents = {}
+        self._total_length = 0
+        self._max_transaction_id = 0
+
+    def invalidate(self):
+        """Drop everything; it is rebuilt on the next request."""
+        with self._lock:
+            self._summaries = None
+            self._postings = None
+
+    def on_change(self, event):
+        """Change listener: reindex the rows touched by a write and recompute summaries lazily.
+
+        New rows are indexed, rows named by the event's transaction ids are
+        reindexed, and writes without ids (undone imports, recategorized or
+        archived rows) reindex the months they touched.
+        """
+        with self._lock:
+            self._summaries = None
+            if self._postings is None:
+                return
+            event_type = event.get("type")
+            if event_type in ("import", "transaction_added"):
+                self._index_new_rows()
+            elif event_type == "rates_updated":
+                # Only amounts were converted; the indexed text is unchanged
+                pass
+            elif event.get("transaction_ids") is not None:
+                self._reindex_ids(event["transaction_ids"])
+            elif event_type in ("year_archived", "year_restored"):
+                self._reindex_months([f"{event['year']}-{month:02d}" for month in range(1, 13)])
+            elif event.get("months") is not None:
+                self._reindex_months(event["months"])
+            else:
+                self._postings = None
+
+    # Keyword index
+
+    def _ensure_index(self):
+        if self._postings is None:
+            self._postings = defaultdict(dict)
+            self._doc_lengths = {}
+            self._documents = {}
+            self._total_length = 0
+            self._max_transaction_id = 0
+            self._index_new_rows()
+
+    def _index_new_rows(self):
+        self._index_rows("t.transaction_id > ?", (self._max_transaction_id,))
+
+    def _reindex_ids(self, transaction_ids):
+        for start in range(0, len(transaction_ids), 500):
+            chunk = transaction_ids[start:start + 500]
+            self._remove(chunk)
+            self._index_rows(f"t.transaction_id IN ({', '.join(['?' for _ in chunk])})", chunk)
+
+    def _reindex_months(self, months):
+        months = set(months)
+        self._remove([transaction_id for transaction_id, (month, tokens) in self._documents.items()
+                      if month in months])
+        for month in sorted(months):
+            year, mon = int(month[:4]), int(month[5:7])
+            next_month = f"{year + 1}-01" if mon == 12 else f"{year}-{mon + 1:02d}"
+            # Date ranges instead of strftime() so the index on transaction_date can be used
+            self._index_rows("t.transaction_date >= ? AND t.transaction_date < ?",
+                             (f"{month}-01", f"{next_month}-01"))
+
+    def _remove(self, transaction_ids):
+        for transaction_id in transaction_ids:
+            document = self._documents.pop(transaction_id, None)
+            if document is None:
+                continue
+            for token in document[1]:
+                postings = self._postings[token]
+                postings.pop(transaction_id, None)
+                if not postings:
+                    del self._postings[token]
+            self._total_length -= self._doc_lengths.pop(transaction_id)
+
+    def _index_rows(self, where, params):
+        rows = self.db.execute_query(f"""
+        SELECT t.transaction_id, strftime('%Y-%m', t.transaction_date) AS month,
+               t.item_name, t.description, t.memo,
+               a.name AS account_name, c.name AS category_name,
+               (SELECT GROUP_CONCAT(tg.name, ' ') FROM transaction_tags tt
+                JOIN tags tg ON tt.tag_id = tg.tag_id
+                WHERE tt.transaction_id = t.transaction_id) AS tag_names
+        FROM transactions t
+        JOIN accounts a ON t.account_id = a.account_id
+        JOIN categories c ON t.category_id = c.category_id
+        WHERE {where}
+        ORDER BY t.transaction_id
+        """, params)
+
+        for row in rows:
+            transaction_id = row['transaction_id']
+            text = ' '.join(filter(None, [
+                row['item_name'], row['description'], row['memo'],
+                row['account_name'], row['category_name'], row['tag_names']
+            ]))
+            tokens = tokenize(text)
+            for token in tokens:
+                postings = self._postings[token]
+                postings[transaction_id] = postings.get(transaction_id, 0) + 1
+            self._documents[transaction_id] = (row['month'], frozenset(tokens))
+            self._doc_lengths[transaction_id] = len(tokens)
+            self._total_length += len(tokens)
+            self._max_transaction_id = max(self._max_transaction_id, transaction_id)
+
+    def search(self, query, limit=200):
+        """Find the transactions most relevant to a query.
+
+        Args:
+            query (str): Free text, e.g. the user's chat message
+            limit (int): Maximum number of transactions to return
+
+        Returns:
+            list: Transactions (dicts) ordered by relevance, each with a "score"
+        """
+        with self._lock:
+            self._ensure_index()
+            doc_count = len(self._doc_lengths)
+            if doc_count == 0:
+                return []
+            avg_length = self._total_length / doc_count
+
+            scores = defaultdict(float)
+            for token in set(tokenize(query)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for transaction_id, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[transaction_id] / avg_length)
+                    scores[transaction_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[:limit]
+        if not top:
+            return []
+
+        rows = self.db.execute_query(f"""
+        SELECT t.transaction_id, t.transaction_date, t.amount, t.item_name, t.description, t.memo,
+               a.name AS account_name, c.type AS category_type, c.name AS category_name
+        FROM transactions t
+        JOIN accounts a ON t.account_id = a.account_id
+        JOIN categories c ON t.category_id = c.category_id
+        WHERE t.transaction_id IN ({', '.join(['?' for _ in top])})
+        """, [transaction_id for transaction_id, score in top])
+        by_id = {row['transaction_id']: row for row in rows}
+
+        results = []
+        for transaction_id, score in top:
+            row = by_id.get(transaction_id)
+            if row:
+                row['score'] = round(score, 4)
+                results.append(row)
+        return results
+
+    # Summaries
+
+    def summaries(self):
+        """Get the precomputed ledger summaries.
+
+        Returns:
+            dict: {"monthly_category_totals": [...], "top_merchants": [...], "recurring_payments": [...]}
+        """
+        with self._lock:
+            if self._summaries is None:
+                self._summaries = self._build_summaries()
+            return self._summaries
+
+    def _build_summaries(self):
+        ledger = compact_ledger.ledger.get(self.db.name)
+        totals = ledger.totals(("month", "category"))
+        recent_months = sorted({row['month'] for row in totals}, reverse=True)[:self.summary_months]
+        monthly_category_totals = sorted(
+            (row for row in totals if row['month'] in recent_months),
+            key=lambda row: (row['month'], -row['total']), reverse=True
+        )
+        for row in monthly_category_totals:
+            del row['category_id']
+
+        top_merchant_rows = ledger.top_items(self.top_merchants)
+
+        recurring_payments = recurring.detector.get_series(min_confidence=0.5, limit=50)
+
+        return {
+            "monthly_category_totals": monthly_category_totals,
+            "top_merchants": top_merchant_rows,
+            "recurring_payments": recurring_payments
+        }
+
+    def build_context(self, question, limit=200):
+        """Build the context for one chat turn.
+
+        Args:
+            question (str): The user's message
+            limit (int): Maximum number of transactions to include
+
+        Returns:
+            dict: {"summaries": ..., "transactions": [...], "elapsed_ms": float}
+        """
+        start = time.perf_counter()
+        summaries = self.summaries()
+        transactions = self.search(question, limit)
+        return {
+            "summaries": summaries,
+            "transactions": transactions,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+
+class StubChatModel:
+    """Offline stand-in for a chat model.
+
+    Answers from the context alone, so the chat works without network access.
+    A real model only needs the same reply(question, context) method.
+    """
+
+    name = "local-stub"
+
+    def reply(self, question, context):
+        transactions = context["transactions"]
+        if not transactions:
+            return "ご質問に関連する取引は見つかりませんでした。品目名やカテゴリ名を含めて質問してみてください。"
+
+        total = sum(row['amount'] for row in transactions)
+        months = sorted({str(row['transaction_date'])[:7] for row in transactions})
+        lines = [
+            f"関連する取引が{len(transactions)}件見つかりました（{months[0]}〜{months[-1]}）。",
+            f"合計金額は¥{total:,.0f}です。",
+            "主な取引:"
+        ]
+        for row in transactions[:5]:
+            lines.append(f"・{row['transaction_date']} {row['item_name'] or row['description'] or ''} "
+                         f"({row['category_name']}) ¥{row['amount']:,.0f}")
+        return "\n".join(lines)
+
+
+# Create global instances for easy access
+engine = db_access.PerLedger(ChatContextEngine)
+model = StubChatModel()
+db_access.db.add_change_listener(lambda event: engine.on_change(event))
+
+
+def get_chat_context(question, limit=200):
+    try:
+        return {"success": True, **engine.build_context(question, limit)}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def chat(message, limit=200):
+    try:
+        context = engine.build_context(message, limit)
+        return {
+            "success": True,
+            "reply": model.reply(message, context),
+            "model": model.name,
+            "context": context
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
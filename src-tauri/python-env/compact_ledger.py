@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+import time
+import threading
+
+import numpy as np
+import pandas as pd
+
+import db_access
+import archive
+
+# Dimensions totals() can group by
+DIMENSIONS = ("month", "account", "category", "item", "tag")
+
+EPOCH_MONTH = np.datetime64('1970-01', 'M')
+
+
+def _month_index(month):
+    """'2025-04' -> months since 1970-01."""
+    return int((np.datetime64(month, 'M') - EPOCH_MONTH).astype(np.int64))
+
+
+def _month_label(index):
+    return str(EPOCH_MONTH + np.timedelta64(int(index), 'M'))
+
+
+def _lookup(codes, keys):
+    """Map keys (ids) to their codes with one vectorized lookup."""
+    keys = np.asarray(keys, dtype=np.int64)
+    if not len(keys):
+        return np.empty(0, dtype=np.int32)
+    table = np.full(int(keys.max()) + 1, -1, dtype=np.int32)
+    for key, code in codes.items():
+        if key <= keys.max():
+            table[key] = code
+    return table[keys]
+
+
+def _grow(array, capacity):
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class StringDictionary:
+    """Dictionary encoding: each distinct string is stored once and rows hold its int32 code."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code_of(self, value):
+        """Get the code of a value, or None if it does not occur."""
+        return self._codes.get(value)
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return self.values[code] if code >= 0 else None
+
+    def __len__(self):
+        return len(self.values)
+
+
+class CompactLedger:
+    """Column-oriented, in-memory copy of the transactions of a ledger.
+
+    Dates are int32 days since 1970-01-01, amounts float64 (in the reporting
+    currency, see currency.py; NaN without a rate), and accounts,
+    categories, item names and tags int32 codes into small dictionaries, so
+    a transaction takes about 40 bytes instead of a dict or an object
+    DataFrame row. Tags are kept in CSR form: the tags of row i are
+    tag_codes[tag_indptr[i]:tag_indptr[i + 1]].
+
+    Built once on first use, archived years included. New transactions are
+    appended and the months touched by updates and deletes are reloaded,
+    from the change listener.
+    """
+
+    def __init__(self, db, chunk_size=50000):
+        self.db = db
+        self.chunk_size = chunk_size
+        self._lock = threading.RLock()
+        self._built = False
+        self.build_seconds = None
+        self._clear()
+
+    def _clear(self):
+        self.size = 0
+        self.max_transaction_id = 0
+        self.transaction_ids = np.empty(0, dtype=np.int64)
+        self.dates = np.empty(0, dtype=np.int32)
+        self.amounts = np.empty(0, dtype=np.float64)
+        self.account_codes = np.empty(0, dtype=np.int32)
+        self.category_codes = np.empty(0, dtype=np.int32)
+        self.item_codes = np.empty(0, dtype=np.int32)
+        self.tag_indptr = np.zeros(1, dtype=np.int64)
+        self.tag_codes = np.empty(0, dtype=np.int32)
+        self.items = StringDictionary()
+        self.accounts, self.categories, self.tags = [], [], []
+        self._account_code, self._category_code, self._tag_code = {}, {}, {}
+        self._load_dimensions()
+
+    def _load_dimensions(self):
+        # Accounts, categories and tags are small tables, reread when rows refer to one not seen yet.
+        # Codes are never reassigned, so the rows already loaded stay valid.
+        for row in self.db.execute_query("SELECT account_id, name FROM accounts ORDER BY account_id"):
+            self._encode_dimension(self.accounts, self._account_code, row['account_id'], (row['account_id'], row['name']))
+        for row in self.db.execute_query("SELECT category_id, name, type FROM categories ORDER BY category_id"):
+            self._encode_dimension(self.categories, self._category_code, row['category_id'],
+                                   (row['category_id'], row['name'], row['type']))
+        for row in self.db.execute_query("SELECT tag_id, name FROM tags ORDER BY tag_id"):
+            self._encode_dimension(self.tags, self._tag_code, row['tag_id'], (row['tag_id'], row['name']))
+
+    @staticmethod
+    def _encode_dimension(values, codes, key, value):
+        code = codes.get(key)
+        if code is None:
+            codes[key] = len(values)
+            values.append(value)
+        else:
+            values[code] = value
+
+    # Loading
+
+    def _ensure(self):
+        if not self._built:
+            start = time.perf_counter()
+            self._clear()
+            years = [row['year'] for row in archive.get_archived_years(self.db)]
+            for rows, tag_rows in self._query_rows("1", (), years):
+                self._append_rows(rows, tag_rows)
+            self._built = True
+            self.build_seconds = round(time.perf_counter() - start, 3)
+        else:
+            # Also picks up rows written without a change event (e.g. imports through Tauri)
+            self._append_new_rows()
+
+    def _query_rows(self, where, params, years=()):
+        """Yield chunks of (columns, tags) for the transactions matching a WHERE clause, by transaction_id.
+
+        `years` are archived years to read as well (new rows are always in the main database).
+        """
+        with archive.history(self.db, years):
+            # Plain tuples: building a sqlite3.Row per row costs more than the rest of the load
+            cursor = self.db.connect().cursor()
+            cursor.row_factory = None
+            last_transaction_id = 0
+            while True:
+                cursor.execute(f"""
+                SELECT transaction_id, substr(transaction_date, 1, 10), amount_reporting,
+                       account_id, category_id, item_name
+                FROM transactions
+                WHERE ({where}) AND transaction_id > ?
+                ORDER BY transaction_id
+                LIMIT ?
+                """, list(params) + [last_transaction_id, self.chunk_size])
+                rows = cursor.fetchall()
+                if not rows:
+                    return
+                last_transaction_id = rows[-1][0]
+                # Tags of the id range; those of rows outside the WHERE clause are dropped in _append_rows
+                cursor.execute("""
+                SELECT transaction_id, tag_id FROM transaction_tags
+                WHERE transaction_id >= ? AND transaction_id <= ?
+                ORDER BY transaction_id
+                """, (rows[0][0], last_transaction_id))
+                yield rows, cursor.fetchall()
+
+    def _append_rows(self, rows, tag_rows):
+        count = len(rows)
+        needed = self.size + count
+        if needed > len(self.transaction_ids):
+            capacity = max(needed, 2 * len(self.transaction_ids), 1024)
+            for name in ("transaction_ids", "dates", "amounts", "account_codes", "category_codes", "item_codes"):
+                setattr(self, name, _grow(getattr(self, name)[:self.size], capacity))
+
+        ids, dates, amounts, account_ids, category_ids, item_names = zip(*rows)
+        ids = np.array(ids, dtype=np.int64)
+        tag_transaction_ids = np.array([transaction_id for transaction_id, _ in tag_rows], dtype=np.int64)
+        tag_ids = np.array([tag_id for _, tag_id in tag_rows], dtype=np.int64)
+        in_rows = np.isin(tag_transaction_ids, ids)
+        tag_transaction_ids, tag_ids = tag_transaction_ids[in_rows], tag_ids[in_rows]
+
+        if not set(account_ids) <= self._account_code.keys() or not set(category_ids) <= self._category_code.keys() \
+                or not set(tag_ids.tolist()) <= self._tag_code.keys():
+            self._load_dimensions()
+
+        end = self.size + count
+        self.transaction_ids[self.size:end] = ids
+        self.dates[self.size:end] = (np.array(dates, dtype='datetime64[D]') - np.datetime64(0, 'D')).astype(np.int32)
+        self.amounts[self.size:end] = np.array(amounts, dtype=np.float64)
+        self.account_codes[self.size:end] = _lookup(self._account_code, account_ids)
+        self.category_codes[self.size:end] = _lookup(self._category_code, category_ids)
+        # Encode each distinct item name of the chunk once
+        item_codes, uniques = pd.factorize(pd.Series(item_names, dtype=object))
+        mapping = np.array([self.items.encode(value) for value in uniques] + [-1], dtype=np.int32)
+        self.item_codes[self.size:end] = mapping[item_codes]
+
+        # CSR: count the tags of each new row (tag_rows are ordered by transaction_id like rows)
+        counts = np.searchsorted(tag_transaction_ids, ids, side='right') - \
+            np.searchsorted(tag_transaction_ids, ids, side='left')
+        self.tag_indptr = np.concatenate([self.tag_indptr, self.tag_indptr[-1] + np.cumsum(counts)])
+        self.tag_codes = np.concatenate([
+            self.tag_codes,
+            _lookup(self._tag_code, tag_ids)
+        ])
+
+        self.size = end
+        self.max_transaction_id = max(self.max_transaction_id, int(ids.max()))
+
+    def _append_new_rows(self):
+        for rows, tag_rows in self._query_rows("transaction_id > ?", (self.max_transaction_id,)):
+            self._append_rows(rows, tag_rows)
+
+    def _remove(self, mask):
+        keep = ~mask
+        tag_counts = np.diff(self.tag_indptr)
+        self.tag_codes = self.tag_codes[np.repeat(keep, tag_counts)]
+        self.tag_indptr = np.concatenate([[0], np.cumsum(tag_counts[keep])])
+        for name in ("transaction_ids", "dates", "amounts", "account_codes", "category_codes", "item_codes"):
+            setattr(self, name, getattr(self, name)[:self.size][keep])
+        self.size = int(keep.sum())
+
+    def _reload_months(self, months):
+        """Drop the rows of some months and read them again (after updates or deletes)."""
+        month_indexes = [_month_index(month) for month in months]
+        self._remove(np.isin(self.month_indexes(), month_indexes))
+        archived = {row['year'] for row in archive.get_archived_years(self.db)}
+        for month in months:
+            start = str(np.datetime64(month, 'M'))
+            end = str(np.datetime64(month, 'M') + np.timedelta64(1, 'M'))
+            # Rows above the watermark are left to _append_new_rows
+            where = "transaction_date >= ? AND transaction_date < ? AND transaction_id <= ?"
+            years = [int(month[:4])] if int(month[:4]) in archived else []
+            for rows, tag_rows in self._query_rows(where, (start + '-01', end + '-01', self.max_transaction_id),
+                                                   years):
+                self._append_rows(rows, tag_rows)
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+
+    def on_change(self, event):
+        """Change listener: append new rows, reload the months touched by other writes.
+
+        Archiving or restoring a year only moves rows between files, so the
+        loaded rows stay as they are.
+        """
+        with self._lock:
+            if not self._built or event.get("type") in ("year_archived", "year_restored"):
+                return
+            if event.get("type") in ("import", "transaction_added"):
+                self._append_new_rows()
+            elif event.get("months") is not None:
+                self._reload_months(event["months"])
+                self._append_new_rows()
+            else:
+                self._built = False
+
+    # Columns
+
+    def month_indexes(self):
+        """Months since 1970-01 of each row."""
+        return self.dates[:self.size].astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+    def memory_usage(self):
+        """Get the bytes held by the arrays (dictionaries of strings not included)."""
+        arrays = {
+            name: getattr(self, name)[:self.size].nbytes
+            for name in ("transaction_ids", "dates", "amounts", "account_codes", "category_codes", "item_codes")
+        }
+        arrays["tag_indptr"] = self.tag_indptr.nbytes
+        arrays["tag_codes"] = self.tag_codes.nbytes
+        return arrays
+
+    def stats(self):
+        with self._lock:
+            self._ensure()
+            memory = self.memory_usage()
+            return {
+                "transactions": self.size,
+                "unconverted": int(np.isnan(self.amounts[:self.size]).sum()),
+                "tags": len(self.tag_codes),
+                "distinct_items": len(self.items),
+                "bytes": sum(memory.values()),
+                "bytes_per_transaction": round(sum(memory.values()) / self.size, 1) if self.size else 0.0,
+                "memory": memory,
+                "build_seconds": self.build_seconds,
+            }
+
+    # Analytics
+
+    def _mask(self, start=None, end=None, category_type=None, account_id=None):
+        mask = np.ones(self.size, dtype=bool)
+        if start:
+            mask &= self.dates[:self.size] >= (np.datetime64(start[:10], 'D') - np.datetime64(0, 'D')).astype(np.int64)
+        if end:
+            mask &= self.dates[:self.size] <= (np.datetime64(end[:10], 'D') - np.datetime64(0, 'D')).astype(np.int64)
+        if category_type:
+            codes = [code for code, (_, _, type) in enumerate(self.categories) if type == category_type]
+            mask &= np.isin(self.category_codes[:self.size], codes)
+        if account_id is not None:
+            mask &= self.account_codes[:self.size] == self._account_code.get(account_id, -2)
+        return mask
+
+    def totals(self, group_by=("month", "category"), start=None, end=None, category_type=None, account_id=None):
+        """Sum and count transactions by some dimensions.
+
+        Args:
+            group_by (tuple): Dimensions from DIMENSIONS. Grouping by "tag" counts a
+                transaction once per tag (untagged transactions are left out).
+            start (str): First date (YYYY-MM-DD), inclusive
+            end (str): Last date (YYYY-MM-DD), inclusive
+            category_type (str): Only this category type (e.g. "expense")
+            account_id (int): Only this account
+
+        Returns:
+            list: One dict per group with its labels, "total" and "count", ordered by the group keys.
+                Transactions without an exchange rate are not in total and count but in "unconverted".
+        """
+        unknown = [dimension for dimension in group_by if dimension not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimension '{unknown[0]}' (expected one of {', '.join(DIMENSIONS)})")
+
+        with self._lock:
+            self._ensure()
+            rows = np.flatnonzero(self._mask(start, end, category_type, account_id))
+            keys = {}
+            if "tag" in group_by:
+                # One entry per (transaction, tag) pair
+                counts = np.diff(self.tag_indptr)[rows]
+                starts = self.tag_indptr[rows]
+                # Positions in tag_codes of every tag of the selected rows
+                offsets = np.cumsum(counts) - counts
+                positions = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+                keys["tag"] = self.tag_codes[positions]
+                rows = np.repeat(rows, counts)
+            if "month" in group_by:
+                keys["month"] = self.month_indexes()[rows]
+            if "account" in group_by:
+                keys["account"] = self.account_codes[rows]
+            if "category" in group_by:
+                keys["category"] = self.category_codes[rows]
+            if "item" in group_by:
+                keys["item"] = self.item_codes[rows]
+            amounts = self.amounts[rows]
+
+        converted = ~np.isnan(amounts)
+        amounts = np.where(converted, amounts, 0.0)
+        if not group_by:
+            return [{"total": float(amounts.sum()), "count": int(converted.sum()),
+                     "unconverted": int(len(amounts) - converted.sum())}]
+        if len(rows) == 0:
+            return []
+
+        # One int64 key per row combining the dimension codes, so grouping is a single bincount or sort
+        composite = np.zeros(len(rows), dtype=np.int64)
+        bases = []
+        for dimension in group_by:
+            codes = keys[dimension].astype(np.int64)
+            base = int(codes.min())  # item codes start at -1 and months at the first month
+            cardinality = int(codes.max()) - base + 1
+            composite = composite * cardinality + (codes - base)
+            bases.append((base, cardinality))
+
+        if int(composite.max()) < 4 * len(rows) + 1024:
+            sums = np.bincount(composite, weights=amounts)
+            rows_per_group = np.bincount(composite)
+            counts = np.bincount(composite, weights=converted)
+            groups = np.flatnonzero(rows_per_group)
+            sums, counts, rows_per_group = sums[groups], counts[groups], rows_per_group[groups]
+        else:
+            groups, inverse = np.unique(composite, return_inverse=True)
+            sums = np.bincount(inverse, weights=amounts, minlength=len(groups))
+            rows_per_group = np.bincount(inverse, minlength=len(groups))
+            counts = np.bincount(inverse, weights=converted, minlength=len(groups))
+
+        # Split the combined keys back into the codes of each dimension
+        decoded = []
+        remainder = groups
+        for base, cardinality in reversed(bases):
+            decoded.append(remainder % cardinality + base)
+            remainder = remainder // cardinality
+        decoded.reverse()
+
+        results = []
+        for group, total, count, group_rows in zip(zip(*decoded), sums, counts, rows_per_group):
+            result = {}
+            for dimension, code in zip(group_by, group):
+                result.update(self._labels(dimension, int(code)))
+            result["total"] = float(total)
+            result["count"] = int(count)
+            result["unconverted"] = int(group_rows - count)
+            results.append(result)
+        return results
+
+    def _labels(self, dimension, code):
+        if dimension == "month":
+            return {"month": _month_label(code)}
+        if dimension == "account":
+            account_id, name = self.accounts[code]
+            return {"account_id": account_id, "account_name": name}
+        if dimension == "category":
+            category_id, name, type = self.categories[code]
+            return {"category_id": category_id, "category_name": name, "category_type": type}
+        if dimension == "item":
+            return {"item_name": self.items.decode(code)}
+        tag_id, name = self.tags[code]
+        return {"tag_id": tag_id, "tag_name": name}
+
+    def top_items(self, limit=20):
+        """Get the item names with the largest total absolute amount.
+
+        Returns:
+            list: {"item_name", "count", "total", "last_date"} dicts
+        """
+        with self._lock:
+            self._ensure()
+            codes = self.item_codes[:self.size]
+            # Only amounts in the reporting currency can be added up
+            named = (codes >= 0) & ~np.isnan(self.amounts[:self.size])
+            codes = codes[named]
+            amounts = self.amounts[:self.size][named]
+            dates = self.dates[:self.size][named]
+            item_count = len(self.items)
+
+            if not len(codes):
+                return []
+            volume = np.bincount(codes, weights=np.abs(amounts), minlength=item_count)
+            empty_code = self.items.code_of("")
+            if empty_code is not None:
+                volume[empty_code] = -1
+            totals = np.bincount(codes, weights=amounts, minlength=item_count)
+            counts = np.bincount(codes, minlength=item_count)
+            last_dates = np.full(item_count, np.iinfo(np.int32).min, dtype=np.int64)
+            np.maximum.at(last_dates, codes, dates)
+
+            top = [code for code in np.argsort(-volume, kind='stable')[:limit] if volume[code] >= 0 and counts[code]]
+            return [{
+                "item_name": self.items.decode(int(code)),
+                "count": int(counts[code]),
+                "total": float(totals[code]),
+                "last_date": str(np.datetime64(int(last_dates[code]), 'D'))
+            } for code in top]
+
+
+# Create a global instance for easy access (one per ledger)
+ledger = db_access.PerLedger(CompactLedger)
+db_access.db.add_change_listener(lambda event: ledger.on_change(event))
+
+
+def get_totals(group_by=("month", "category"), start=None, end=None, category_type=None, account_id=None):
+    try:
+        return {
+            "success": True,
+            "totals": ledger.totals(tuple(group_by), start, end, category_type, account_id)
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def get_stats():
+    try:
+        return {"success": True, **ledger.stats()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
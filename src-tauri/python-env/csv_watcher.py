@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+import os
+import threading
+import time
+import logging
+
+import db_access
+import job_queue
+
+# Polling is the supported mode: the app does not ship watchdog. When it happens to be
+# installed, its inotify (Linux) / FSEvents (macOS) events are used to notice files sooner.
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _CsvEventHandler(FileSystemEventHandler):
+    """Forward file system events for CSV files to the watcher."""
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.dest_path)
+
+
+class CsvFolderWatcher:
+    """Watch the CSV folders of the ledgers and import new {collector}_{date}.csv files in the background.
+
+    Files dropped in data/csv/ are imported into the default ledger, files
+    in data/csv/ledgers/{name}/ into the ledger of that name (see
+    LedgerManager.get_import_dirs). A file is only imported once its size
+    and modification time have stayed the same for `debounce_seconds`, so a
+    collector still writing the file is not picked up half way. Imports go
+    through the job queue, which keeps the usual data_logs / dust folder
+    bookkeeping of load_csv_file.
+
+    The folders are polled every `poll_interval` seconds; watchdog, if
+    installed, only replaces the polling with file system events.
+    """
+
+    def __init__(self, jobs, ledgers, debounce_seconds=2.0, poll_interval=1.0):
+        self.jobs = jobs
+        self.ledgers = ledgers
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+        # (ledger, filename) -> (size, mtime, monotonic time the file was last seen changing)
+        self._pending = {}
+        # (ledger, filename) -> (size, mtime) of a version that failed to import; retried only when the file changes
+        self._failed = {}
+        # (ledger, filename) -> (job, (size, mtime)) of imports submitted by the watcher and not yet finished
+        self._submitted = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._observer = None
+        self.backend = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, use_polling=False):
+        """Start watching. Polls the folders, or uses watchdog events if it is installed and use_polling is not set."""
+        if self.running:
+            return
+        root = self._csv_dir(db_access.DEFAULT_LEDGER)
+        root.mkdir(parents=True, exist_ok=True)
+        self._stop_event.clear()
+
+        if Observer is not None and not use_polling:
+            # The folders of the other ledgers are below data/csv/
+            self._observer = Observer()
+            self._observer.schedule(_CsvEventHandler(self), str(root), recursive=True)
+            self._observer.start()
+            self.backend = "watchdog"
+        else:
+            self.backend = "polling"
+
+        # Files that were already there before the watcher started
+        self._scan()
+
+        self._thread = threading.Thread(target=self._run, name="csv-folder-watcher", daemon=True)
+        self._thread.start()
+        logging.info(f"CSV folder watcher started on {root} ({self.backend})")
+
+    def stop(self):
+        """Stop watching."""
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        logging.info("CSV folder watcher stopped")
+
+    def notify(self, path):
+        """Record that a file in one of the watched folders was created or changed."""
+        filename = os.path.basename(path)
+        if not self._is_candidate(filename):
+            return
+        ledger = self._ledger_of(os.path.dirname(path))
+        if ledger is None:
+            return
+        with self._lock:
+            # Keep the old stat so _check_pending sees the change and restarts the debounce timer
+            self._pending.setdefault((ledger, filename), (None, None, time.monotonic()))
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "backend": self.backend,
+                "csv_dirs": {name: str(path) for name, path in self._folders().items()},
+                "debounce_seconds": self.debounce_seconds,
+                "pending": [{"ledger": ledger, "filename": filename} for ledger, filename in sorted(self._pending)],
+                "failed": [{"ledger": ledger, "filename": filename} for ledger, filename in sorted(self._failed)],
+                "jobs": [{"ledger": ledger, "filename": filename, "job_id": job.job_id}
+                         for (ledger, filename), (job, current) in sorted(self._submitted.items())],
+            }
+
+    def _csv_dir(self, ledger):
+        return self.ledgers.get_import_dirs(ledger)[0]
+
+    def _folders(self):
+        """Get {ledger name: CSV folder} of every ledger."""
+        return {name: self._csv_dir(name) for name in self.ledgers.names()}
+
+    def _ledger_of(self, directory):
+        directory = os.path.abspath(directory)
+        for name, folder in self._folders().items():
+            if os.path.abspath(folder) == directory:
+                return name
+        return None
+
+    def _is_candidate(self, filename):
+        # Same filename format load_csv_file expects: {data_collector}_{update_date}.csv
+        return filename.endswith('.csv') and not filename.startswith('.') and '_' in filename
+
+    def _scan(self):
+        for folder in self._folders().values():
+            for path in folder.glob('*.csv'):
+                self.notify(str(path))
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.poll()
+
+    def poll(self):
+        """Look for finished imports and files that are ready to import (called by the watcher thread)."""
+        try:
+            self._collect_finished()
+            if self.backend == "polling":
+                self._scan()
+            self._check_pending()
+        except Exception as e:
+            logging.error(f"CSV folder watcher error: {str(e)}")
+
+    def _check_pending(self):
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for key, (size, mtime, changed_at) in list(self._pending.items()):
+                ledger, filename = key
+                try:
+                    stat = os.stat(self._csv_dir(ledger) / filename)
+                except FileNotFoundError:
+                    # Moved away (imported, or deleted) before it settled
+                    del self._pending[key]
+                    continue
+
+                current = (stat.st_size, stat.st_mtime)
+                if current != (size, mtime):
+                    self._pending[key] = (stat.st_size, stat.st_mtime, now)
+                elif now - changed_at >= self.debounce_seconds:
+                    del self._pending[key]
+                    if self._failed.get(key) != current and key not in self._submitted:
+                        ready.append((key, current))
+
+        for (ledger, filename), current in ready:
+            # The job runs on the ledger that is current when it is submitted
+            with self.ledgers.use(ledger):
+                job = self.jobs.submit_import(filename)
+            with self._lock:
+                self._submitted[(ledger, filename)] = (job, current)
+
+    def _collect_finished(self):
+        # Remember failed versions so polling does not resubmit the same broken file forever
+        with self._lock:
+            for key, (job, current) in list(self._submitted.items()):
+                if not job.finished:
+                    continue
+                del self._submitted[key]
+                ledger, filename = key
+                if job.status == "failed":
+                    self._failed[key] = current
+                    logging.error(f"Auto-import of {filename} into ledger {ledger} failed: {job.errors}")
+                else:
+                    self._failed.pop(key, None)
+                    logging.info(f"Auto-imported {filename} into ledger {ledger}: {job.result}")
+
+
+# Create a global instance for easy access
+watcher = CsvFolderWatcher(job_queue.jobs, db_access.ledgers)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import db_access
+
+# Currency all totals are reported in
+REPORTING_CURRENCY = os.environ.get("KAKEIBO_REPORTING_CURRENCY", "JPY")
+
+# accounts.currency of accounts created without one
+DEFAULT_ACCOUNT_CURRENCY = "JPY"
+
+
+def get_rates_dir():
+    """Get the data/rates/ directory that exchange rate CSV files are read from."""
+    script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+    return script_dir.parent.parent / 'data' / 'rates'
+
+
+def get_rate_files():
+    rates_dir = get_rates_dir()
+    if not rates_dir.exists():
+        return []
+    return sorted(path.name for path in rates_dir.glob('*.csv'))
+
+
+def _days(dates):
+    """Convert date strings to datetime64[D] (NaT where a date cannot be parsed)."""
+    return pd.to_datetime(pd.Series(list(dates), dtype=object), errors='coerce').to_numpy(dtype='datetime64[D]')
+
+
+class CurrencyConverter:
+    """Convert amounts to the reporting currency with a local exchange rate table.
+
+    Rates are loaded from CSV files into exchange_rates; nothing is fetched
+    from the network. A transaction is converted with the latest rate on or
+    before its date (the earliest rate for dates before the first one).
+    The converted amount is cached in transactions.amount_reporting by a
+    write hook, so totals sum one column instead of looking up a rate per
+    row; it is NULL when there is no rate for the currency.
+    """
+
+    def __init__(self, db, reporting_currency=REPORTING_CURRENCY):
+        self.db = db
+        self.reporting_currency = reporting_currency
+        self._lock = threading.Lock()
+        self._rates = None
+
+    def ensure_schema(self):
+        """Create exchange_rates and add amount_reporting to older ledgers (filling it in)."""
+        self.db.ensure_schema('exchange_rates.sql')
+        if self.db.ensure_column("transactions", "amount_reporting", "REAL"):
+            # Without rates yet, this only copies amount for accounts in the reporting currency,
+            # so no total changes and the other hooks and listeners need not run
+            conn = self.db.connect()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN TRANSACTION")
+                self.apply(cursor, "1", [], 1)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    # Rates
+
+    def rate_table(self):
+        """Get {currency: (rate dates, rates)} for converting to the reporting currency, ordered by date."""
+        with self._lock:
+            if self._rates is None:
+                rows = self.db.execute_query("""
+                SELECT currency, base_currency, rate_date, rate FROM exchange_rates
+                WHERE base_currency = ? OR currency = ?
+                """, (self.reporting_currency, self.reporting_currency))
+                df = pd.DataFrame(rows, columns=["currency", "base_currency", "rate_date", "rate"])
+                # Rates quoted the other way round (1 JPY = x USD) are inverted; direct quotes win
+                inverse = df["currency"] == self.reporting_currency
+                df.loc[inverse, "currency"] = df.loc[inverse, "base_currency"]
+                df.loc[inverse, "rate"] = 1.0 / df.loc[inverse, "rate"]
+                df["inverse"] = inverse
+                df = df[df["rate"] > 0].sort_values(["currency", "rate_date", "inverse"])
+                df = df.drop_duplicates(["currency", "rate_date"], keep="first")
+                self._rates = {
+                    currency: (_days(group["rate_date"]), group["rate"].to_numpy(dtype=float))
+                    for currency, group in df.groupby("currency")
+                }
+            return self._rates
+
+    def invalidate(self):
+        with self._lock:
+            self._rates = None
+
+    def convert(self, dates, currencies, amounts):
+        """Convert amounts to the reporting currency.
+
+        Args:
+            dates (array-like): YYYY-MM-DD dates of the amounts
+            currencies (array-like): Currency of each amount
+            amounts (array-like): The amounts
+
+        Returns:
+            ndarray: Converted amounts (NaN where the currency has no rates)
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        currencies = np.asarray(currencies, dtype=object)
+        result = np.full(len(amounts), np.nan)
+        same = currencies == self.reporting_currency
+        result[same] = amounts[same]
+        if same.all():
+            return result
+
+        days = _days(dates)
+        rates = self.rate_table()
+        for currency in pd.unique(currencies[~same]):
+            if currency not in rates:
+                continue
+            rate_days, rate_values = rates[currency]
+            mask = (currencies == currency) & ~np.isnat(days)
+            # Latest rate on or before each date; the first rate before the table starts
+            index = np.searchsorted(rate_days, days[mask], side='right') - 1
+            result[mask] = amounts[mask] * rate_values[np.maximum(index, 0)]
+        return result
+
+    # Cached column
+
+    def apply(self, cursor, where, params, sign):
+        """Write hook: fill in amount_reporting of added or changed transactions."""
+        if sign < 0:
+            return
+        cursor.execute(f"""
+        UPDATE transactions SET amount_reporting = amount
+        WHERE ({where})
+          AND account_id IN (SELECT account_id FROM accounts WHERE COALESCE(currency, ?) = ?)
+        """, list(params) + [DEFAULT_ACCOUNT_CURRENCY, self.reporting_currency])
+
+        cursor.execute(f"""
+        SELECT t.transaction_id, substr(t.transaction_date, 1, 10), t.amount, a.currency
+        FROM (SELECT transaction_id, transaction_date, amount, account_id FROM transactions WHERE {where}) t
+        JOIN accounts a ON a.account_id = t.account_id
+        WHERE COALESCE(a.currency, ?) != ?
+        """, list(params) + [DEFAULT_ACCOUNT_CURRENCY, self.reporting_currency])
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        transaction_ids, dates, amounts, currencies = zip(*rows)
+        currencies = [currency or DEFAULT_ACCOUNT_CURRENCY for currency in currencies]
+        converted = self.convert(dates, currencies, amounts)
+        cursor.executemany("UPDATE transactions SET amount_reporting = ? WHERE transaction_id = ?", [
+            (None if np.isnan(amount) else float(amount), transaction_id)
+            for amount, transaction_id in zip(converted, transaction_ids)
+        ])
+
+    def refresh(self, currencies=None):
+        """Recompute amount_reporting (for the accounts in some currencies, or all).
+
+        Runs the write hooks as an update of those transactions, so
+        counters kept by other hooks (budgets) follow the new amounts, and
+        notifies the change listeners.
+
+        Args:
+            currencies (list): Account currencies to recompute (None for all)
+
+        Returns:
+            dict: Result of the operation
+        """
+        if currencies is None:
+            where, params = "1", []
+        else:
+            placeholders = ', '.join(['?' for _ in currencies])
+            where = f"account_id IN (SELECT account_id FROM accounts WHERE COALESCE(currency, ?) IN ({placeholders}))"
+            params = [DEFAULT_ACCOUNT_CURRENCY] + list(currencies)
+
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            affected = self.db.get_affected(cursor, where, params)
+            self.db.run_write_hooks(cursor, where, params, -1)
+            self.db.run_write_hooks(cursor, where, params, 1)
+            cursor.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(amount_reporting IS NULL), 0) FROM transactions WHERE {where}
+            """, params)
+            count, unconverted = cursor.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if affected["months"]:
+            self.db.notify_change({"type": "rates_updated", "count": count, **affected})
+        return {"success": True, "transactions": count, "unconverted": unconverted}
+
+    def load_rates(self, filename):
+        """Load a CSV file of rates from data/rates/ and convert the transactions again.
+
+        The file has the columns date, currency and rate (1 currency = rate
+        base), and optionally base (the reporting currency by default).
+        Rates already loaded for the same day are replaced.
+
+        Args:
+            filename (str): The name of the CSV file
+
+        Returns:
+            dict: Result of the operation
+        """
+        path = get_rates_dir() / filename
+        if not path.exists():
+            return {"success": False, "error": f"File not found: {filename}"}
+
+        df = pd.read_csv(path, dtype=str)
+        df.columns = [column.strip().lower() for column in df.columns]
+        missing = [column for column in ("date", "currency", "rate") if column not in df.columns]
+        if missing:
+            return {"success": False, "error": f"Missing columns: {', '.join(missing)}"}
+        if "base" not in df.columns:
+            df["base"] = self.reporting_currency
+
+        df["currency"] = df["currency"].str.strip().str.upper()
+        df["base"] = df["base"].fillna(self.reporting_currency).str.strip().str.upper()
+        df["date"] = pd.to_datetime(df["date"].str.strip(), errors='coerce').dt.strftime('%Y-%m-%d')
+        df["rate"] = pd.to_numeric(df["rate"], errors='coerce')
+        valid = df["date"].notna() & (df["rate"] > 0) & df["currency"].notna() & (df["currency"] != df["base"])
+        rows = df[valid]
+
+        self.db.ensure_schema('exchange_rates.sql')
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        try:
+            # IMMEDIATE, as the other writes here: never upgrade a read snapshot to a write
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany("""
+            INSERT INTO exchange_rates (currency, base_currency, rate_date, rate) VALUES (?, ?, ?, ?)
+            ON CONFLICT(currency, base_currency, rate_date) DO UPDATE SET rate = excluded.rate
+            """, list(zip(rows["currency"], rows["base"], rows["date"], rows["rate"].astype(float))))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e)}
+        self.invalidate()
+
+        currencies = sorted(set(rows["currency"]) | set(rows["base"]))
+        result = self.refresh([currency for currency in currencies if currency != self.reporting_currency])
+        return {
+            "success": True,
+            "rates_loaded": len(rows),
+            "rows_skipped": int((~valid).sum()),
+            "currencies": currencies,
+            "transactions_converted": result["transactions"],
+            "unconverted": result["unconverted"]
+        }
+
+    def status(self):
+        """Get the loaded rates and the transactions per account currency."""
+        self.db.ensure_schema('exchange_rates.sql')
+        rates = self.db.execute_query("""
+        SELECT currency, base_currency, COUNT(*) AS count, MIN(rate_date) AS first_date, MAX(rate_date) AS last_date
+        FROM exchange_rates GROUP BY currency, base_currency ORDER BY currency, base_currency
+        """)
+        transactions = self.db.execute_query("""
+        SELECT COALESCE(a.currency, ?) AS currency, COUNT(*) AS count,
+               SUM(t.amount_reporting IS NULL) AS unconverted
+        FROM transactions t JOIN accounts a ON a.account_id = t.account_id
+        GROUP BY 1 ORDER BY 1
+        """, (DEFAULT_ACCOUNT_CURRENCY,))
+        return {
+            "reporting_currency": self.reporting_currency,
+            "rates": rates,
+            "transactions": transactions,
+            "files": get_rate_files()
+        }
+
+
+# Create a global instance for easy access
+converter = db_access.PerLedger(CurrencyConverter)
+db_access.db.add_initializer(lambda db: converter.get(db.name).ensure_schema())
+# Runs before the hooks reading amount_reporting (budgets), so they see converted amounts
+db_access.db.add_write_hook(lambda cursor, where, params, sign: converter.apply(cursor, where, params, sign),
+                            priority=db_access.DERIVED_COLUMN_HOOK_PRIORITY)
+
+
+def get_currency_status():
+    try:
+        return {"success": True, **converter.status()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def load_rates(filename):
+    try:
+        return converter.load_rates(filename)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def refresh_conversions():
+    try:
+        return converter.refresh()
+    except Exception as e:
+        return {"success": False, "error": str(e)}
@@ -7,38 +7,365 @@ import datetime
 import os
 import csv
 import shutil
+import threading
+import copy
+import time
+import re
+import contextlib
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Category given to imported rows that have no category and match no categorization rule
+UNCATEGORIZED_NAME = "未分類"
+
+# Columns of transactions that can be written through the bulk API
+TRANSACTION_FIELDS = ("account_id", "category_id", "amount", "item_name", "description", "transaction_date", "memo")
+REQUIRED_TRANSACTION_FIELDS = ("account_id", "category_id", "amount", "transaction_date")
+
+# Ids per IN (...) clause, below SQLite's limit on bound parameters
+ID_CHUNK_SIZE = 500
+
+# Write hooks run by priority, lowest first: hooks filling in derived columns of transactions
+# (amount_reporting) run before the hooks reading them (budget counters)
+DERIVED_COLUMN_HOOK_PRIORITY = 10
+DEFAULT_HOOK_PRIORITY = 100
+
+# Page cache of each read-only query connection, sized for analytics scans (the default is about 2 MB)
+QUERY_CACHE_MB = int(os.environ.get("KAKEIBO_QUERY_CACHE_MB", "64"))
+
+# What ad-hoc and component SQL may do on a read-only query connection; everything else is denied
+QUERY_ACTIONS = (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE)
+# Pragmas that only describe the schema; other pragmas may be read but not set
+QUERY_PRAGMAS = ("table_info", "table_xinfo", "index_list", "index_info", "index_xinfo", "foreign_key_list")
+
+# The ledger in data/db/database.sqlite; other ledgers live in data/db/ledgers/{name}.sqlite
+DEFAULT_LEDGER = "default"
+LEDGER_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# The ledger the current request or job works on (see LedgerManager.use)
+current_ledger = contextvars.ContextVar("current_ledger", default=DEFAULT_LEDGER)
+
+
+def _call_listeners(listeners, event):
+    table = event.get("table", "transactions")
+    for listener, tables in list(listeners):
+        if tables is not None and table not in tables:
+            continue
+        try:
+            listener(event)
+        except Exception as e:
+            print(f"Error in change listener for {event.get('type')}: {str(e)}")
 
 class DatabaseManager:
-    def __init__(self):
-        # Use absolute path to the database file
-        # Get the directory where the script is located
-        script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
-        # Navigate to the data/db directory from script location
-        # Assuming structure: src-tauri/python-env/db_access.py and data/db at project root
-        db_dir = script_dir.parent.parent / 'data' / 'db'
-        db_dir.mkdir(parents=True, exist_ok=True)  # Ensure the directory exists
-        self.db_path = db_dir / 'database.sqlite'
-        self._conn = None
+    def __init__(self, db_path=None, name=DEFAULT_LEDGER, csv_dir=None, dust_dir=None):
+        if db_path is None:
+            # Use absolute path to the database file
+            # Get the directory where the script is located
+            script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+            # Navigate to the data/db directory from script location
+            # Assuming structure: src-tauri/python-env/db_access.py and data/db at project root
+            db_dir = script_dir.parent.parent / 'data' / 'db'
+            db_dir.mkdir(parents=True, exist_ok=True)  # Ensure the directory exists
+            db_path = db_dir / 'database.sqlite'
+        self.db_path = Path(db_path)
+        self.name = name
+        # Where CSV files to import are dropped, and where imported files are moved to
+        data_dir = Path(os.path.dirname(os.path.abspath(__file__))).parent.parent / 'data'
+        self.csv_dir = Path(csv_dir) if csv_dir else data_dir / 'csv'
+        self.dust_dir = Path(dust_dir) if dust_dir else data_dir / 'dust'
+        # One connection per thread, so background jobs never share a transaction with API requests
+        self._local = threading.local()
+        # Every open connection of this database and the thread using it, so they can be closed (see close_idle)
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._generation = 0
+        self._change_listeners = []
+        self._write_hooks = []
+        self._ensured_ddl = set()
+        self._ensured_columns = set()
+        self._categorizer_factory = None
     
     def connect(self):
-        """Connect to the SQLite database."""
-        if not self._conn:
-            self._conn = sqlite3.connect(self.db_path)
+        """Connect to the SQLite database (one connection per thread)."""
+        conn = getattr(self._local, 'conn', None)
+        if not conn or self._local.generation != self._generation:
+            if conn:
+                # Retired by close_idle while this thread was using it
+                self._close(conn)
+            # Wait for the writer instead of failing immediately while a background import holds the lock.
+            # check_same_thread is off only so that close_all can close it; each connection is still used by one thread.
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
             # Enable foreign keys
-            self._conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute("PRAGMA foreign_keys = ON")
+            # WAL lets readers keep working while an import is writing
+            conn.execute("PRAGMA journal_mode = WAL")
             # Configure SQLite to return rows as dictionaries
-            self._conn.row_factory = sqlite3.Row
-        return self._conn
+            conn.row_factory = sqlite3.Row
+            with self._connections_lock:
+                self._connections[conn] = threading.current_thread()
+                self._local.generation = self._generation
+            self._local.conn = conn
+        return conn
+    
+    def connect_read_only(self):
+        """Connect to the database for ad-hoc and component SQL (one connection per thread).
+        
+        The file is opened read-only and an authorizer denies everything but
+        reading, so a query can neither write nor ATTACH other files, and
+        never takes the write lock imports wait for. The connection has its
+        own, larger page cache (QUERY_CACHE_MB). Internal code that needs
+        temp views or attached archives on it uses unrestricted().
+        """
+        conn = getattr(self._local, 'query_conn', None)
+        if not conn or self._local.query_generation != self._generation:
+            if conn:
+                self._close(conn)
+            # Opening read-only cannot create the file or switch it to WAL, so let the writable connection do that
+            self.connect()
+            # No statement cache: a statement prepared while unrestricted must not be reused by a query
+            conn = sqlite3.connect(f"{self.db_path.as_uri()}?mode=ro", uri=True, timeout=30,
+                                   check_same_thread=False, cached_statements=0)
+            conn.execute(f"PRAGMA cache_size = {-QUERY_CACHE_MB * 1024}")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            conn.row_factory = sqlite3.Row
+            conn.set_authorizer(self._authorize_query)
+            with self._connections_lock:
+                self._connections[conn] = threading.current_thread()
+                self._local.query_generation = self._generation
+            self._local.query_conn = conn
+        return conn
+    
+    def _authorize_query(self, action, arg1, arg2, db_name, source):
+        if getattr(self._local, 'unrestricted', False) or action in QUERY_ACTIONS:
+            return sqlite3.SQLITE_OK
+        if action == sqlite3.SQLITE_PRAGMA and (arg2 is None or arg1.lower() in QUERY_PRAGMAS):
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+    
+    @contextlib.contextmanager
+    def unrestricted(self):
+        """Lift the authorizer of this thread's read-only connection (for internal statements only)."""
+        previous = getattr(self._local, 'unrestricted', False)
+        self._local.unrestricted = True
+        try:
+            yield
+        finally:
+            self._local.unrestricted = previous
+    
+    def _close(self, conn):
+        with self._connections_lock:
+            self._connections.pop(conn, None)
+        conn.close()
     
     def disconnect(self):
-        """Close the database connection."""
-        if self._conn:
-            self._conn.close()
-            self._conn = None
+        """Close the database connections of the current thread."""
+        for attribute in ('conn', 'query_conn'):
+            conn = getattr(self._local, attribute, None)
+            if conn:
+                self._close(conn)
+                setattr(self._local, attribute, None)
     
-    def execute_query(self, query, params=None):
-        """Execute a query and return the results as a list of dictionaries."""
+    def close_stale(self):
+        """Close this thread's connections retired by close_idle, unless it is in a transaction on them."""
+        for attribute, generation in (('conn', 'generation'), ('query_conn', 'query_generation')):
+            conn = getattr(self._local, attribute, None)
+            if not conn or getattr(self._local, generation) == self._generation:
+                continue
+            with self._connections_lock:
+                closed = conn not in self._connections
+            if closed or not conn.in_transaction:
+                self._close(conn)
+                setattr(self._local, attribute, None)
+    
+    def close_idle(self):
+        """Close the connections that are known to be idle and retire the others.
+        
+        Connections of threads that have ended are closed, and so are this
+        thread's own connections outside of a transaction. A connection of
+        another running thread may be in the middle of a query, so it is only
+        retired: its thread closes it and opens a new one on its next
+        connect() (or close_stale()).
+        
+        Returns:
+            int: The number of connections closed
+        """
+        current = threading.current_thread()
+        with self._connections_lock:
+            self._generation += 1
+            idle = [conn for conn, thread in self._connections.items()
+                    if not thread.is_alive() or (thread is current and not conn.in_transaction)]
+            for conn in idle:
+                del self._connections[conn]
+        for conn in idle:
+            conn.close()
+        return len(idle)
+    
+    def close_all(self):
+        """Close the connections of all threads. Each thread reconnects on its next query.
+        
+        Only for when no other thread can be running a query on this ledger
+        (e.g. at shutdown); otherwise use close_idle.
+        
+        Returns:
+            int: The number of connections closed
+        """
+        with self._connections_lock:
+            connections = list(self._connections)
+            self._connections = {}
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+        return len(connections)
+    
+    @property
+    def has_connections(self):
+        with self._connections_lock:
+            return bool(self._connections)
+    
+    def ensure_schema(self, ddl_file):
+        """Create the tables of a DDL file in data/ddl/ if they do not exist yet.
+        
+        The DDL must use IF NOT EXISTS. Call it outside of a transaction:
+        executescript commits whatever is pending first.
+        
+        Args:
+            ddl_file (str): The name of the DDL file (without path)
+        """
+        if ddl_file in self._ensured_ddl:
+            return
+        script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+        ddl_path = script_dir.parent.parent / 'data' / 'ddl' / ddl_file
+        with open(ddl_path, 'r', encoding='utf-8') as f:
+            self.connect().executescript(f.read())
+        self._ensured_ddl.add(ddl_file)
+    
+    def ensure_column(self, table, column, definition):
+        """Add a column to a table of a database created before the column existed.
+        
+        Call it outside of a transaction.
+        
+        Args:
+            table (str): The table
+            column (str): The column name
+            definition (str): Type and constraints, as in ALTER TABLE ... ADD COLUMN
+        
+        Returns:
+            bool: True if the column was added now
+        """
+        if (table, column) in self._ensured_columns:
+            return False
         conn = self.connect()
+        columns = [row['name'] for row in conn.execute(f"PRAGMA table_info({table})")]
+        added = column not in columns
+        if added:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            conn.commit()
+        self._ensured_columns.add((table, column))
+        return added
+    
+    def add_change_listener(self, listener, tables=("transactions",)):
+        """Register a function to be called after transactions (or other tables) are written.
+        
+        The listener is called with an event dict on the thread that did the
+        write, after the commit. Every event has a "type" and the "table"
+        written. Events of transactions also have the "months" (YYYY-MM) and
+        "account_ids" touched by the write, except "year_archived" and
+        "year_restored", which move rows between files without changing them
+        and have the "year" instead; events of accounts, categories and tags
+        ("account_added", "tag_deleted", ...) have the id instead.
+        
+        Args:
+            listener (callable): Function taking the event dict
+            tables (tuple): The tables to be notified about (None for all)
+        """
+        self._change_listeners.append((listener, tables))
+    
+    def notify_change(self, event):
+        """Call the registered change listeners with an event."""
+        event.setdefault("table", "transactions")
+        _call_listeners(self._change_listeners, event)
+    
+    def add_write_hook(self, hook):
+        """Register a function to be called inside transaction writes, before the commit.
+        
+        Unlike a change listener, the hook runs in the database transaction
+        of the write, so whatever it writes is committed or rolled back
+        together with the transactions. It is called with
+        (cursor, where, params, sign): the transactions matching the WHERE
+        clause were just added (sign 1) or are about to be removed (sign -1).
+        Updates call it before (-1) and after (1) the change. An exception
+        fails the write. The hook must not commit.
+        
+        Args:
+            hook (callable): Function taking (cursor, where, params, sign)
+        """
+        self._write_hooks.append(hook)
+    
+    def run_write_hooks(self, cursor, where, params, sign):
+        """Call the write hooks for the transactions matching a WHERE clause (see add_write_hook)."""
+        for hook in list(self._write_hooks):
+            hook(cursor, where, params, sign)
+    
+    def run_write_hooks_ids(self, cursor, transaction_ids, sign):
+        """Call the write hooks for a list of transactions (see add_write_hook)."""
+        if not self._write_hooks:
+            return
+        for start in range(0, len(transaction_ids), ID_CHUNK_SIZE):
+            chunk = list(transaction_ids[start:start + ID_CHUNK_SIZE])
+            placeholders = ', '.join(['?' for _ in chunk])
+            self.run_write_hooks(cursor, f"transaction_id IN ({placeholders})", chunk, sign)
+    
+    def set_categorizer(self, factory):
+        """Set the categorization stage of the CSV import.
+        
+        Args:
+            factory (callable): Function returning an object with a
+                categorize(account_id, amount, *texts) method that gives a
+                category_id or None. It is called once per import, before the
+                import transaction starts.
+        """
+        self._categorizer_factory = factory
+    
+    def get_affected(self, cursor, where, params=()):
+        """Get the months and accounts of the transactions matching a WHERE clause.
+        
+        Args:
+            cursor (cursor): database cursor
+            where (str): WHERE clause on the transactions table
+            params (tuple): Parameters for the WHERE clause
+        
+        Returns:
+            dict: {"months": [YYYY-MM, ...], "account_ids": [int, ...]}
+        """
+        cursor.execute(f"""
+        SELECT DISTINCT strftime('%Y-%m', transaction_date) AS month, account_id
+        FROM transactions WHERE {where}
+        """, params)
+        rows = cursor.fetchall()
+        return {
+            "months": sorted({row['month'] for row in rows if row['month']}),
+            "account_ids": sorted({row['account_id'] for row in rows})
+        }
+    
+    def get_affected_ids(self, cursor, transaction_ids):
+        """Get the months and accounts of a list of transactions (see get_affected)."""
+        months = set()
+        account_ids = set()
+        for start in range(0, len(transaction_ids), ID_CHUNK_SIZE):
+            chunk = transaction_ids[start:start + ID_CHUNK_SIZE]
+            placeholders = ', '.join(['?' for _ in chunk])
+            affected = self.get_affected(cursor, f"transaction_id IN ({placeholders})", chunk)
+            months.update(affected["months"])
+            account_ids.update(affected["account_ids"])
+        return {"months": sorted(months), "account_ids": sorted(account_ids)}
+    
+    def execute_query(self, query, params=None, read_only=False):
+        """Execute a query and return the results as a list of dictionaries.
+        
+        read_only runs it on the read-only query connection (see connect_read_only).
+        """
+        conn = self.connect_read_only() if read_only else self.connect()
         cursor = conn.cursor()
         
         if params:
@@ -49,9 +376,12 @@ class DatabaseManager:
         results = [dict(row) for row in cursor.fetchall()]
         return results
     
-    def execute_query_as_df(self, query, params=None):
-        """Execute a query and return the results as a pandas DataFrame."""
-        conn = self.connect()
+    def execute_query_as_df(self, query, params=None, read_only=False):
+        """Execute a query and return the results as a pandas DataFrame.
+        
+        read_only runs it on the read-only query connection (see connect_read_only).
+        """
+        conn = self.connect_read_only() if read_only else self.connect()
         
         if params:
             df = pd.read_sql_query(query, conn, params=params)
@@ -65,12 +395,16 @@ class DatabaseManager:
         conn = self.connect()
         cursor = conn.cursor()
         
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-            
-        conn.commit()
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            conn.commit()
+        except Exception:
+            # Do not keep the write lock of the failed statement
+            conn.rollback()
+            raise
         return cursor.rowcount
     
     def insert_record(self, table, data):
@@ -91,8 +425,13 @@ class DatabaseManager:
         
         conn = self.connect()
         cursor = conn.cursor()
-        cursor.execute(query, values)
-        conn.commit()
+        try:
+            cursor.execute(query, values)
+            conn.commit()
+        except Exception:
+            # Do not keep the write lock of the failed insert (e.g. a duplicate name)
+            conn.rollback()
+            raise
         
         return cursor.lastrowid
 
@@ -130,8 +469,12 @@ class DatabaseManager:
         
         conn = self.connect()
         cursor = conn.cursor()
-        cursor.execute(query, (condition_value,))
-        conn.commit()
+        try:
+            cursor.execute(query, (condition_value,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
         
         return cursor.rowcount
     
@@ -169,6 +512,166 @@ class DatabaseManager:
         """
         return self.execute_query(query, (transaction_id,))
     
+    def add_transactions(self, transactions):
+        """Insert transactions and their tag links in one database transaction.
+        
+        Args:
+            transactions (list): Dicts with account_id, category_id, amount and
+                transaction_date, and optionally item_name, description, memo
+                and tags (list of tag ids)
+        
+        Returns:
+            dict: {"success": True, "transaction_ids": [...]} in the order given
+        """
+        for index, transaction in enumerate(transactions):
+            missing = [field for field in REQUIRED_TRANSACTION_FIELDS if transaction.get(field) is None]
+            if missing:
+                return {"success": False, "error": f"Transaction {index}: {', '.join(missing)} is required"}
+        if not transactions:
+            return {"success": True, "transaction_ids": []}
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            # IMMEDIATE takes the write lock up front, so the AUTOINCREMENT ids
+            # assigned by the executemany below are consecutive
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0),
+                COALESCE((SELECT MAX(transaction_id) FROM transactions), 0)
+            ) AS last_id
+            """)
+            first_id = cursor.fetchone()['last_id'] + 1
+            
+            columns = ', '.join(TRANSACTION_FIELDS)
+            placeholders = ', '.join(['?' for _ in TRANSACTION_FIELDS])
+            cursor.executemany(
+                f"INSERT INTO transactions ({columns}) VALUES ({placeholders})",
+                [tuple(transaction.get(field) for field in TRANSACTION_FIELDS) for transaction in transactions]
+            )
+            transaction_ids = list(range(first_id, first_id + len(transactions)))
+            
+            cursor.execute("SELECT MAX(transaction_id) AS last_id FROM transactions")
+            if cursor.fetchone()['last_id'] != transaction_ids[-1]:
+                raise RuntimeError("Unexpected transaction ids assigned")
+            
+            cursor.executemany(
+                "INSERT INTO transaction_tags (transaction_id, tag_id) VALUES (?, ?)",
+                [(transaction_id, tag_id)
+                 for transaction_id, transaction in zip(transaction_ids, transactions)
+                 for tag_id in (transaction.get('tags') or [])]
+            )
+            
+            self.run_write_hooks(cursor, "transaction_id BETWEEN ? AND ?",
+                                 (transaction_ids[0], transaction_ids[-1]), 1)
+            affected = self.get_affected(cursor, "transaction_id BETWEEN ? AND ?",
+                                         (transaction_ids[0], transaction_ids[-1]))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e)}
+        
+        self.notify_change({"type": "transaction_added", "transaction_ids": transaction_ids, **affected})
+        return {"success": True, "transaction_ids": transaction_ids}
+    
+    def update_transactions(self, updates):
+        """Update transactions in one database transaction.
+        
+        Args:
+            updates (list): Dicts with transaction_id and the fields to change.
+                If tags (list of tag ids) is given, it replaces the tag links.
+        
+        Returns:
+            dict: {"success": True, "updated": int}
+        """
+        if any(update.get('transaction_id') is None for update in updates):
+            return {"success": False, "error": "transaction_id is required"}
+        if not updates:
+            return {"success": True, "updated": 0}
+        
+        transaction_ids = [update['transaction_id'] for update in updates]
+        
+        # Updates changing the same set of columns share one executemany
+        groups = {}
+        for update in updates:
+            fields = tuple(field for field in TRANSACTION_FIELDS if field in update)
+            if fields:
+                groups.setdefault(fields, []).append(update)
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            before = self.get_affected_ids(cursor, transaction_ids)
+            self.run_write_hooks_ids(cursor, transaction_ids, -1)
+            
+            for fields, group in groups.items():
+                assignments = ', '.join(f"{field} = ?" for field in fields)
+                cursor.executemany(
+                    f"UPDATE transactions SET {assignments} WHERE transaction_id = ?",
+                    [tuple(update[field] for field in fields) + (update['transaction_id'],) for update in group]
+                )
+                if cursor.rowcount != len(group):
+                    raise ValueError("Some transactions were not found")
+            
+            tag_updates = [update for update in updates if update.get('tags') is not None]
+            if tag_updates:
+                cursor.executemany("DELETE FROM transaction_tags WHERE transaction_id = ?",
+                                   [(update['transaction_id'],) for update in tag_updates])
+                cursor.executemany(
+                    "INSERT INTO transaction_tags (transaction_id, tag_id) VALUES (?, ?)",
+                    [(update['transaction_id'], tag_id) for update in tag_updates for tag_id in update['tags']]
+                )
+            
+            self.run_write_hooks_ids(cursor, transaction_ids, 1)
+            after = self.get_affected_ids(cursor, transaction_ids)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e)}
+        
+        self.notify_change({
+            "type": "transactions_updated",
+            "transaction_ids": transaction_ids,
+            "months": sorted(set(before["months"]) | set(after["months"])),
+            "account_ids": sorted(set(before["account_ids"]) | set(after["account_ids"]))
+        })
+        return {"success": True, "updated": len(updates)}
+    
+    def delete_transactions(self, transaction_ids):
+        """Delete transactions and their tag links in one database transaction.
+        
+        Args:
+            transaction_ids (list): Ids of the transactions to delete
+        
+        Returns:
+            dict: {"success": True, "deleted": int}
+        """
+        if not transaction_ids:
+            return {"success": True, "deleted": 0}
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            affected = self.get_affected_ids(cursor, transaction_ids)
+            self.run_write_hooks_ids(cursor, transaction_ids, -1)
+            params = [(transaction_id,) for transaction_id in transaction_ids]
+            cursor.executemany("DELETE FROM transaction_tags WHERE transaction_id = ?", params)
+            cursor.executemany("DELETE FROM transactions WHERE transaction_id = ?", params)
+            deleted = cursor.rowcount
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e)}
+        
+        self.notify_change({"type": "transactions_deleted", "transaction_ids": transaction_ids, **affected})
+        return {"success": True, "deleted": deleted}
+    
     def add_account(self, name, account_type, currency="JPY"):
         """Add a new account."""
         data = {
@@ -178,6 +681,7 @@ class DatabaseManager:
         }
         try:
             account_id = self.insert_record("accounts", data)
+            self.notify_change({"type": "account_added", "table": "accounts", "account_id": account_id})
             return {"success": True, "account_id": account_id}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -190,6 +694,7 @@ class DatabaseManager:
         }
         try:
             category_id = self.insert_record("categories", data)
+            self.notify_change({"type": "category_added", "table": "categories", "category_id": category_id})
             return {"success": True, "category_id": category_id}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -201,6 +706,7 @@ class DatabaseManager:
         }
         try:
             tag_id = self.insert_record("tags", data)
+            self.notify_change({"type": "tag_added", "table": "tags", "tag_id": tag_id})
             return {"success": True, "tag_id": tag_id}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -208,7 +714,8 @@ class DatabaseManager:
     def delete_account(self, account_id):
         """Delete an account."""
         try:
-            self.delete_record("accounts", "account_id", account_id)
+            if self.delete_record("accounts", "account_id", account_id):
+                self.notify_change({"type": "account_deleted", "table": "accounts", "account_id": account_id})
             return {"success": True}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -216,7 +723,8 @@ class DatabaseManager:
     def delete_category(self, category_id):
         """Delete a category."""
         try:
-            self.delete_record("categories", "category_id", category_id)
+            if self.delete_record("categories", "category_id", category_id):
+                self.notify_change({"type": "category_deleted", "table": "categories", "category_id": category_id})
             return {"success": True}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -224,33 +732,119 @@ class DatabaseManager:
     def delete_tag(self, tag_id):
         """Delete a tag."""
         try:
-            self.delete_record("tags", "tag_id", tag_id)
+            if self.delete_record("tags", "tag_id", tag_id):
+                self.notify_change({"type": "tag_deleted", "table": "tags", "tag_id": tag_id})
             return {"success": True}
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    def get_data_logs(self):
+        """Get all import logs with the number of transactions each one added."""
+        self.ensure_schema('indexes.sql')
+        return self.execute_query("""
+        SELECT l.*, (SELECT COUNT(*) FROM transactions t WHERE t.log_id = l.log_id) AS transaction_count
+        FROM data_logs l
+        ORDER BY l.log_id DESC
+        """)
+    
+    def delete_data_log(self, log_id, restore_file=False):
+        """Undo an import: delete a data_logs entry with its transactions and their tag links.
+        
+        Args:
+            log_id (int): The id of the data_logs entry
+            restore_file (bool): Move the imported file from the dust folder back to the CSV folder
+        
+        Returns:
+            dict: Result of the operation
+        """
+        # The deletes below look transactions up by log_id
+        self.ensure_schema('indexes.sql')
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT * FROM data_logs WHERE log_id = ?", (log_id,))
+            log = cursor.fetchone()
+            if not log:
+                conn.rollback()
+                return {"success": False, "error": f"Data log not found: {log_id}"}
+            
+            affected = self.get_affected(cursor, "log_id = ?", (log_id,))
+            self.run_write_hooks(cursor, "log_id = ?", (log_id,), -1)
+            
+            cursor.execute("""
+            DELETE FROM transaction_tags
+            WHERE transaction_id IN (SELECT transaction_id FROM transactions WHERE log_id = ?)
+            """, (log_id,))
+            tags_deleted = cursor.rowcount
+            
+            cursor.execute("DELETE FROM transactions WHERE log_id = ?", (log_id,))
+            transactions_deleted = cursor.rowcount
+            
+            cursor.execute("DELETE FROM data_logs WHERE log_id = ?", (log_id,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return {"success": False, "error": str(e)}
+        
+        # Rollups (materialized components, recurring series, ...) are updated by the listeners
+        self.notify_change({"type": "import_deleted", "log_id": log_id, "count": transactions_deleted, **affected})
+        
+        result = {
+            "success": True,
+            "log_id": log_id,
+            "transactions_deleted": transactions_deleted,
+            "tags_deleted": tags_deleted
+        }
+        
+        if restore_file:
+            # Same filename format as load_csv_file: {data_collector}_{update_date}.csv
+            filename = f"{log['data_collector']}_{log['update_date']}.csv"
+            dust_path = self.get_dust_dir() / filename
+            csv_path = self.get_csv_dir() / filename
+            if not dust_path.exists():
+                result["restore_error"] = f"File not found in data/dust: {filename}"
+            elif csv_path.exists():
+                result["restore_error"] = f"File already exists in data/csv: {filename}"
+            else:
+                csv_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(dust_path), str(csv_path))
+                result["restored_file"] = filename
+        
+        return result
+    
+    def get_csv_dir(self):
+        """Get the directory that collectors drop this ledger's files into (see LedgerManager.get_import_dirs)."""
+        return self.csv_dir
+    
+    def get_dust_dir(self):
+        """Get the directory that imported files are moved to."""
+        return self.dust_dir
+    
     def get_csv_files(self):
-        """Get list of CSV files in data/csv/ directory."""
-        script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
-        csv_dir = script_dir.parent.parent / 'data' / 'csv'
+        """Get list of CSV files in the ledger's CSV directory."""
+        csv_dir = self.get_csv_dir()
         if not csv_dir.exists():
             csv_dir.mkdir(parents=True, exist_ok=True)
         
         files = [f.name for f in csv_dir.glob('*.csv')]
         return files
     
-    def load_csv_file(self, filename):
+    def load_csv_file(self, filename, progress_callback=None, progress_interval=500):
         """Load data from a CSV file into the database.
         
         Args:
             filename (str): The name of the CSV file (without path)
+            progress_callback (callable): Optional function called with the number of rows processed so far
+            progress_interval (int): Number of rows between progress_callback calls
             
         Returns:
             dict: Result of the operation
         """
-        script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
-        csv_path = script_dir.parent.parent / 'data' / 'csv' / filename
-        dust_dir = script_dir.parent.parent / 'data' / 'dust'
+        csv_path = self.get_csv_dir() / filename
+        dust_dir = self.get_dust_dir()
         
         if not csv_path.exists():
             return {"success": False, "error": f"File not found: {filename}"}
@@ -268,12 +862,16 @@ class DatabaseManager:
             data_collector = parts[0]
             update_date = '_'.join(parts[1:]).replace('.csv', '')
             
+            # Rules for rows that come without a category
+            categorizer = self._categorizer_factory() if self._categorizer_factory else None
+            
             conn = self.connect()
             cursor = conn.cursor()
             
             try:
-                # Begin transaction
-                cursor.execute("BEGIN TRANSACTION")
+                # IMMEDIATE: the write hooks read before rows are written, and a deferred
+                # transaction fails with "database is locked" if another write commits in between
+                cursor.execute("BEGIN IMMEDIATE")
                 
                 # Insert into data_logs
                 log_data = {
@@ -286,12 +884,17 @@ class DatabaseManager:
                 # Read CSV file
                 transactions_inserted = 0
                 tags_inserted = 0
+                rows_processed = 0
                 
                 with open(csv_path, 'r', encoding='utf-8') as csvfile:
                     reader = csv.reader(csvfile)
                     headers = next(reader)  # Skip header row
                     
                     for row in reader:
+                        rows_processed += 1
+                        if progress_callback and rows_processed % progress_interval == 0:
+                            progress_callback(rows_processed)
+                        
                         if len(row) < 5:  # Ensure there's at least date, account, category_type, category_name, amount
                             continue
                         
@@ -330,10 +933,22 @@ class DatabaseManager:
                             #account_id = self.insert_record("accounts", account_data)
                             account_id = self.insert_record_withCur_notCommit(cursor, "accounts", account_data)
                         
+                        # Rows without a category are classified by the categorization rules
+                        category_id = None
+                        if not category_name:
+                            if categorizer:
+                                category_id = categorizer.categorize(account_id, amount, item_name, description, memo)
+                            if category_id is None:
+                                category_type = category_type or ("income" if amount > 0 else "expense")
+                                category_name = UNCATEGORIZED_NAME
+                        
                         # Get category_id from categories table, or create if not exists
-                        cursor.execute("SELECT category_id FROM categories WHERE name = ? AND type = ?", 
-                                      (category_name, category_type))
-                        result = cursor.fetchone()
+                        if category_id is None:
+                            cursor.execute("SELECT category_id FROM categories WHERE name = ? AND type = ?", 
+                                          (category_name, category_type))
+                            result = cursor.fetchone()
+                        else:
+                            result = {"category_id": category_id}
                         if result:
                             category_id = result['category_id']
                         else:
@@ -381,12 +996,22 @@ class DatabaseManager:
                             )
                             tags_inserted += 1
                 
+                self.run_write_hooks(cursor, "log_id = ?", (log_id,), 1)
+                affected = self.get_affected(cursor, "log_id = ?", (log_id,))
+                
                 # Commit the transaction
                 conn.commit()
                 
+                if progress_callback:
+                    progress_callback(rows_processed)
+                
                 # Move the file to dust directory
                 shutil.move(str(csv_path), str(dust_dir / filename))
                 
+                self.notify_change({
+                    "type": "import", "log_id": log_id, "filename": filename, "count": transactions_inserted, **affected
+                })
+                
                 return {
                     "success": True, 
                     "transactions_inserted": transactions_inserted,
@@ -424,12 +1049,271 @@ class DatabaseManager:
                 "error": str(e)
             })
 
-# Create a global instance for easy access
-db = DatabaseManager()
+class LedgerManager:
+    """Named ledgers, each with its own SQLite file.
+    
+    A DatabaseManager is created the first time a ledger is used and kept,
+    together with its caches. Connections are opened lazily; when a request
+    or job enters use() and more than `max_open` ledgers have open
+    connections, the idle connections of the least recently used ones are
+    closed (see DatabaseManager.close_idle) and reopened on their next
+    query. Ledgers in use are never touched, and neither is a connection
+    another thread may be querying on.
+    
+    Change listeners and the categorizer are registered once here and apply
+    to every ledger; they run with that ledger as the current ledger.
+    """
+    
+    def __init__(self, max_open=4):
+        self.max_open = max_open
+        self._ledgers = {}
+        self._recent = OrderedDict()  # least recently used first
+        self._in_use = {}
+        self._lock = threading.RLock()
+        self._change_listeners = []
+        self._write_hooks = []
+        self._initializers = []
+        self._categorizer_factory = None
+    
+    def get_data_dir(self):
+        script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+        return script_dir.parent.parent / 'data'
+    
+    def get_ledger_dir(self):
+        return self.get_data_dir() / 'db' / 'ledgers'
+    
+    def get_import_dirs(self, name):
+        """Get the (CSV, dust) directories of a ledger.
+        
+        data/csv/ and data/dust/ belong to the default ledger; every other
+        ledger has its own data/csv/ledgers/{name}/ and data/dust/ledgers/{name}/,
+        so a file is imported into the ledger whose folder it was dropped in.
+        """
+        data_dir = self.get_data_dir()
+        if name == DEFAULT_LEDGER:
+            return data_dir / 'csv', data_dir / 'dust'
+        return data_dir / 'csv' / 'ledgers' / name, data_dir / 'dust' / 'ledgers' / name
+    
+    def get_path(self, name):
+        if name == DEFAULT_LEDGER:
+            return None  # DatabaseManager's default location
+        if not LEDGER_NAME_RE.match(name or ""):
+            raise ValueError(f"Invalid ledger name '{name}' (letters, digits, '_' and '-' only)")
+        return self.get_ledger_dir() / f"{name}.sqlite"
+    
+    def exists(self, name):
+        return name == DEFAULT_LEDGER or self.get_path(name).exists()
+    
+    def names(self):
+        """Get the names of all ledgers, the default ledger first."""
+        ledger_dir = self.get_ledger_dir()
+        names = sorted(path.stem for path in ledger_dir.glob('*.sqlite')) if ledger_dir.exists() else []
+        return [DEFAULT_LEDGER] + [name for name in names if name != DEFAULT_LEDGER]
+    
+    def list_ledgers(self):
+        with self._lock:
+            ledgers = []
+            for name in self.names():
+                db = self._ledgers.get(name)
+                ledgers.append({
+                    "name": name,
+                    "open": bool(db and db.has_connections),
+                    "in_use": self._in_use.get(name, 0)
+                })
+            return ledgers
+    
+    def create(self, name):
+        """Create a new, empty ledger with all tables.
+        
+        Args:
+            name (str): The name of the ledger
+        
+        Returns:
+            DatabaseManager: The new ledger
+        """
+        if self.exists(name):
+            raise ValueError(f"Ledger '{name}' already exists")
+        path = self.get_path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.get_import_dirs(name)[0].mkdir(parents=True, exist_ok=True)
+        import init_db
+        init_db.init_database(path)
+        return self.get(name)
+    
+    def get(self, name=None):
+        """Get the DatabaseManager of a ledger (the current ledger by default).
+        
+        Called on every access through `db`, so it only looks the ledger up;
+        recency and closing least recently used ledgers are left to use().
+        """
+        name = name or current_ledger.get()
+        with self._lock:
+            db = self._ledgers.get(name)
+            if db is None:
+                if not self.exists(name):
+                    raise KeyError(f"Ledger '{name}' does not exist")
+                db = DatabaseManager(self.get_path(name), name, *self.get_import_dirs(name))
+                db.add_change_listener(lambda event, db=db: self._dispatch(db, event), tables=None)
+                db.add_write_hook(lambda *args, db=db: self._run_write_hooks(db, *args))
+                db.set_categorizer(lambda db=db: self._make_categorizer(db))
+                self._ledgers[name] = db
+                self._recent[name] = None
+                for initializer in list(self._initializers):
+                    self._initialize(db, initializer)
+        return db
+    
+    @contextlib.contextmanager
+    def use(self, name=None):
+        """Make a ledger the current ledger for a block of code.
+        
+        Args:
+            name (str): The name of the ledger (the current ledger by default)
+        
+        Yields:
+            DatabaseManager: The ledger
+        """
+        name = name or current_ledger.get()
+        with self._lock:
+            db = self.get(name)
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+            self._recent.move_to_end(name)
+            self._close_least_recent()
+        token = current_ledger.set(name)
+        try:
+            yield db
+        finally:
+            current_ledger.reset(token)
+            with self._lock:
+                self._in_use[name] -= 1
+                ledgers = list(self._ledgers.values())
+            # Connections of this thread retired while it was busy can be closed now
+            for ledger in ledgers:
+                ledger.close_stale()
+    
+    def _close_least_recent(self):
+        open_names = [name for name in self._recent if self._ledgers[name].has_connections]
+        for name in open_names[:max(0, len(open_names) - self.max_open)]:
+            if not self._in_use.get(name):
+                self._ledgers[name].close_idle()
+    
+    def add_change_listener(self, listener, tables=("transactions",)):
+        """Register a change listener for all ledgers (see DatabaseManager.add_change_listener)."""
+        self._change_listeners.append((listener, tables))
+    
+    def add_write_hook(self, hook, priority=DEFAULT_HOOK_PRIORITY):
+        """Register a write hook for all ledgers (see DatabaseManager.add_write_hook).
+        
+        Hooks run by priority, lowest first, and in the order they were
+        registered within the same priority, so the order does not depend
+        on which module is imported first.
+        
+        Args:
+            hook (callable): Function taking (cursor, where, params, sign)
+            priority (int): e.g. DERIVED_COLUMN_HOOK_PRIORITY for hooks other hooks read the result of
+        """
+        self._write_hooks.append((priority, len(self._write_hooks), hook))
+        self._write_hooks.sort(key=lambda entry: entry[:2])
+    
+    def add_initializer(self, initializer):
+        """Register a function called with each ledger's DatabaseManager when it is first used.
+        
+        For schema migrations of ledgers created by an older version. It runs
+        outside of any transaction, with the ledger as the current ledger.
+        
+        Args:
+            initializer (callable): Function taking the DatabaseManager
+        """
+        with self._lock:
+            self._initializers.append(initializer)
+            for db in list(self._ledgers.values()):
+                self._initialize(db, initializer)
+    
+    def _initialize(self, db, initializer):
+        try:
+            with self.use(db.name):
+                initializer(db)
+        except Exception as e:
+            print(f"Error initializing ledger {db.name}: {str(e)}")
+    
+    def set_categorizer(self, factory):
+        """Set the categorization stage for all ledgers (see DatabaseManager.set_categorizer)."""
+        self._categorizer_factory = factory
+    
+    def _dispatch(self, db, event):
+        with self.use(db.name):
+            _call_listeners(self._change_listeners, event)
+    
+    def _run_write_hooks(self, db, cursor, where, params, sign):
+        with self.use(db.name):
+            for _, _, hook in list(self._write_hooks):
+                hook(cursor, where, params, sign)
+    
+    def _make_categorizer(self, db):
+        if self._categorizer_factory is None:
+            return None
+        with self.use(db.name):
+            return self._categorizer_factory()
+
+
+class CurrentLedger:
+    """Stands in for the DatabaseManager of the current ledger.
+    
+    Attribute access is forwarded to the ledger of the current request or
+    job, so code written against one global `db` keeps working.
+    """
+    
+    def __init__(self, manager):
+        self._manager = manager
+    
+    def add_change_listener(self, listener, tables=("transactions",)):
+        self._manager.add_change_listener(listener, tables)
+    
+    def add_write_hook(self, hook, priority=DEFAULT_HOOK_PRIORITY):
+        self._manager.add_write_hook(hook, priority)
+    
+    def add_initializer(self, initializer):
+        self._manager.add_initializer(initializer)
+    
+    def set_categorizer(self, factory):
+        self._manager.set_categorizer(factory)
+    
+    def __getattr__(self, name):
+        return getattr(self._manager.get(), name)
+
+
+class PerLedger:
+    """One instance of a service per ledger, created on first use.
+    
+    For services holding caches or locks (compiled rules, search index, ...),
+    so ledgers never share them. Attribute access is forwarded to the instance
+    of the current ledger.
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+    
+    def get(self, name=None):
+        db = ledgers.get(name)
+        with self._lock:
+            instance = self._instances.get(db.name)
+            if instance is None:
+                instance = self._factory(db)
+                self._instances[db.name] = instance
+            return instance
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+# Create global instances for easy access
+ledgers = LedgerManager(max_open=int(os.environ.get("KAKEIBO_MAX_OPEN_LEDGERS", "4")))
+db = CurrentLedger(ledgers)
 
 # Example functions that can be called from Rust/Tauri
 def execute_query(sql):
-    return db.execute_query(sql)
+    # Ad-hoc SQL from the UI, so it runs on the read-only query connection
+    return db.execute_query(sql, read_only=True)
 
 def execute_sql(sql):
     return db.execute_sql_component(sql)
@@ -451,37 +1335,30 @@ def get_transactions(limit=100, offset=0):
     return json.dumps(transactions, default=db.json_serializer)
 
 def add_transaction(account_id, category_id, amount, description, transaction_date, memo="", tags=None):
-    conn = db.connect()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("BEGIN TRANSACTION")
-        
-        # Insert transaction
-        transaction_data = {
-            "account_id": account_id,
-            "category_id": category_id,
-            "amount": amount,
-            "description": description,
-            "transaction_date": transaction_date,
-            "memo": memo
-        }
-        transaction_id = db.insert_record("transactions", transaction_data)
-        
-        # Add tags if provided
-        if tags and isinstance(tags, list):
-            for tag_id in tags:
-                cursor.execute(
-                    "INSERT INTO transaction_tags (transaction_id, tag_id) VALUES (?, ?)",
-                    (transaction_id, tag_id)
-                )
-        
-        conn.commit()
-        return json.dumps({"success": True, "transaction_id": transaction_id})
-    
-    except Exception as e:
-        conn.rollback()
-        return json.dumps({"success": False, "error": str(e)})
+    result = db.add_transactions([{
+        "account_id": account_id,
+        "category_id": category_id,
+        "amount": amount,
+        "description": description,
+        "transaction_date": transaction_date,
+        "memo": memo,
+        "tags": tags if isinstance(tags, list) else None
+    }])
+    if not result["success"]:
+        return json.dumps(result)
+    return json.dumps({"success": True, "transaction_id": result["transaction_ids"][0]})
+
+def add_transactions(transactions):
+    result = db.add_transactions(transactions)
+    return json.dumps(result, default=db.json_serializer)
+
+def update_transactions(updates):
+    result = db.update_transactions(updates)
+    return json.dumps(result, default=db.json_serializer)
+
+def delete_transactions(transaction_ids):
+    result = db.delete_transactions(transaction_ids)
+    return json.dumps(result, default=db.json_serializer)
 
 # Master table management functions
 def add_account(name, account_type, currency="JPY"):
@@ -513,11 +1390,41 @@ def get_csv_files():
     files = db.get_csv_files()
     return json.dumps(files, default=db.json_serializer)
 
-def load_csv_file(filename):
-    result = db.load_csv_file(filename)
+def load_csv_file(filename, progress_callback=None):
+    result = db.load_csv_file(filename, progress_callback)
+    return json.dumps(result, default=db.json_serializer)
+
+def get_data_logs():
+    data_logs = db.get_data_logs()
+    return json.dumps(data_logs, default=db.json_serializer)
+
+def delete_data_log(log_id, restore_file=False):
+    result = db.delete_data_log(log_id, restore_file)
     return json.dumps(result, default=db.json_serializer)
 
 # SQL component management functions
+
+# Functions called with the name of a SQL component after it is saved or deleted
+_component_listeners = []
+
+def add_component_listener(listener):
+    """Register a function to be called with a component's name after it is saved or deleted.
+    
+    Lets caches derived from the components (e.g. which components read a
+    table) be dropped. Component files edited outside the API are not noticed.
+    
+    Args:
+        listener (callable): Function taking the component name
+    """
+    _component_listeners.append(listener)
+
+def _notify_component_change(name):
+    for listener in list(_component_listeners):
+        try:
+            listener(name)
+        except Exception as e:
+            print(f"Error in component listener for {name}: {str(e)}")
+
 def save_sql_component(component):
     """Save a SQL component to a JSON file.
     
@@ -559,6 +1466,7 @@ def save_sql_component(component):
         # Write the component to file
         with open(component_path, 'w', encoding='utf-8') as f:
             json.dump(component, f, ensure_ascii=False, indent=2, default=db.json_serializer)
+        _notify_component_change(name)
         
         return {"success": True, "message": f"SQL component '{name}' saved successfully"}
     except Exception as e:
@@ -587,12 +1495,11 @@ def get_sql_components():
         components = []
         for file in component_files:
             try:
-                with open(file, 'r', encoding='utf-8') as f:
-                    component = json.load(f)
-                    components.append({
-                        "name": component.get('name', file.stem),
-                        "description": component.get('description', '')
-                    })
+                component = _read_component_file(file)
+                components.append({
+                    "name": component.get('name', file.stem),
+                    "description": component.get('description', '')
+                })
             except Exception as e:
                 print(f"Error loading component {file}: {str(e)}")
         
@@ -601,6 +1508,24 @@ def get_sql_components():
         print(f"Error getting SQL components: {str(e)}")
         return []
 
+# Parsed component files keyed by path, with the (mtime, size) they were read at
+_component_cache = {}
+_component_cache_lock = threading.Lock()
+
+def _read_component_file(component_path):
+    """Read a component JSON file, reusing the parsed result while the file is unchanged."""
+    stat = component_path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _component_cache_lock:
+        cached = _component_cache.get(component_path)
+    if cached is None or cached[0] != version:
+        with open(component_path, 'r', encoding='utf-8') as f:
+            cached = (version, json.load(f))
+        with _component_cache_lock:
+            _component_cache[component_path] = cached
+    # Callers may modify the component, so hand out a copy
+    return copy.deepcopy(cached[1])
+
 def get_sql_component(name):
     """Get a specific SQL component by name.
     
@@ -623,8 +1548,7 @@ def get_sql_component(name):
             return {"success": False, "error": f"SQL component '{name}' not found"}
         
         # Read the component from file
-        with open(component_path, 'r', encoding='utf-8') as f:
-            component = json.load(f)
+        component = _read_component_file(component_path)
         
         return {"success": True, "component": component}
     except Exception as e:
@@ -653,56 +1577,178 @@ def delete_sql_component(name):
             return {"success": False, "error": f"SQL component '{name}' not found"}
 
         os.remove(component_path)
+        _notify_component_change(name)
+        
+        # Drop the stored result if the component was materialized
+        import materialized
+        materialized.drop(name)
         return {"success": True}
 
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
-def run_sql_component(name, env_vars=None):
+def _prepare_sql_component(name, env_vars=None):
+    """Load a SQL component and fill in its environment variables.
+    
+    Returns:
+        tuple: (component, sql), or (None, error result) if the component cannot run
+    """
+    # Get the SQL component
+    component_result = get_sql_component(name)
+    if not component_result.get("success", False):
+        return None, component_result
+    
+    component = component_result.get("component", {})
+    
+    # Get the SQL from the component
+    sql = component.get("sql", "")
+    if not sql:
+        return None, {"success": False, "error": "SQL is required"}
+    
+    # Materialized components are read from their stored table,
+    # unless environment variables change the query
+    if component.get("materialized") and not env_vars:
+        return component, None
+    
+    # Replace environment variables in the SQL
+    if env_vars:
+        for var_name, var_value in env_vars.items():
+            sql = sql.replace(f"${var_name}", str(var_value))
+    return component, sql
+
+def _execute_sql_component(component, sql, max_points=None):
+    """Run a prepared SQL component (sql None means: read the materialized result).
+    
+    Args:
+        component (dict): The SQL component
+        sql (str): The SQL with environment variables filled in, or None
+        max_points (int): Overrides the number of points of a downsampled component
+    
+    Returns:
+        dict: Result of the operation, without the component
+    """
+    result = {"success": True}
+    if sql is None:
+        import materialized
+        try:
+            df, result["materialized"] = materialized.read(component)
+        except Exception as e:
+            return {"success": False, "error": f"Materialized component error: {str(e)}"}
+    else:
+        # Run the SQL, over the archived years too if the component or its date range needs them
+        try:
+            import archive
+            with archive.history(db, archive.route(component, sql), read_only=True):
+                df = db.execute_query_as_df(sql, read_only=True)
+        except Exception as e:
+            return {"success": False, "error": f"SQL execution error: {str(e)}"}
+    
+    # Reduce large results to about the number of points the chart draws
+    if component.get("downsample"):
+        import downsample
+        try:
+            df, result["downsampled"] = downsample.apply(df, downsample.get_config(component), max_points)
+        except Exception as e:
+            return {"success": False, "error": f"Downsample error: {str(e)}"}
+    
+    result["data"] = df.to_dict(orient="records")
+    result["columns"] = df.columns.tolist()
+    return result
+
+def run_sql_component(name, env_vars=None, max_points=None):
     """Run a SQL component with environment variables.
     
     Args:
         name (str): The name of the SQL component
         env_vars (dict): Environment variables for the SQL
+        max_points (int): Overrides the number of points of a downsampled component
         
     Returns:
         dict: Result of the operation
     """
     try:
-        # Get the SQL component
-        component_result = get_sql_component(name)
-        if not component_result.get("success", False):
-            return json.dumps(component_result)
+        component, sql = _prepare_sql_component(name, env_vars)
+        if component is None:
+            return json.dumps(sql)
+        
+        result = _execute_sql_component(component, sql, max_points)
+        result["component"] = component
+        return json.dumps(result, default=db.json_serializer)
+    except Exception as e:
+        return json.dumps({"success": False, "error": str(e)})
+
+# Worker threads for run_sql_components. They live as long as the process,
+# so each keeps its own (thread-local) read connection between batches.
+_batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("KAKEIBO_BATCH_WORKERS", "4")),
+                                     thread_name_prefix="sql-component")
+
+def run_sql_components(runs):
+    """Run several SQL components concurrently.
+    
+    Each component runs on its own read connection. Runs that resolve to
+    the same query (same SQL after environment variables, or the same
+    materialized component) execute once and share the result.
+    
+    Args:
+        runs (list): [{"name": str, "env_vars": dict, "max_points": int}, ...]
         
-        component = component_result.get("component", {})
+    Returns:
+        str: JSON with "results" (in request order) and a per-component "timings" breakdown
+    """
+    try:
+        start = time.perf_counter()
+        prepared = []
+        queries = {}
+        for run in runs:
+            name = run.get("name")
+            component, sql = _prepare_sql_component(name, run.get("env_vars"))
+            if component is None:
+                prepared.append((name, None, sql, None))
+                continue
+            max_points = run.get("max_points")
+            key = ("materialized", name) if sql is None else ("sql", sql, bool(component.get("history")))
+            key += (json.dumps(component.get("downsample"), sort_keys=True), max_points)
+            if key not in queries:
+                queries[key] = (component, sql, max_points)
+            prepared.append((name, component, sql, key))
         
-        # Get the SQL from the component
-        sql = component.get("sql", "")
-        if not sql:
-            return json.dumps({"success": False, "error": "SQL is required"})
+        def timed(component, sql, max_points):
+            query_start = time.perf_counter()
+            result = _execute_sql_component(component, sql, max_points)
+            return result, (time.perf_counter() - query_start) * 1000
         
-        # Replace environment variables in the SQL
-        if env_vars:
-            for var_name, var_value in env_vars.items():
-                sql = sql.replace(f"${var_name}", str(var_value))
+        # Run with the ledger of the request on the worker threads
+        futures = {
+            key: _batch_executor.submit(contextvars.copy_context().run, timed, component, sql, max_points)
+            for key, (component, sql, max_points) in queries.items()
+        }
         
-        # Run the SQL
-        try:
-            df = db.execute_query_as_df(sql)
-            
-            # Convert DataFrame to JSON
-            return json.dumps({
-                "success": True,
-                "data": df.to_dict(orient="records"),
-                "columns": df.columns.tolist(),
-                "component": component
-            }, default=db.json_serializer)
-        except Exception as e:
-            return json.dumps({
-                "success": False,
-                "error": f"SQL execution error: {str(e)}",
-                "component": component
+        results = []
+        timings = []
+        first_name = {}
+        for name, component, sql, key in prepared:
+            if component is None:
+                results.append({"name": name, **sql})
+                timings.append({"name": name, "elapsed_ms": 0.0, "shared_with": None})
+                continue
+            result, elapsed_ms = futures[key].result()
+            results.append({"name": name, **result, "component": component})
+            timings.append({
+                "name": name,
+                "elapsed_ms": round(elapsed_ms, 2),
+                "rows": len(result.get("data", [])),
+                # Set when the result was reused from an identical query earlier in the batch
+                "shared_with": first_name.get(key)
             })
+            first_name.setdefault(key, name)
+        
+        return json.dumps({
+            "success": True,
+            "results": results,
+            "timings": timings,
+            "queries_executed": len(queries),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+        }, default=db.json_serializer)
     except Exception as e:
         return json.dumps({"success": False, "error": str(e)})
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+import numpy as np
+import pandas as pd
+
+METHODS = ("lttb", "minmax", "top_n")
+
+# Default number of points to keep: about the width of the charts in d3code
+DEFAULT_POINTS = 600
+
+OTHER_LABEL = "その他"
+
+
+def get_config(component):
+    """Get the downsampling settings of a SQL component.
+
+    Declared in the component JSON, e.g.
+    {"method": "lttb", "x": "date", "y": "amount", "points": 600},
+    {"method": "minmax", "x": "date", "y": "amount", "series": "account"} or
+    {"method": "top_n", "label": "category", "value": "total", "n": 8}
+    (the 7 rows largest in absolute value, so that negative expense totals
+    rank by size too, plus one その他 row summing the rest).
+
+    Args:
+        component (dict): The SQL component
+
+    Returns:
+        dict: The settings, or None if the component is not downsampled
+    """
+    config = component.get("downsample")
+    if not config:
+        return None
+    method = config.get("method")
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsample method '{method}' (expected one of {', '.join(METHODS)})")
+    required = ("label", "value") if method == "top_n" else ("x", "y")
+    missing = [key for key in required if not config.get(key)]
+    if missing:
+        raise ValueError(f"Downsample method '{method}' needs {', '.join(missing)}")
+    return config
+
+
+def _numeric(values):
+    """Get a column as floats; dates (or date strings) become seconds since the epoch."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    dates = pd.to_datetime(values, errors='coerce')
+    return (dates - pd.Timestamp(0)).dt.total_seconds().to_numpy(dtype=float, na_value=np.nan)
+
+
+def lttb_indices(x, y, threshold):
+    """Pick `threshold` points of a series with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last point and, for each bucket in between, the
+    point forming the largest triangle with the previously kept point and
+    the average of the next bucket, which preserves peaks and the shape.
+
+    Args:
+        x (ndarray): x values, ascending
+        y (ndarray): y values
+        threshold (int): Number of points to keep
+
+    Returns:
+        ndarray: Positions of the kept points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    indices[-1] = n - 1
+    return indices
+
+
+def minmax_indices(y, buckets):
+    """Keep the lowest and highest point of each of `buckets` equal-sized buckets (plus the ends).
+
+    Args:
+        y (ndarray): y values, in x order
+        buckets (int): Number of buckets
+
+    Returns:
+        ndarray: Positions of the kept points, ascending
+    """
+    n = len(y)
+    if buckets * 2 >= n or buckets < 1:
+        return np.arange(n)
+    values = pd.Series(y)
+    bucket = np.arange(n) * buckets // n
+    grouped = values.groupby(bucket)
+    kept = np.concatenate([grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy(), [0, n - 1]])
+    return np.unique(kept)
+
+
+def _reduce_series(df, config, points):
+    df = df.sort_values(config["x"], kind="stable").reset_index(drop=True)
+    x = _numeric(df[config["x"]])
+    y = np.nan_to_num(_numeric(df[config["y"]]))
+    if config["method"] == "lttb":
+        indices = lttb_indices(np.nan_to_num(x), y, points)
+    else:
+        indices = minmax_indices(y, max(1, points // 2))
+    return df.iloc[indices]
+
+
+def _top_n(df, config, n):
+    if len(df) <= n:
+        return df
+    df = df.sort_values(config["value"], ascending=False, kind="stable", key=lambda values: values.abs())
+    top, rest = df.iloc[:n - 1], df.iloc[n - 1:]
+    # The remaining rows are folded into one row; numeric columns are summed
+    other = {
+        column: rest[column].sum() if pd.api.types.is_numeric_dtype(rest[column]) else None
+        for column in df.columns
+    }
+    other[config["label"]] = config.get("other_label", OTHER_LABEL)
+    return pd.concat([top, pd.DataFrame([other])], ignore_index=True)
+
+
+def apply(df, config, max_points=None):
+    """Reduce a component result to about the number of points a chart can show.
+
+    Args:
+        df (DataFrame): The component result
+        config (dict): The settings from get_config
+        max_points (int): Overrides the configured number of points (e.g. the chart width)
+
+    Returns:
+        tuple: (reduced DataFrame, {"method", "rows_before", "rows_after"})
+    """
+    rows_before = len(df)
+    if config["method"] == "top_n":
+        df = _top_n(df, config, max_points or config.get("n", 10))
+    else:
+        points = max_points or config.get("points", DEFAULT_POINTS)
+        series = config.get("series")
+        if series:
+            # Each series (e.g. one line per account) gets its own share of the points
+            groups = [group for _, group in df.groupby(series, sort=False)]
+            per_series = max(3, points // max(1, len(groups)))
+            df = pd.concat([_reduce_series(group, config, per_series) for group in groups],
+                           ignore_index=True) if groups else df
+        else:
+            df = _reduce_series(df, config, points).reset_index(drop=True)
+    return df, {"method": config["method"], "rows_before": rows_before, "rows_after": len(df)}
@@ -3,16 +3,18 @@ import os
 import sqlite3
 from pathlib import Path
 
-def init_database():
+def init_database(db_path=None):
     # Get the directory where the script is located
     script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
     
-    # Create the database directory if it doesn't exist
-    db_dir = script_dir.parent.parent / 'data' / 'db'
-    db_dir.mkdir(parents=True, exist_ok=True)
+    if db_path is None:
+        # Create the database directory if it doesn't exist
+        db_dir = script_dir.parent.parent / 'data' / 'db'
+        db_dir.mkdir(parents=True, exist_ok=True)
+        db_path = db_dir / 'database.sqlite'
+    db_path = Path(db_path)
     
     # Connect to the SQLite database (creates it if it doesn't exist)
-    db_path = db_dir / 'database.sqlite'
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
@@ -24,14 +26,21 @@ def init_database():
         'data_logs.sql',
         'tags.sql',
         'transactions.sql',
-        'transaction_tags.sql'
+        'transaction_tags.sql',
+        'indexes.sql',
+        'materialized_components.sql',
+        'recurring_series.sql',
+        'category_rules.sql',
+        'archive.sql',
+        'budgets.sql',
+        'exchange_rates.sql'
     ]
     
     for ddl_file in ddl_files:
         print(f"Executing DDL file: {ddl_file}")
         with open(ddl_dir / ddl_file, 'r') as f:
             sql = f.read()
-            cursor.execute(sql)
+            cursor.executescript(sql)
     
     # Commit the changes and close the connection
     conn.commit()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+import threading
+import queue
+import uuid
+import datetime
+from collections import OrderedDict
+
+import db_access
+
+
+class Job:
+    """A unit of background work and its progress."""
+
+    def __init__(self, kind, key, ledger=db_access.DEFAULT_LEDGER):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.ledger = ledger
+        self.status = "queued"  # queued -> running -> succeeded / failed
+        self.rows_total = None
+        self.rows_processed = 0
+        self.errors = []
+        self.result = None
+        self.created_at = datetime.datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        # Bumped on every change so streaming clients know when to send an update
+        self.version = 0
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed")
+
+    def rows_per_sec(self):
+        if not self.started_at:
+            return 0.0
+        end = self.finished_at or datetime.datetime.now()
+        elapsed = (end - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return 0.0
+        return round(self.rows_processed / elapsed, 1)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "key": self.key,
+            "ledger": self.ledger,
+            "status": self.status,
+            "rows_total": self.rows_total,
+            "rows_processed": self.rows_processed,
+            "rows_per_sec": self.rows_per_sec(),
+            "errors": list(self.errors),
+            "result": self.result,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobQueue:
+    """In-process job queue with a single worker thread.
+
+    Having exactly one worker serializes the writers: only one import touches
+    the database at a time, in submission order.
+    """
+
+    def __init__(self, db, max_finished_jobs=100):
+        self.db = db
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, kind, key, func):
+        """Submit a job.
+
+        The job runs on the ledger that is current when it is submitted.
+
+        Args:
+            kind (str): The kind of job (e.g. "import")
+            key (str): What the job works on. A queued or running job with the same kind and key
+                on the same ledger is reused.
+            func (callable): Function called with the Job on the worker thread. Its return value becomes job.result.
+
+        Returns:
+            Job: The new job, or the already active job for the same key
+        """
+        ledger = db_access.current_ledger.get()
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == kind and job.key == key and job.ledger == ledger and not job.finished:
+                    return job
+
+            job = Job(kind, key, ledger)
+            self._jobs[job.job_id] = job
+            self._prune()
+            self._ensure_worker()
+
+        self._queue.put((job, func))
+        return job
+
+    def submit_import(self, filename):
+        """Submit a CSV import for a file in data/csv/."""
+        return self.submit("import", filename, lambda job: self._run_import(job, filename))
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def report_progress(self, job, rows_processed, rows_total=None):
+        """Update the progress of a running job (called from the job's function)."""
+        if rows_total is None:
+            self._update(job, rows_processed=rows_processed)
+        else:
+            self._update(job, rows_processed=rows_processed, rows_total=rows_total)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._work, name="job-queue-worker", daemon=True)
+            self._worker.start()
+
+    def _prune(self):
+        # Drop the oldest finished jobs so the table does not grow forever
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _update(self, job, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.version += 1
+
+    def _work(self):
+        while True:
+            job, func = self._queue.get()
+            self._update(job, status="running", started_at=datetime.datetime.now())
+            try:
+                with db_access.ledgers.use(job.ledger):
+                    result = func(job)
+                if isinstance(result, dict) and not result.get("success", True):
+                    self._update(job, status="failed", result=result,
+                                 errors=job.errors + [result.get("error", "unknown error")],
+                                 finished_at=datetime.datetime.now())
+                else:
+                    self._update(job, status="succeeded", result=result,
+                                 finished_at=datetime.datetime.now())
+            except Exception as e:
+                self._update(job, status="failed", errors=job.errors + [str(e)],
+                             finished_at=datetime.datetime.now())
+            finally:
+                self._queue.task_done()
+
+    def _run_import(self, job, filename):
+        csv_path = self.db.get_csv_dir() / filename
+        if csv_path.exists():
+            # Count rows up front so clients can show a percentage
+            with open(csv_path, 'r', encoding='utf-8') as f:
+                self.report_progress(job, 0, max(0, sum(1 for _ in f) - 1))
+
+        return self.db.load_csv_file(
+            filename,
+            progress_callback=lambda rows: self.report_progress(job, rows)
+        )
+
+
+# Create a global instance for easy access
+jobs = JobQueue(db_access.db)
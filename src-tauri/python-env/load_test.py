@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+"""Load test for the API server.
+
+Replays a mix of dashboard traffic (transaction paging, SQL component
+runs, analytics), CSV imports, chat and /health polls from several
+threads at once against a generated ledger, and reports latency
+percentiles, throughput and error rates per endpoint.
+
+    python load_test.py --duration 30 --concurrency 8 --output result.json
+    python load_test.py --url http://127.0.0.1:8000 --baseline result.json
+
+Without --url the app is started in-process with uvicorn on a free port.
+The run fails (exit 1) when an endpoint's error rate is above
+--max-error-rate, which is 0 by default: any failed request fails it.
+Imports write CSV files into the ledger's CSV folder (data/csv/ledgers/{name}/)
+of this checkout, so the server must be running from it (and the CSV
+folder watcher should be off).
+"""
+import os
+import csv
+import json
+import math
+import time
+import random
+import argparse
+import datetime
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Relative weight of each operation in the mix
+DEFAULT_MIX = {
+    "transactions": 40,
+    "component": 20,
+    "totals": 10,
+    "health": 20,
+    "import": 5,
+    "chat": 5,
+}
+
+ACCOUNTS = [("現金", "cash"), ("三菱UFJ銀行", "bank"), ("楽天カード", "credit")]
+
+CATEGORIES = [
+    ("食費", "expense"), ("交通費", "expense"), ("住居費", "expense"), ("光熱費", "expense"),
+    ("日用品", "expense"), ("娯楽", "expense"), ("給与", "income")
+]
+
+ITEMS = ["スーパー", "コンビニ", "電車", "電気代", "ガス代", "映画", "書籍", "ドラッグストア", "ランチ", "カフェ"]
+
+CHAT_MESSAGES = ["先月の食費はいくら?", "今年の支出の合計", "一番大きい出費は?", "交通費の推移を教えて"]
+
+
+def percentile(sorted_values, fraction):
+    """Get a percentile (nearest rank) of values sorted in ascending order."""
+    if not sorted_values:
+        return None
+    # The rank is ceil(fraction * n); rounded first so that e.g. 0.07 * 100 is not taken as 7.000000000000001
+    rank = math.ceil(round(fraction * len(sorted_values), 9))
+    index = max(0, min(len(sorted_values) - 1, rank - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Collect the latency and outcome of each request, per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append((seconds, ok))
+
+    def summary(self, duration):
+        """Get count, errors, throughput and latency (ms) per endpoint, and overall."""
+        with self._lock:
+            samples = {endpoint: list(values) for endpoint, values in self._samples.items()}
+
+        def summarize(values):
+            latencies = sorted(seconds * 1000 for seconds, _ in values)
+            errors = sum(1 for _, ok in values if not ok)
+            return {
+                "count": len(values),
+                "errors": errors,
+                "error_rate": round(errors / len(values), 4) if values else 0.0,
+                "throughput": round(len(values) / duration, 2) if duration else 0.0,
+                "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+                "p50_ms": _round(percentile(latencies, 0.50)),
+                "p95_ms": _round(percentile(latencies, 0.95)),
+                "p99_ms": _round(percentile(latencies, 0.99)),
+                "max_ms": _round(latencies[-1] if latencies else None),
+            }
+
+        return {
+            "total": summarize([value for values in samples.values() for value in values]),
+            "endpoints": {endpoint: summarize(values) for endpoint, values in sorted(samples.items())}
+        }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+class Client:
+    """Minimal JSON client for the API, sending every request to one ledger."""
+
+    def __init__(self, base_url, ledger, recorder, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.ledger = ledger
+        self.recorder = recorder
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, params=None, endpoint=None):
+        """Send a request and record it under `endpoint` (e.g. "GET /transactions").
+
+        Returns:
+            dict: The decoded response, or None if the request failed
+        """
+        url = self.base_url + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method)
+        request.add_header("X-Ledger", self.ledger)
+        if data is not None:
+            request.add_header("Content-Type", "application/json")
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read() or b"null")
+            # Most endpoints report failures as {"success": false} with status 200
+            ok = not (isinstance(result, dict) and result.get("success") is False)
+        except (urllib.error.URLError, OSError, ValueError):
+            result, ok = None, False
+        if self.recorder is not None:
+            self.recorder.record(endpoint or f"{method} {path}", time.perf_counter() - start, ok)
+        return result if ok else None
+
+    def wait_for_job(self, job_id, poll_interval=0.2, timeout=300):
+        """Poll a job until it finishes; returns the job, or None if it failed or timed out."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.request("GET", f"/jobs/{job_id}", endpoint="GET /jobs/{job_id}")
+            if job is None:
+                return None
+            if job.get("status") == "succeeded":
+                return job
+            if job.get("status") == "failed":
+                return None
+            time.sleep(poll_interval)
+        return None
+
+
+class LoadTest:
+    """Generate a ledger and drive the mix of operations against it.
+
+    Each worker thread picks operations by weight in a closed loop (the
+    next request is sent as soon as the previous one returns), like a
+    dashboard refreshing its tiles as fast as the server lets it.
+    """
+
+    def __init__(self, base_url, ledger, mix=None, seed=0, component="all_monthly_expences"):
+        self.base_url = base_url
+        self.ledger = ledger
+        self.mix = dict(mix or DEFAULT_MIX)
+        self.seed = seed
+        self.component = component
+        self.recorder = Recorder()
+        self.transaction_count = 0
+        self._imports = 0
+        self._imports_lock = threading.Lock()
+        self._csv_files = []
+
+    def _client(self, recorded=True):
+        return Client(self.base_url, self.ledger, self.recorder if recorded else None)
+
+    # Setup
+
+    def generate(self, transactions=20000, months=24, batch_size=1000):
+        """Create the ledger (if needed) with accounts, categories and random transactions."""
+        client = self._client(recorded=False)
+        existing = client.request("GET", "/transactions", params={"limit": 1})
+        if existing is None:
+            # The ledger does not exist yet (404)
+            result = Client(self.base_url, "default", None).request("POST", "/ledgers", {"name": self.ledger})
+            if result is None:
+                raise RuntimeError(f"Could not create ledger '{self.ledger}'")
+            existing = []
+
+        if existing:
+            # Reusing a generated ledger; only count what is there
+            count = client.request("POST", "/execute_sql", {"sql": "SELECT COUNT(*) AS n FROM transactions"})
+            self.transaction_count = count["result"][0]["n"] if count else 0
+            return {"transactions": self.transaction_count, "generated": 0}
+
+        account_ids = []
+        for name, account_type in ACCOUNTS:
+            result = client.request("POST", "/accounts", {"name": name, "account_type": account_type})
+            if result is None:
+                raise RuntimeError(f"Could not create account '{name}'")
+            account_ids.append(result["account_id"])
+        category_ids = {}
+        for name, category_type in CATEGORIES:
+            result = client.request("POST", "/categories", {"name": name, "category_type": category_type})
+            if result is None:
+                raise RuntimeError(f"Could not create category '{name}'")
+            category_ids[(name, category_type)] = result["category_id"]
+
+        rng = random.Random(self.seed)
+        today = datetime.date.today()
+        batch = []
+        for index in range(transactions):
+            name, category_type = rng.choice(CATEGORIES)
+            amount = rng.randint(200000, 400000) if category_type == "income" else -rng.randint(100, 30000)
+            batch.append({
+                "account_id": rng.choice(account_ids),
+                "category_id": category_ids[(name, category_type)],
+                "amount": amount,
+                "transaction_date": (today - datetime.timedelta(days=rng.randrange(months * 30))).isoformat(),
+                "item_name": rng.choice(ITEMS),
+                "description": f"load test {index}",
+            })
+            if len(batch) == batch_size or index == transactions - 1:
+                if client.request("POST", "/transactions/bulk", {"transactions": batch}) is None:
+                    raise RuntimeError("Could not add transactions")
+                batch = []
+        self.transaction_count = transactions
+        return {"transactions": transactions, "generated": transactions}
+
+    def _write_import_file(self, rows=200):
+        """Write a CSV file for one import into the ledger's CSV folder and get its name."""
+        with self._imports_lock:
+            self._imports += 1
+            number = self._imports
+        rng = random.Random(f"{self.seed}-{number}")
+        # The collector name is everything before the first "_"
+        filename = f"loadtest-{self.ledger}_{datetime.date.today().isoformat()}-{os.getpid()}-{number}.csv"
+        csv_dir = get_import_dirs(self.ledger)[0]
+        csv_dir.mkdir(parents=True, exist_ok=True)
+        with open(csv_dir / filename, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["transaction_date", "account_name", "category_type", "category_name", "amount",
+                             "item_name", "tags", "description", "memo"])
+            for index in range(rows):
+                name, category_type = rng.choice(CATEGORIES[:-1])
+                writer.writerow([
+                    (datetime.date.today() - datetime.timedelta(days=rng.randrange(60))).isoformat(),
+                    rng.choice(ACCOUNTS)[0], category_type, name, -rng.randint(100, 30000),
+                    rng.choice(ITEMS), "", f"load test import {number}", ""
+                ])
+        self._csv_files.append(filename)
+        return filename
+
+    # Operations
+
+    def op_transactions(self, client, rng):
+        # Mostly the first pages, sometimes deep in the history
+        page = rng.randrange(5) if rng.random() < 0.8 else rng.randrange(max(1, self.transaction_count // 100))
+        client.request("GET", "/transactions", params={"limit": 100, "offset": page * 100},
+                       endpoint="GET /transactions")
+
+    def op_component(self, client, rng):
+        client.request("POST", f"/sql_components/{self.component}/run", {},
+                       endpoint="POST /sql_components/{name}/run")
+
+    def op_totals(self, client, rng):
+        client.request("GET", "/analytics/totals", params={"group_by": "month,category"},
+                       endpoint="GET /analytics/totals")
+
+    def op_health(self, client, rng):
+        client.request("GET", "/health", endpoint="GET /health")
+
+    def op_chat(self, client, rng):
+        client.request("POST", "/chat/context", {"message": rng.choice(CHAT_MESSAGES)},
+                       endpoint="POST /chat/context")
+
+    def op_import(self, client, rng):
+        filename = self._write_import_file()
+        start = time.perf_counter()
+        result = client.request("POST", f"/csv_files/{filename}", endpoint="POST /csv_files/{filename}")
+        job = client.wait_for_job(result["job_id"]) if result else None
+        ok = job is not None and (job.get("result") or {}).get("success", False)
+        # Time from submitting until the rows are in the ledger
+        self.recorder.record("import (end to end)", time.perf_counter() - start, ok)
+
+    # Run
+
+    def run(self, duration=30, concurrency=8):
+        """Run the mix from `concurrency` threads for `duration` seconds.
+
+        Returns:
+            dict: Summary with overall and per endpoint statistics
+        """
+        operations = [(name, weight) for name, weight in self.mix.items() if weight > 0]
+        unknown = [name for name, _ in operations if not hasattr(self, f"op_{name}")]
+        if unknown:
+            raise ValueError(f"Unknown operations in mix: {', '.join(unknown)}")
+        names = [name for name, _ in operations]
+        weights = [weight for _, weight in operations]
+        deadline = time.monotonic() + duration
+
+        def work(worker):
+            rng = random.Random(f"{self.seed}-worker-{worker}")
+            client = self._client()
+            while time.monotonic() < deadline:
+                getattr(self, f"op_{rng.choices(names, weights)[0]}")(client, rng)
+
+        threads = [threading.Thread(target=work, args=(worker,), daemon=True) for worker in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {"duration": round(elapsed, 2), **self.recorder.summary(elapsed)}
+
+    def cleanup(self):
+        """Remove the import files left in the ledger's CSV folder (failed imports) and dust folder (imported)."""
+        for directory in get_import_dirs(self.ledger):
+            for filename in self._csv_files:
+                path = directory / filename
+                if path.exists():
+                    path.unlink()
+
+
+def get_import_dirs(ledger):
+    """Get the (CSV, dust) directories the server imports the files of a ledger from."""
+    import db_access
+
+    return db_access.ledgers.get_import_dirs(ledger)
+
+
+def compare(result, baseline, max_regression=0.2):
+    """Compare p95 latency and error rate of each endpoint with a baseline result.
+
+    Args:
+        result (dict): The result of this run
+        baseline (dict): The result of an earlier run
+        max_regression (float): Allowed relative increase of p95 latency
+
+    Returns:
+        list: Descriptions of the endpoints that regressed
+    """
+    regressions = []
+    for endpoint, stats in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before or not before.get("p95_ms") or stats["p95_ms"] is None:
+            continue
+        if stats["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{endpoint}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms")
+        if stats["error_rate"] > before["error_rate"]:
+            regressions.append(f"{endpoint}: error rate {before['error_rate']} -> {stats['error_rate']}")
+    return regressions
+
+
+def print_summary(result):
+    columns = ("count", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    width = max(len(endpoint) for endpoint in list(result["endpoints"]) + ["total"])
+    print(f"{'endpoint':<{width}}  " + "  ".join(f"{column:>10}" for column in columns))
+    for endpoint, stats in list(result["endpoints"].items()) + [("total", result["total"])]:
+        print(f"{endpoint:<{width}}  " + "  ".join(f"{str(stats[column]):>10}" for column in columns))
+
+
+def start_server():
+    """Start the app with uvicorn on a free port in a background thread; returns (server, base URL)."""
+    import uvicorn
+    import api
+
+    port = api.find_available_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="load-test-server", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("The API server did not start")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def parse_mix(text):
+    """Parse "transactions=40,health=20" into a mix (operations not given keep their default weight)."""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Kakeibo API server")
+    parser.add_argument("--url", help="Base URL of a running server (default: start one in-process)")
+    parser.add_argument("--ledger", default="loadtest", help="Ledger to generate and test against")
+    parser.add_argument("--transactions", type=int, default=20000, help="Transactions to generate")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--mix", default="", help="Operation weights, e.g. transactions=40,import=0")
+    parser.add_argument("--component", default="all_monthly_expences", help="SQL component to run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", help="Write the result as JSON to this file")
+    parser.add_argument("--baseline", help="Compare with an earlier JSON result; exit 1 on regression")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative p95 increase")
+    parser.add_argument("--max-error-rate", type=float, default=0.0, help="Allowed error rate per endpoint")
+    args = parser.parse_args()
+
+    server = thread = None
+    base_url = args.url
+    if not base_url:
+        server, thread, base_url = start_server()
+
+    started_at = datetime.datetime.now().isoformat(timespec="seconds")
+    test = LoadTest(base_url, args.ledger, parse_mix(args.mix), args.seed, args.component)
+    try:
+        setup_start = time.perf_counter()
+        generated = test.generate(args.transactions)
+        print(f"Ledger '{args.ledger}': {generated['transactions']} transactions "
+              f"({generated['generated']} generated in {time.perf_counter() - setup_start:.1f}s)")
+        health = Client(base_url, args.ledger, None).request("GET", "/health") or {}
+
+        result = test.run(args.duration, args.concurrency)
+    finally:
+        test.cleanup()
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    result = {
+        "started_at": started_at,
+        "server_version": health.get("version"),
+        "config": {
+            "url": args.url or "in-process",
+            "ledger": args.ledger,
+            "transactions": test.transaction_count,
+            "concurrency": args.concurrency,
+            "mix": test.mix,
+            "component": args.component,
+            "seed": args.seed,
+        },
+        **result
+    }
+    print_summary(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    failed = False
+    for endpoint, stats in result["endpoints"].items():
+        if stats["error_rate"] > args.max_error_rate:
+            print(f"ERRORS {endpoint}: error rate {stats['error_rate']} (allowed {args.max_error_rate})")
+            failed = True
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
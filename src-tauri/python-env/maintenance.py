@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sqlite3
+import datetime
+import contextlib
+import threading
+import logging
+from pathlib import Path
+
+import db_access
+import job_queue
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+def get_backup_dir():
+    """Get the data/backup/ directory that snapshots are written to."""
+    script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+    return script_dir.parent.parent / 'data' / 'backup'
+
+
+def get_stats(db):
+    """Get the size and fragmentation of a database file.
+
+    Args:
+        db (DatabaseManager): The database
+
+    Returns:
+        dict: File sizes, page counts and the share of free pages
+    """
+    conn = db.connect()
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+    db_path = Path(db.db_path)
+    wal_path = db_path.with_name(db_path.name + '-wal')
+    return {
+        "file_size": db_path.stat().st_size if db_path.exists() else 0,
+        "wal_size": wal_path.stat().st_size if wal_path.exists() else 0,
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": freelist_count,
+        # Free pages are space left behind by deletes (e.g. undone imports)
+        "fragmentation": round(freelist_count / page_count, 4) if page_count else 0.0,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+    }
+
+
+def _backup(source_path, target_path, pages_per_step, progress):
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages_per_step, progress=progress, sleep=0.005)
+    finally:
+        target.close()
+        source.close()
+
+
+def get_archive_dir(snapshot_name):
+    """Get the directory holding the archived years of a snapshot (next to its file)."""
+    return get_backup_dir() / f"{Path(snapshot_name).stem}.archive"
+
+
+def snapshot(db, pages_per_step=256, keep=10, progress_callback=None):
+    """Take a consistent copy of the database while it stays in use.
+
+    Uses the SQLite online backup API, copying `pages_per_step` pages at a
+    time on a separate connection, so readers and writers keep working in
+    between steps. The copy is written under a temporary name and renamed
+    once complete, so a snapshot file is never torn.
+
+    The archive files of the years listed in the copy's archived_years are
+    backed up the same way into a `.archive` directory next to it. Archiving
+    and restoring years run on the job queue like snapshots, so the files
+    cannot change in between.
+
+    Args:
+        db (DatabaseManager): The database
+        pages_per_step (int): Pages copied per backup step
+        keep (int): Number of most recent snapshots to keep (0 keeps all)
+        progress_callback (callable): Optional function called with (pages copied, total pages)
+
+    Returns:
+        dict: Result of the operation
+    """
+    backup_dir = get_backup_dir()
+    backup_dir.mkdir(parents=True, exist_ok=True)
+
+    db_path = Path(db.db_path)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    snapshot_path = backup_dir / f"{db.name}_{timestamp}.sqlite"
+    suffix = 1
+    while snapshot_path.exists():
+        snapshot_path = backup_dir / f"{db.name}_{timestamp}_{suffix}.sqlite"
+        suffix += 1
+    temp_path = snapshot_path.with_name(snapshot_path.name + '.part')
+    archive_dir = get_archive_dir(snapshot_path.name)
+    temp_archive_dir = archive_dir.with_name(archive_dir.name + '.part')
+
+    # Pages of the files already copied, so progress adds up over all of them
+    copied = [0]
+
+    def progress(status, remaining, total):
+        if progress_callback:
+            progress_callback(copied[0] + total - remaining, copied[0] + total)
+
+    def backup(source_path, target_path):
+        _backup(source_path, target_path, pages_per_step, progress)
+        with contextlib.closing(sqlite3.connect(target_path)) as conn:
+            copied[0] += conn.execute("PRAGMA page_count").fetchone()[0]
+
+    backup(db_path, temp_path)
+
+    # The archived years as of the copy
+    with contextlib.closing(sqlite3.connect(temp_path)) as conn:
+        has_archive = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_years'").fetchone()
+        file_names = [row[0] for row in conn.execute("SELECT file_name FROM archived_years ORDER BY year")] \
+            if has_archive else []
+    if file_names:
+        shutil.rmtree(temp_archive_dir, ignore_errors=True)
+        temp_archive_dir.mkdir()
+        for file_name in file_names:
+            backup(db_path.parent / 'archive' / file_name, temp_archive_dir / file_name)
+        os.replace(temp_archive_dir, archive_dir)
+    # Last, so a listed snapshot always has its archives
+    os.replace(temp_path, snapshot_path)
+
+    removed = []
+    if keep:
+        for old in list_snapshots(db.name)[keep:]:
+            os.remove(backup_dir / old["name"])
+            shutil.rmtree(get_archive_dir(old["name"]), ignore_errors=True)
+            removed.append(old["name"])
+
+    return {
+        "success": True,
+        "snapshot": snapshot_path.name,
+        "size": snapshot_path.stat().st_size,
+        "archives": file_names,
+        "archive_size": sum((archive_dir / file_name).stat().st_size for file_name in file_names),
+        "removed": removed
+    }
+
+
+def list_snapshots(ledger=None):
+    """Get the snapshots in data/backup/ (of one ledger, or all), newest first."""
+    backup_dir = get_backup_dir()
+    if not backup_dir.exists():
+        return []
+    pattern = f"{ledger}_[0-9]*.sqlite" if ledger else "*.sqlite"
+    snapshots = [
+        {"name": path.name, "size": path.stat().st_size,
+         "created_at": datetime.datetime.fromtimestamp(path.stat().st_mtime).isoformat()}
+        for path in backup_dir.glob(pattern)
+    ]
+    return sorted(snapshots, key=lambda item: item["name"], reverse=True)
+
+
+def optimize(db, analyze=False, vacuum_pages=None, enable_incremental_vacuum=False):
+    """Refresh planner statistics, release free pages and checkpoint the WAL.
+
+    Args:
+        db (DatabaseManager): The database
+        analyze (bool): Run a full ANALYZE instead of only PRAGMA optimize
+        vacuum_pages (int): Maximum free pages to release (None releases all)
+        enable_incremental_vacuum (bool): Switch auto_vacuum to incremental. This needs one
+            full VACUUM, which rewrites the whole file and blocks writers while it runs.
+
+    Returns:
+        dict: Statistics before and after, and the steps that ran
+    """
+    before = get_stats(db)
+    conn = db.connect()
+    steps = []
+
+    if enable_incremental_vacuum and before["auto_vacuum"] != "incremental":
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        steps.append("vacuum")
+
+    if analyze:
+        conn.execute("ANALYZE")
+        steps.append("analyze")
+    conn.execute("PRAGMA optimize")
+    steps.append("optimize")
+
+    if get_stats(db)["auto_vacuum"] == "incremental":
+        if vacuum_pages is None:
+            conn.execute("PRAGMA incremental_vacuum")
+        else:
+            conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+        steps.append("incremental_vacuum")
+    conn.commit()
+
+    # Fold the WAL back into the database file and shrink it
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    steps.append("wal_checkpoint")
+
+    return {"success": True, "steps": steps, "before": before, "after": get_stats(db)}
+
+
+def submit_snapshot(db, pages_per_step=256, keep=10):
+    """Queue a snapshot on the job queue. Progress is reported in pages."""
+    return job_queue.jobs.submit("snapshot", db.name, lambda job: snapshot(
+        db, pages_per_step, keep,
+        progress_callback=lambda copied, total: job_queue.jobs.report_progress(job, copied, total)
+    ))
+
+
+def submit_optimize(db, analyze=False, vacuum_pages=None, enable_incremental_vacuum=False):
+    """Queue an optimize run on the job queue, so it never overlaps an import."""
+    return job_queue.jobs.submit("optimize", db.name, lambda job: optimize(
+        db, analyze, vacuum_pages, enable_incremental_vacuum
+    ))
+
+
+class MaintenanceScheduler:
+    """Queue a snapshot and an optimize run at a fixed interval."""
+
+    def __init__(self, db):
+        self.db = db
+        self.interval_hours = None
+        self.last_run = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_hours):
+        if self.running:
+            return
+        self.interval_hours = interval_hours
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="maintenance-scheduler", daemon=True)
+        self._thread.start()
+        logging.info(f"Maintenance scheduled every {interval_hours} hours")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self):
+        return {
+            "running": self.running,
+            "interval_hours": self.interval_hours,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+        }
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_hours * 3600):
+            self.last_run = datetime.datetime.now()
+            for name in db_access.ledgers.names():
+                with db_access.ledgers.use(name):
+                    submit_snapshot(self.db)
+                    # A full ANALYZE once in a while; PRAGMA optimize keeps it current in between
+                    submit_optimize(self.db, analyze=True)
+
+
+# Create a global instance for easy access
+scheduler = MaintenanceScheduler(db_access.db)
+
+
+def get_maintenance_status():
+    try:
+        return {
+            "success": True,
+            "stats": get_stats(db_access.db),
+            "snapshots": list_snapshots(db_access.db.name),
+            "scheduler": scheduler.status()
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
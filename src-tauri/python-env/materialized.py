@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+import json
+import hashlib
+import logging
+
+import db_access
+import archive
+import job_queue
+
+# Partition types a materialized component can declare, with the default result column holding the partition key
+PARTITIONS = {
+    "month": "month",         # strftime('%Y-%m', transaction_date)
+    "account": "account_id",
+}
+
+
+def get_config(component):
+    """Get the materialization settings of a SQL component.
+
+    A component is materialized when its JSON has a "materialized" key, e.g.
+    {"partition": "month"}, {"partition": "account", "column": "account_id"}
+    or just true (no partition: every change triggers a full refresh).
+
+    With a partition, the component's SQL must group by that partition and
+    return it in `column`, so that only the months or accounts touched by a
+    write need to be recomputed.
+
+    Args:
+        component (dict): The SQL component
+
+    Returns:
+        dict: {"partition": str or None, "column": str or None}, or None if the component is not materialized
+    """
+    config = component.get("materialized")
+    if not config:
+        return None
+    if config is True:
+        config = {}
+
+    partition = config.get("partition")
+    if partition and partition not in PARTITIONS:
+        raise ValueError(f"Unknown partition '{partition}' (expected one of {', '.join(PARTITIONS)})")
+    return {
+        "partition": partition,
+        "column": config.get("column", PARTITIONS.get(partition)) if partition else None
+    }
+
+
+def table_name(name):
+    """Get the name of the table holding a component's stored result."""
+    return f"mv_{name}"
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _literal(value):
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_hash(sql, config):
+    return hashlib.sha1(json.dumps([sql, config], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _strip_sql(sql):
+    # Allow the component SQL to be used as a subquery
+    return sql.strip().rstrip(';')
+
+
+def _next_month(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + 1}-01" if mon == 12 else f"{year}-{mon + 1:02d}"
+
+
+def _partition_filter(partition, values):
+    """Build a WHERE clause on transactions selecting the given partitions."""
+    if partition == "month":
+        # Date ranges instead of strftime() so an index on transaction_date can be used
+        ranges = [
+            f"(transaction_date >= {_literal(month + '-01')} AND transaction_date < {_literal(_next_month(month) + '-01')})"
+            for month in values
+        ]
+        return " OR ".join(ranges)
+    return f"account_id IN ({', '.join(_literal(v) for v in values)})"
+
+
+def _ensure_schema():
+    db_access.db.ensure_schema('materialized_components.sql')
+    # Tables created before refreshes could fail have no dirty flag
+    db_access.db.ensure_column('materialized_components', 'dirty', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def _get_state(name):
+    _ensure_schema()
+    rows = db_access.db.execute_query("SELECT * FROM materialized_components WHERE name = ?", (name,))
+    return rows[0] if rows else None
+
+
+def _load(name):
+    component_result = db_access.get_sql_component(name)
+    if not component_result.get("success", False):
+        raise ValueError(component_result.get("error", f"SQL component '{name}' not found"))
+    component = component_result["component"]
+    config = get_config(component)
+    if config is None:
+        raise ValueError(f"SQL component '{name}' is not materialized")
+    sql = component.get("sql", "")
+    if not sql:
+        raise ValueError("SQL is required")
+    return component, config, _strip_sql(sql)
+
+
+def refresh(name, partitions=None):
+    """Refresh the stored result of a materialized component.
+
+    Args:
+        name (str): The name of the SQL component
+        partitions (list): Months (YYYY-MM) or account ids to recompute. None means a full refresh.
+
+    Returns:
+        dict: The materialized_components row after the refresh
+    """
+    component, config, sql = _load(name)
+    state = _get_state(name)
+    sql_hash = _sql_hash(sql, config)
+
+    # The stored table only matches the component if it was built from the same SQL
+    # and no incremental refresh has failed since
+    if partitions is not None and (not config["partition"] or not state or state["sql_hash"] != sql_hash
+                                   or state["dirty"]):
+        partitions = None
+
+    # Incremental refreshes read the main database only, so partitions with archived rows are rebuilt in full
+    years = archive.route(component, sql)
+    if partitions and years and (config["partition"] != "month"
+                                 or any(int(month[:4]) in years for month in partitions)):
+        partitions = None
+
+    conn = db_access.db.connect()
+    cursor = conn.cursor()
+    table = _quote(table_name(name))
+
+    # A full refresh sees the archived years the component needs
+    with archive.history(db_access.db, years if partitions is None else []):
+        try:
+            # IMMEDIATE: the refresh reads before it writes, and a deferred transaction could not
+            # upgrade to a write once another connection had written ("database is locked")
+            cursor.execute("BEGIN IMMEDIATE")
+
+            if partitions is None:
+                cursor.execute(f"DROP TABLE IF EXISTS main.{table}")
+                cursor.execute(f"CREATE TABLE main.{table} AS SELECT * FROM (\n{sql}\n)")
+            elif partitions:
+                # Shadow transactions with a temp view holding only the touched partitions,
+                # so the component's own SQL recomputes just those
+                cursor.execute(
+                    "CREATE TEMP VIEW transactions AS SELECT * FROM main.transactions WHERE "
+                    + _partition_filter(config["partition"], partitions)
+                )
+                try:
+                    placeholders = ', '.join(['?' for _ in partitions])
+                    cursor.execute(
+                        f"DELETE FROM main.{table} WHERE {_quote(config['column'])} IN ({placeholders})",
+                        list(partitions)
+                    )
+                    cursor.execute(f"INSERT INTO main.{table} SELECT * FROM (\n{sql}\n)")
+                finally:
+                    cursor.execute("DROP VIEW temp.transactions")
+
+            cursor.execute(f"SELECT COUNT(*) AS row_count FROM main.{table}")
+            row_count = cursor.fetchone()["row_count"]
+
+            cursor.execute("""
+            INSERT OR REPLACE INTO materialized_components
+                (name, table_name, partition_type, partition_column, sql_hash, row_count, dirty, refreshed_at)
+            VALUES (?, ?, ?, ?, ?, ?, 0, CURRENT_TIMESTAMP)
+            """, (name, table_name(name), config["partition"], config["column"], sql_hash, row_count))
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return _get_state(name)
+
+
+def drop(name):
+    """Drop the stored result of a component."""
+    if _get_state(name) is None:
+        return
+    conn = db_access.db.connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"DROP TABLE IF EXISTS main.{_quote(table_name(name))}")
+        cursor.execute("DELETE FROM materialized_components WHERE name = ?", (name,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def read(component):
+    """Read the stored result of a materialized component.
+
+    Reads never write: when the stored table is missing, was built from
+    other SQL or has a failed refresh behind it, a full refresh is queued
+    on the job queue and the component's SQL is run read-only instead
+    until that refresh has finished.
+
+    Args:
+        component (dict): The SQL component
+
+    Returns:
+        tuple: (pandas DataFrame, materialized_components row). Instead of the row, a
+            {"name", "stale": True, "refresh_job_id"} dict when the SQL was run.
+    """
+    name = component["name"]
+    config = get_config(component)
+    sql = _strip_sql(component.get("sql", ""))
+    state = _get_state(name)
+    if state is None or state["dirty"] or state["sql_hash"] != _sql_hash(sql, config):
+        job = job_queue.jobs.submit("materialize", name, lambda job: refresh_sql_component(name))
+        with archive.history(db_access.db, archive.route(component, sql), read_only=True):
+            df = db_access.db.execute_query_as_df(sql, read_only=True)
+        return df, {"name": name, "stale": True, "refresh_job_id": job.job_id}
+
+    # Incremental refreshes append at the end; ordering by the partition keeps the result stable
+    order_by = f"{_quote(config['column'])}, rowid" if config["column"] else "rowid"
+    df = db_access.db.execute_query_as_df(f"SELECT * FROM main.{_quote(table_name(name))} ORDER BY {order_by}",
+                                          read_only=True)
+    return df, state
+
+
+def _mark_dirty(name):
+    """Flag a component whose stored result missed a write, so it is not read until rebuilt."""
+    conn = db_access.db.connect()
+    try:
+        conn.execute("UPDATE materialized_components SET dirty = 1 WHERE name = ?", (name,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def on_change(event):
+    """Change listener: incrementally refresh the materialized components touched by a write.
+
+    Archiving or restoring a year moves rows between the main database and
+    the archive files, so it refreshes every component in full. A failed
+    refresh marks the component dirty; its next read queues a full refresh.
+    """
+    _ensure_schema()
+    moved = event.get("type") in ("year_archived", "year_restored")
+    for state in db_access.db.execute_query("SELECT * FROM materialized_components"):
+        name = state["name"]
+        if not db_access.get_sql_component(name).get("success", False):
+            # The component was deleted
+            drop(name)
+            continue
+
+        partition = state["partition_type"]
+        if moved:
+            partitions = None
+        elif partition == "month":
+            partitions = event.get("months", [])
+        elif partition == "account":
+            partitions = event.get("account_ids", [])
+        else:
+            partitions = None
+        if partitions == [] or state["dirty"]:
+            continue
+
+        try:
+            refresh(name, partitions)
+        except Exception as e:
+            logging.error(f"Error refreshing materialized component {name}: {str(e)}")
+            _mark_dirty(name)
+
+
+def refresh_sql_component(name):
+    """Fully refresh a materialized component on demand.
+
+    Args:
+        name (str): The name of the SQL component
+
+    Returns:
+        dict: Result of the operation
+    """
+    try:
+        state = refresh(name)
+        return {"success": True, "materialized": state}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+db_access.db.add_change_listener(on_change)
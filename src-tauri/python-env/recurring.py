@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+import re
+import json
+import datetime
+import statistics
+import threading
+import unicodedata
+from collections import defaultdict
+
+import db_access
+import archive
+
+# Number of most recent occurrences kept per series
+MAX_HISTORY = 36
+
+# period -> (minimum occurrences, interval range in days)
+PERIODS = {
+    "monthly": (3, (25, 35)),
+    "yearly": (2, (350, 380)),
+}
+
+_NOISE_RE = re.compile(r'[\d\s\W_]+')
+
+
+def normalize_name(name):
+    """Normalize an item name so that e.g. 'Netflix 4月分' and 'NETFLIX　5月分' group together."""
+    if not name:
+        return ""
+    name = unicodedata.normalize('NFKC', name).lower()
+    return _NOISE_RE.sub('', name)
+
+
+def _add_months(date, months):
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    # Clamp to the last day of the month (e.g. Jan 31 -> Feb 28)
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return datetime.date(year, month, min(date.day, (next_month - datetime.timedelta(days=1)).day))
+
+
+def classify(dates, amounts):
+    """Find the period of a series of dates.
+
+    Args:
+        dates (list): Sorted datetime.date values
+        amounts (list): Amounts, in the same order
+
+    Returns:
+        dict: period, interval_days, average_amount, next_expected_date and confidence
+    """
+    result = {
+        "period": None,
+        "interval_days": None,
+        "average_amount": statistics.fmean(amounts) if amounts else None,
+        "next_expected_date": None,
+        "confidence": 0.0,
+    }
+    intervals = [(b - a).days for a, b in zip(dates, dates[1:])]
+    if not intervals:
+        return result
+
+    interval = statistics.median(intervals)
+    result["interval_days"] = interval
+
+    for period, (min_occurrences, (low, high)) in PERIODS.items():
+        if len(dates) < min_occurrences or not low <= interval <= high:
+            continue
+
+        # Share of the gaps that fit the period, damped when the amount varies a lot
+        regularity = sum(1 for days in intervals if low <= days <= high) / len(intervals)
+        mean_amount = abs(result["average_amount"])
+        if len(amounts) > 1 and mean_amount > 0:
+            stability = max(0.0, 1.0 - statistics.pstdev(amounts) / mean_amount)
+        else:
+            stability = 1.0
+
+        result["period"] = period
+        result["confidence"] = round(regularity * (0.5 + 0.5 * stability), 3)
+        result["next_expected_date"] = _add_months(dates[-1], 1 if period == "monthly" else 12).isoformat()
+        break
+
+    return result
+
+
+class RecurringDetector:
+    """Detect subscriptions and fixed costs incrementally.
+
+    Transactions are grouped by account and normalized item name (or
+    description when there is no item name). Each group keeps its recent
+    dates and amounts in recurring_series, and recurring_state remembers the
+    last processed transaction_id, so an import only reads its own new rows
+    and the series they belong to instead of self-joining the whole ledger.
+    Updates and deletes of processed rows mark their series in
+    recurring_dirty (from a write hook), and the next update recomputes
+    just those series.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+
+    def update(self):
+        """Process the transactions added since the last update.
+
+        Called from the change listener (and rebuild jobs) only, so reads
+        such as GET /recurring never write.
+
+        Returns:
+            dict: Number of transactions processed and series updated
+        """
+        with self._lock:
+            self.db.ensure_schema('recurring_series.sql')
+            archived_years = {str(row['year']) for row in archive.get_archived_years(self.db)}
+            conn = self.db.connect()
+            cursor = conn.cursor()
+            try:
+                # IMMEDIATE: a deferred transaction that reads first cannot upgrade to a write
+                # once another connection has written ("database is locked")
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT last_transaction_id FROM recurring_state WHERE id = 1")
+                row = cursor.fetchone()
+                last_transaction_id = row['last_transaction_id'] if row else 0
+
+                cursor.execute("SELECT account_id, normalized_name FROM recurring_dirty")
+                dirty = cursor.fetchall()
+                if dirty:
+                    self._recompute(cursor, dirty, last_transaction_id, archived_years)
+                    cursor.execute("DELETE FROM recurring_dirty")
+
+                cursor.execute("""
+                SELECT transaction_id, account_id, item_name, description, amount, transaction_date
+                FROM transactions
+                WHERE transaction_id > ?
+                ORDER BY transaction_id
+                """, (last_transaction_id,))
+                new_rows = cursor.fetchall()
+                if not new_rows:
+                    conn.commit()
+                    return {"transactions_processed": 0, "series_updated": len(dirty)}
+
+                groups = defaultdict(list)
+                for row in new_rows:
+                    display_name = row['item_name'] or row['description'] or ""
+                    normalized = normalize_name(display_name)
+                    if not normalized:
+                        continue
+                    groups[(row['account_id'], normalized)].append(row)
+                last_transaction_id = new_rows[-1]['transaction_id']
+
+                for (account_id, normalized), rows in groups.items():
+                    self._update_series(cursor, account_id, normalized, rows)
+
+                cursor.execute("""
+                INSERT OR REPLACE INTO recurring_state (id, last_transaction_id) VALUES (1, ?)
+                """, (last_transaction_id,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            return {"transactions_processed": len(new_rows), "series_updated": len(groups) + len(dirty)}
+
+    def _recompute(self, cursor, dirty, last_transaction_id, archived_years):
+        """Recompute the dirty series from the processed transactions of their accounts."""
+        names_by_account = defaultdict(set)
+        for row in dirty:
+            names_by_account[row['account_id']].add(row['normalized_name'])
+
+        for account_id, names in names_by_account.items():
+            cursor.execute("""
+            SELECT transaction_id, account_id, item_name, description, amount, transaction_date
+            FROM transactions
+            WHERE account_id = ? AND transaction_id <= ?
+            ORDER BY transaction_id
+            """, (account_id, last_transaction_id))
+            groups = defaultdict(list)
+            for row in cursor.fetchall():
+                normalized = normalize_name(row['item_name'] or row['description'] or "")
+                if normalized in names:
+                    groups[normalized].append(row)
+            for normalized in names:
+                self._update_series(cursor, account_id, normalized, groups[normalized], keep_years=archived_years)
+
+    def _update_series(self, cursor, account_id, normalized, rows, keep_years=None):
+        """Add rows to a series, or recompute it from all its rows in the main database.
+
+        When recomputing, `keep_years` are the archived years, whose occurrences are
+        kept from the stored series (archived rows cannot change).
+        """
+        series_key = f"{account_id}:{normalized}"
+        cursor.execute("SELECT display_name, dates, amounts FROM recurring_series WHERE series_key = ?", (series_key,))
+        existing = cursor.fetchone()
+        history = list(zip(json.loads(existing['dates']), json.loads(existing['amounts']))) if existing else []
+        if keep_years is not None:
+            history = [(date, amount) for date, amount in history if date[:4] in keep_years]
+
+        history.extend((str(row['transaction_date'])[:10], row['amount']) for row in rows)
+        if not history:
+            cursor.execute("DELETE FROM recurring_series WHERE series_key = ?", (series_key,))
+            return
+        history.sort()
+        history = history[-MAX_HISTORY:]
+
+        dates = [datetime.date.fromisoformat(date) for date, amount in history]
+        amounts = [amount for date, amount in history]
+        result = classify(dates, amounts)
+
+        cursor.execute("""
+        INSERT OR REPLACE INTO recurring_series
+            (series_key, account_id, normalized_name, display_name, dates, amounts, occurrences,
+             period, interval_days, average_amount, last_date, next_expected_date, confidence, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (
+            series_key, account_id, normalized,
+            (rows[-1]['item_name'] or rows[-1]['description']) if rows else existing['display_name'],
+            json.dumps([date for date, amount in history]), json.dumps(amounts), len(history),
+            result["period"], result["interval_days"], result["average_amount"],
+            history[-1][0], result["next_expected_date"], result["confidence"]
+        ))
+
+    def rebuild(self):
+        """Forget all state and reprocess every transaction, archived years included."""
+        with self._lock:
+            self.db.ensure_schema('recurring_series.sql')
+            conn = self.db.connect()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("DELETE FROM recurring_series")
+                cursor.execute("DELETE FROM recurring_dirty")
+                cursor.execute("DELETE FROM recurring_state")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        years = [row['year'] for row in archive.get_archived_years(self.db)]
+        with archive.history(self.db, years):
+            return self.update()
+
+    def get_series(self, period=None, min_confidence=0.0, limit=100):
+        """Get the detected recurring series.
+
+        Args:
+            period (str): Only this period ("monthly" or "yearly"); None for both
+            min_confidence (float): Minimum confidence between 0 and 1
+            limit (int): Maximum number of series
+
+        Returns:
+            list: Series ordered by confidence and amount
+        """
+        self.db.ensure_schema('recurring_series.sql')
+        query = """
+        SELECT r.series_key, r.account_id, a.name AS account_name, r.display_name, r.normalized_name,
+               r.period, r.occurrences, r.interval_days, r.average_amount, r.last_date,
+               r.next_expected_date, r.confidence
+        FROM recurring_series r
+        JOIN accounts a ON r.account_id = a.account_id
+        WHERE r.period IS NOT NULL AND r.confidence >= ?
+        """
+        params = [min_confidence]
+        if period:
+            query += " AND r.period = ?"
+            params.append(period)
+        query += " ORDER BY r.confidence DESC, ABS(r.average_amount) DESC LIMIT ?"
+        params.append(limit)
+        return self.db.execute_query(query, params)
+
+    def mark_dirty(self, cursor, where, params, sign):
+        """Write hook: mark the series of processed transactions that are changed or removed.
+
+        Rows past the watermark are new and left to update(). Called before
+        (and after) an update, so both the old and the new series are marked.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recurring_dirty'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("SELECT last_transaction_id FROM recurring_state WHERE id = 1")
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute(f"""
+        SELECT DISTINCT account_id, item_name, description FROM transactions
+        WHERE ({where}) AND transaction_id <= ?
+        """, list(params) + [row['last_transaction_id']])
+        keys = {(row['account_id'], normalize_name(row['item_name'] or row['description'] or ""))
+                for row in cursor.fetchall()}
+        cursor.executemany("""
+        INSERT OR IGNORE INTO recurring_dirty (series_key, account_id, normalized_name) VALUES (?, ?, ?)
+        """, [(f"{account_id}:{normalized}", account_id, normalized) for account_id, normalized in keys if normalized])
+
+    def on_change(self, event):
+        """Change listener: process new rows and recompute the series marked dirty.
+
+        Archiving or restoring a year does not change any series.
+        """
+        if event.get("type") in ("year_archived", "year_restored"):
+            return
+        self.update()
+
+
+# Create a global instance for easy access
+detector = db_access.PerLedger(RecurringDetector)
+db_access.db.add_write_hook(lambda cursor, where, params, sign: detector.mark_dirty(cursor, where, params, sign))
+db_access.db.add_change_listener(lambda event: detector.on_change(event))
+
+
+def get_recurring(period=None, min_confidence=0.0, limit=100):
+    try:
+        return {"success": True, "series": detector.get_series(period, min_confidence, limit)}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def rebuild_recurring():
+    try:
+        return {"success": True, **detector.rebuild()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
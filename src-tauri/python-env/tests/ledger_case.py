@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Base class for tests that run on a throwaway ledger.
+
+Run the tests from src-tauri/python-env with:
+
+    python -m unittest discover tests
+"""
+import io
+import os
+import sys
+import time
+import itertools
+import tempfile
+import unittest
+import contextlib
+from pathlib import Path
+from unittest import mock
+
+# The modules under test live in the directory above
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db_access  # noqa: E402
+# The services registering write hooks, change listeners and initializers, as api.py imports them
+import materialized, chat_context, recurring, categorizer, archive, compact_ledger, change_feed, budgets, currency  # noqa: E402,F401,E401
+
+_ledger_numbers = itertools.count(1)
+
+
+class LedgerTestCase(unittest.TestCase):
+    """Runs each test on a new, empty ledger in a temporary directory, as the current ledger.
+
+    Services kept per ledger (db_access.PerLedger) start fresh too, as
+    every test gets a ledger name of its own.
+    """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(db_access.ledgers, 'get_data_dir', return_value=Path(tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.ledger = f"test_{os.getpid()}_{next(_ledger_numbers)}"
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.db = db_access.ledgers.create(self.ledger)
+        use = db_access.ledgers.use(self.ledger)
+        use.__enter__()
+        self.addCleanup(use.__exit__, None, None, None)
+        self.addCleanup(self.db.close_all)
+
+    # Fixtures
+
+    def add_account(self, name="Bank", currency="JPY"):
+        result = self.db.add_account(name, "bank", currency)
+        self.assertTrue(result["success"], result)
+        return result["account_id"]
+
+    def add_category(self, name, category_type="expense"):
+        result = self.db.add_category(name, category_type)
+        self.assertTrue(result["success"], result)
+        return result["category_id"]
+
+    def add_transactions(self, *transactions):
+        result = self.db.add_transactions(list(transactions))
+        self.assertTrue(result["success"], result)
+        return result["transaction_ids"]
+
+    def wait_for(self, job, timeout=10):
+        """Wait until a job_queue.Job has finished."""
+        deadline = time.monotonic() + timeout
+        while not job.finished:
+            if time.monotonic() > deadline:
+                self.fail(f"Job {job.kind} did not finish")
+            time.sleep(0.01)
+        return job
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+import unittest
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import archive
+import budgets
+import job_queue
+import materialized
+import compact_ledger
+
+COMPONENT = "all_monthly_expences"  # materialized by month, "history": true
+
+
+class ArchiveTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account()
+        self.add_category("除外")  # the component leaves out category 1
+        self.category_id = self.add_category("食費")
+        self.tag_id = self.db.add_tag("旅行")["tag_id"]
+        self.add_transactions(*[
+            {"account_id": self.account_id, "category_id": self.category_id, "amount": -1000 - month,
+             "item_name": "Netflix", "transaction_date": f"{year}-{month:02d}-05",
+             "tags": [self.tag_id] if month == 5 else []}
+            for year in (2023, 2024) for month in range(1, 13)
+        ])
+        self.budget_id = budgets.tracker.get(self.ledger).add_budget(
+            "食費", "category", self.category_id, 20000, period="year")["budget_id"]
+        self.component = db_access.get_sql_component(COMPONENT)["component"]
+        self.compact = compact_ledger.ledger.get(self.ledger)
+
+    def read(self):
+        """Read the stored result of the component, waiting for it to be built."""
+        df, state = materialized.read(self.component)
+        if state.get("stale"):
+            self.wait_for(job_queue.jobs.get_job(state["refresh_job_id"]))
+            df, state = materialized.read(self.component)
+        self.assertNotIn("stale", state)
+        return df
+
+    def snapshot(self):
+        df = self.read()
+        return {
+            "component": df.to_dict("records"),
+            "totals": self.compact.totals(("month", "tag")),
+            "budget_2023": budgets.tracker.get(self.ledger).status("2023-05")["budgets"][0]["spent"],
+            "recurring": self.db.execute_query("SELECT series_key, occurrences FROM recurring_series"),
+        }
+
+    def count(self, table="transactions"):
+        return self.db.execute_query(f"SELECT COUNT(*) AS n FROM {table}")[0]["n"]
+
+    def test_round_trip_keeps_every_total(self):
+        before = self.snapshot()
+
+        result = archive.archive_year(self.db, 2023)
+        self.assertEqual(result["transactions_archived"], 12)
+        self.assertEqual(self.count(), 12)
+        self.assertTrue(archive.get_archive_path(self.db, 2023).exists())
+        archived = self.db.execute_query("SELECT SUM(total) AS total, SUM(count) AS count FROM archived_totals")[0]
+        self.assertEqual((archived["total"], archived["count"]), (-sum(1000 + m for m in range(1, 13)), 12))
+
+        self.assertEqual(self.snapshot(), before)
+        # Built from scratch, the compact ledger reads the archived year too
+        self.assertEqual(compact_ledger.CompactLedger(self.db).totals(("month", "tag")), before["totals"])
+        self.assertEqual(budgets.tracker.get(self.ledger).reconcile()["drift"], [])
+        with archive.history(self.db, [2023]):
+            self.assertEqual(self.count(), 24)
+            self.assertEqual(self.count("transaction_tags"), 2)
+
+        result = archive.restore_year(self.db, 2023)
+        self.assertEqual(result["transactions_restored"], 12)
+        self.assertEqual((self.count(), self.count("transaction_tags")), (24, 2))
+        self.assertFalse(archive.get_archive_path(self.db, 2023).exists())
+        self.assertEqual(archive.get_archived_years(self.db), [])
+        self.assertEqual(self.snapshot(), before)
+
+    def test_rows_added_to_an_archived_year(self):
+        archive.archive_year(self.db, 2023)
+        self.add_transactions({"account_id": self.account_id, "category_id": self.category_id,
+                               "amount": -7, "transaction_date": "2023-03-20"})
+        df = self.read()
+        self.assertEqual(dict(zip(df["month"], df["total_expense"]))["2023-03"], 1003 + 7)
+        self.assertEqual(len(df), 24)
+
+        # Archiving the year again moves the new row as well
+        self.assertEqual(archive.archive_year(self.db, 2023)["transactions_archived"], 1)
+        self.assertEqual(self.count(), 12)
+        self.assertEqual(archive.get_archived_years(self.db)[0]["transaction_count"], 13)
+        df = self.read()
+        self.assertEqual(dict(zip(df["month"], df["total_expense"]))["2023-03"], 1003 + 7)
+
+    def test_route_by_date_bounds(self):
+        self.add_transactions({"account_id": self.account_id, "category_id": self.category_id,
+                               "amount": -1, "transaction_date": "2022-06-01"})
+        archive.archive_year(self.db, 2022)
+        archive.archive_year(self.db, 2023)
+        cases = {
+            "SELECT * FROM transactions": [],
+            "SELECT * FROM transactions WHERE transaction_date < '2024-01-01'": [2022, 2023],
+            "SELECT * FROM transactions WHERE transaction_date < '2023-01-01'": [2022],
+            "SELECT * FROM transactions WHERE transaction_date <= '2023-01-01'": [2022, 2023],
+            "SELECT * FROM transactions WHERE transaction_date BETWEEN '2022-01-01' AND '2022-12-31'": [2022],
+            "SELECT * FROM transactions WHERE transaction_date >= '2023-04-01'": [2023],
+            "SELECT * FROM transactions WHERE '2023-01-01' > transaction_date": [2022],
+            "SELECT * FROM transactions WHERE transaction_date >= '2024-01-01'": [],
+            "SELECT * FROM transactions WHERE transaction_date LIKE '2022-%'": [2022],
+            "SELECT * FROM transactions WHERE amount < 0 AND transaction_date > '2022-12-31'"
+            " AND transaction_date < '2024-01-01'": [2022, 2023],
+            # Conditions whose bounds are not worked out see every archived year
+            "SELECT * FROM transactions WHERE transaction_date < '2022-01-01' OR transaction_date > '2024-01-01'":
+                [2022, 2023],
+            "SELECT * FROM transactions WHERE transaction_date NOT BETWEEN '2023-01-01' AND '2023-12-31'":
+                [2022, 2023],
+            "SELECT * FROM transactions WHERE transaction_date >= date('2023-12-31', '+1 day')": [2022, 2023],
+        }
+        for sql, years in cases.items():
+            with self.subTest(sql=sql):
+                self.assertEqual(archive.route({}, sql), years)
+        self.assertEqual(archive.route({"history": True}, "SELECT * FROM transactions"), [2022, 2023])
+
+        # Run as an ad-hoc component, an upper bound alone reads the archived rows
+        result = db_access._execute_sql_component(
+            {}, "SELECT COUNT(*) AS n FROM transactions WHERE transaction_date < '2024-01-01'")
+        self.assertEqual(result["data"], [{"n": 13}])
+
+
+if __name__ == "__main__":
+    unittest.main()
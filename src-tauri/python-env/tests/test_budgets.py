@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import unittest
+
+from ledger_case import LedgerTestCase
+
+import budgets
+
+
+class BudgetsTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tracker = budgets.tracker.get(self.ledger)
+        self.account_id = self.add_account()
+        self.food = self.add_category("食費")
+        self.shopping = self.add_category("買い物")
+        self.salary = self.add_category("給与", "income")
+        self.account_budget = self.add_budget("口座", "account", self.account_id, 10000)
+        self.food_budget = self.add_budget("食費", "category", self.food, 5000)
+
+        self.alerts = []
+        self.db.add_change_listener(self.alerts.append, ("budgets",))
+
+    def add_budget(self, name, scope_type, scope_id, amount, **options):
+        result = self.tracker.add_budget(name, scope_type, scope_id, amount, **options)
+        self.assertTrue(result["success"], result)
+        return result["budget_id"]
+
+    def transaction(self, category_id, amount, date="2024-05-10"):
+        return {"account_id": self.account_id, "category_id": category_id, "amount": amount,
+                "transaction_date": date}
+
+    def spent(self, month="2024-05"):
+        return {budget["budget_id"]: budget["spent"] for budget in self.tracker.status(month)["budgets"]}
+
+    def assert_no_drift(self):
+        self.assertEqual(self.tracker.reconcile()["drift"], [])
+
+    def test_counters_follow_writes(self):
+        ids = self.add_transactions(self.transaction(self.food, -1200), self.transaction(self.shopping, -3000),
+                                    self.transaction(self.food, -800, "2024-06-01"))
+        self.assertEqual(self.spent(), {self.account_budget: 4200, self.food_budget: 1200})
+        self.assert_no_drift()
+
+        # Moving a row to another month and category, then deleting one
+        self.db.update_transactions([{"transaction_id": ids[2], "transaction_date": "2024-05-20",
+                                      "category_id": self.shopping}])
+        self.assertEqual(self.spent(), {self.account_budget: 5000, self.food_budget: 1200})
+        self.db.delete_transactions([ids[0]])
+        self.assertEqual(self.spent(), {self.account_budget: 3800, self.food_budget: 0})
+        self.assertEqual(self.spent("2024-06"), {self.account_budget: 0, self.food_budget: 0})
+        self.assert_no_drift()
+
+    def test_income_is_not_spend(self):
+        self.add_transactions(self.transaction(self.food, -2000), self.transaction(self.salary, 300000),
+                              self.transaction(self.salary, -700))
+        # The account budget only counts the expense, not the salary or its correction
+        self.assertEqual(self.spent(), {self.account_budget: 2000, self.food_budget: 2000})
+        self.assert_no_drift()
+
+    def test_uncategorized_rows_count_by_their_sign(self):
+        (self.db.get_csv_dir() / "bank_2024-05-31.csv").write_text(
+            "transaction_date,account_name,category_type,category_name,amount,item_name,tags,description,memo\n"
+            "2024-05-03,Bank,,,-1500,不明な支払,,,\n"
+            "2024-05-04,Bank,,,20000,不明な入金,,,\n", encoding="utf-8")
+        self.assertTrue(self.db.load_csv_file("bank_2024-05-31.csv")["success"])
+        categories = self.db.execute_query("""
+        SELECT c.name, c.type FROM transactions t JOIN categories c ON t.category_id = c.category_id
+        ORDER BY t.amount""")
+        self.assertEqual([(row["name"], row["type"]) for row in categories],
+                         [("未分類", "expense"), ("未分類", "income")])
+        # Only the payment is spend on the account budget
+        self.assertEqual(self.spent(), {self.account_budget: 1500, self.food_budget: 0})
+        self.assert_no_drift()
+
+    def test_refunds_only_reduce_their_own_category(self):
+        self.add_transactions(self.transaction(self.food, -2000), self.transaction(self.shopping, -1000),
+                              self.transaction(self.shopping, 4000))
+        # The shopping refund exceeds its expenses and counts as 0, not as -3000
+        self.assertEqual(self.spent(), {self.account_budget: 2000, self.food_budget: 2000})
+        self.add_transactions(self.transaction(self.food, 500))
+        self.assertEqual(self.spent(), {self.account_budget: 1500, self.food_budget: 1500})
+        self.assert_no_drift()
+
+    def test_alerts_are_reported_once_per_crossing(self):
+        ids = self.add_transactions(self.transaction(self.food, -4500))
+        self.add_transactions(self.transaction(self.food, -100))
+        self.assertEqual([(alert["budget_id"], alert["level"]) for alert in self.alerts],
+                         [(self.food_budget, "warning")])
+
+        self.add_transactions(self.transaction(self.food, -600))
+        self.assertEqual([alert["level"] for alert in self.alerts], ["warning", "over"])
+
+        # Dropping below the threshold resets the level, so the next crossing is reported again
+        self.db.delete_transactions(ids)
+        self.add_transactions(self.transaction(self.food, -4000))
+        self.assertEqual([alert["level"] for alert in self.alerts], ["warning", "over", "warning"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import unittest
+
+from ledger_case import LedgerTestCase
+
+
+class BulkTransactionsTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account()
+        self.category_id = self.add_category("食費")
+        self.tag_id = self.db.add_tag("旅行")["tag_id"]
+        self.events = []
+        self.db.add_change_listener(self.events.append)
+
+    def transaction(self, amount, **fields):
+        return dict({"account_id": self.account_id, "category_id": self.category_id, "amount": amount,
+                     "transaction_date": "2024-05-01"}, **fields)
+
+    def rows(self):
+        return [(row["transaction_id"], row["amount"]) for row in self.db.execute_query(
+            "SELECT transaction_id, amount FROM transactions ORDER BY transaction_id")]
+
+    def test_ids_on_an_empty_table(self):
+        ids = self.add_transactions(self.transaction(-1), self.transaction(-2, tags=[self.tag_id]),
+                                    self.transaction(-3))
+        self.assertEqual(ids, [1, 2, 3])
+        self.assertEqual(self.rows(), [(1, -1), (2, -2), (3, -3)])
+        self.assertEqual(self.db.get_transaction_tags(2)[0]["tag_id"], self.tag_id)
+        self.assertEqual(self.events[-1]["transaction_ids"], [1, 2, 3])
+
+    def test_ids_are_not_reused_after_deleting_the_highest(self):
+        ids = self.add_transactions(*[self.transaction(-amount) for amount in range(1, 6)])
+        self.assertTrue(self.db.delete_transactions(ids[3:])["success"])
+        self.assertEqual(self.add_transactions(self.transaction(-6), self.transaction(-7)), [6, 7])
+        self.assertEqual(self.rows(), [(1, -1), (2, -2), (3, -3), (6, -6), (7, -7)])
+
+    def test_a_failing_row_rolls_back_the_whole_batch(self):
+        self.add_transactions(self.transaction(-1))
+        events = len(self.events)
+        batches = {
+            "unknown account": [self.transaction(-2), self.transaction(-3, account_id=999)],
+            "unknown tag": [self.transaction(-2, tags=[self.tag_id]), self.transaction(-3, tags=[999])],
+            "duplicate tag": [self.transaction(-2, tags=[self.tag_id, self.tag_id])],
+            "missing amount": [self.transaction(-2), self.transaction(None)],
+        }
+        for name, batch in batches.items():
+            with self.subTest(name):
+                result = self.db.add_transactions(batch)
+                self.assertFalse(result["success"])
+                self.assertEqual(self.rows(), [(1, -1)])
+                self.assertEqual(self.db.execute_query("SELECT COUNT(*) AS n FROM transaction_tags")[0]["n"], 0)
+        self.assertIn("Transaction 1: amount is required", result["error"])
+        self.assertEqual(len(self.events), events)
+
+        # The ids of the rolled back rows are handed out again
+        self.assertEqual(self.add_transactions(self.transaction(-2), self.transaction(-3)), [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
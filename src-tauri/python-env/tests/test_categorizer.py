@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import sqlite3
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import categorizer
+
+
+class CategorizerTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.categorizer = categorizer.categorizer.get(self.ledger)
+        self.account_id = self.add_account()
+        self.food = self.add_category("食費")
+        self.shopping = self.add_category("買い物")
+        self.subscriptions = self.add_category("サブスク")
+
+    def add_rule(self, category_id, match_type, pattern=None, **conditions):
+        result = self.categorizer.add_rule(category_id, match_type, pattern, **conditions)
+        self.assertTrue(result["success"], result)
+        return result["rule_id"]
+
+    def categorize(self, text, amount=-1000, account_id=None):
+        return self.categorizer.compile().categorize(account_id or self.account_id, amount, text)
+
+    def test_keywords_and_regexes(self):
+        self.add_rule(self.food, "keyword", "ｾﾌﾞﾝ")
+        self.add_rule(self.shopping, "regex", r"amazon\.co\.jp|アマゾン")
+        self.assertEqual(self.categorize("セブンイレブン 新宿店"), self.food)
+        self.assertEqual(self.categorize("AMAZON.CO.JP 注文"), self.shopping)
+        self.assertIsNone(self.categorize("ローソン"))
+
+    def test_regex_literals_are_normalized_like_the_text(self):
+        self.add_rule(self.shopping, "regex", r"ｶｰﾄﾞ\s*ﾘﾎﾞ")
+        self.add_rule(self.subscriptions, "regex", r"会費[\s\d]*２０２４")
+        # Full-width brackets stay literals instead of becoming a group
+        self.add_rule(self.food, "regex", "^（株）ｽｰﾊﾟｰ")
+        self.assertEqual(self.categorize("カード リボ払い"), self.shopping)
+        self.assertEqual(self.categorize("ｶｰﾄﾞﾘﾎﾞ"), self.shopping)
+        self.assertEqual(self.categorize("年会費 2024"), self.subscriptions)
+        self.assertEqual(self.categorize("年会費 ２０２４"), self.subscriptions)
+        self.assertEqual(self.categorize("(株)スーパー"), self.food)
+        self.assertIsNone(self.categorize("株スーパー"))
+        self.assertEqual(categorizer.normalize_pattern(r"^\d+ ｶﾞｽ（.*）$"), r"^\d+ ガス\(.*\)$")
+
+    def test_priority_and_conditions(self):
+        self.add_rule(self.shopping, "keyword", "amazon")
+        self.add_rule(self.subscriptions, "regex", "amazon prime", priority=10)
+        self.add_rule(self.food, "regex", "amazon fresh", priority=10, max_amount=-5000)
+        self.assertEqual(self.categorize("Amazon Prime 会費"), self.subscriptions)
+        # The higher priority rule only applies to large amounts
+        self.assertEqual(self.categorize("Amazon Fresh", amount=-8000), self.food)
+        self.assertEqual(self.categorize("Amazon Fresh", amount=-800), self.shopping)
+
+    def test_backreferences(self):
+        # \1 refers to the rule's own group, not to a group of the other rules
+        self.add_rule(self.shopping, "regex", r"(ab)c")
+        self.add_rule(self.food, "regex", r"(\d)\1\1")
+        self.add_rule(self.subscriptions, "regex", r"(?P<word>xy)-(?P=word)")
+        compiled = self.categorizer.compile()
+        self.assertIsNotNone(compiled.combined)
+        self.assertEqual(self.categorize("店舗 777"), self.food)
+        self.assertIsNone(self.categorize("店舗 787"))
+        self.assertEqual(self.categorize("xy-xy"), self.subscriptions)
+        self.assertEqual(self.categorize("abc"), self.shopping)
+
+    def test_recategorize_holds_the_write_lock_while_hooks_read(self):
+        ids = self.add_transactions({"account_id": self.account_id, "category_id": self.food,
+                                     "amount": -500, "item_name": "Netflix", "transaction_date": "2024-01-05"})
+        self.add_rule(self.subscriptions, "keyword", "netflix")
+
+        # Another writer committing while the hooks read must wait, instead of
+        # invalidating the snapshot the update is based on
+        other_writes = []
+
+        def hook(cursor, where, params, sign):
+            # Reads like the budget and recurring hooks do
+            cursor.execute(f"SELECT COUNT(*) FROM transactions WHERE {where}", params)
+            other = sqlite3.connect(self.db.db_path, timeout=0)
+            try:
+                other.execute("INSERT INTO tags (name) VALUES (?)", (f"other {sign}",))
+                other.commit()
+                other_writes.append("committed")
+            except sqlite3.OperationalError as e:
+                other_writes.append(str(e))
+            finally:
+                other.close()
+
+        # Only this hook, as the others may happen to write first
+        with mock.patch.object(db_access.ledgers, "_write_hooks", [(0, 0, hook)]):
+            result = self.categorizer.recategorize(only_uncategorized=False)
+        self.assertEqual(result["rows_updated"], 1)
+        self.assertEqual(other_writes, ["database is locked"] * 2)
+        self.assertEqual(self.db.execute_query(
+            "SELECT category_id FROM transactions WHERE transaction_id = ?", ids)[0]["category_id"],
+            self.subscriptions)
+
+    def test_recategorize_without_changes_writes_nothing(self):
+        self.add_transactions({"account_id": self.account_id, "category_id": self.food,
+                               "amount": -500, "item_name": "ローソン", "transaction_date": "2024-01-05"})
+        self.add_rule(self.food, "keyword", "ローソン")
+        with mock.patch.object(self.db, "run_write_hooks_ids") as run_write_hooks_ids:
+            result = self.categorizer.recategorize(only_uncategorized=False)
+        self.assertEqual((result["rows_processed"], result["rows_updated"]), (1, 0))
+        run_write_hooks_ids.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import asyncio
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import archive
+import change_feed
+
+COMPONENT = "all_monthly_expences"  # reads transactions
+
+
+def event(transaction_id):
+    return {"type": "transactions_added", "transaction_ids": [transaction_id], "months": ["2024-05"]}
+
+
+async def drain(subscriber):
+    """Get the messages waiting for a subscriber."""
+    await asyncio.sleep(0)  # run the callbacks queued by publish()
+    messages = []
+    while (message := await subscriber.get(timeout=0.01)) is not None:
+        messages.append(message)
+    return messages
+
+
+class ChangeFeedTest(LedgerTestCase):
+
+    def test_missed_events_are_replayed(self):
+        feed = change_feed.ChangeFeed(history=3)
+        for transaction_id in range(1, 5):
+            feed.publish(event(transaction_id))
+
+        async def replay(last_event_id, ledger=None):
+            subscriber = feed.subscribe(ledger or self.ledger, last_event_id)
+            self.assertEqual(subscriber.start_id, 4)
+            return [(message["type"], message.get("id")) for message in await drain(subscriber)]
+
+        async def main():
+            self.assertEqual(await replay(2), [("transactions_added", 3), ("transactions_added", 4)])
+            self.assertEqual(await replay(4), [])
+            self.assertEqual(await replay(None), [])
+            # Event 1 is no longer kept
+            self.assertEqual(await replay(0), [("reset", None)])
+            # Only the events of the subscribed ledger
+            self.assertEqual(await replay(2, "other"), [])
+
+        asyncio.run(main())
+        message = feed._history[-1]
+        self.assertEqual((message["ledger"], message["transaction_ids"], message["first_month"]),
+                         (self.ledger, [4], "2024-05"))
+
+    def test_slow_subscribers_get_a_reset(self):
+        feed = change_feed.ChangeFeed(queue_size=2)
+
+        async def main():
+            fast, slow = feed.subscribe(), feed.subscribe()
+            for transaction_id in range(1, 5):
+                feed.publish(event(transaction_id))
+                self.assertEqual([message["id"] for message in await drain(fast)], [transaction_id])
+
+            # The slow subscriber's queue overflowed: the events are dropped for a reset
+            self.assertEqual(await drain(slow), [{"type": "reset", "reason": "overflow"}])
+            feed.publish(event(5))
+            self.assertEqual([message["id"] for message in await drain(slow)], [5])
+            self.assertEqual(feed.status()["subscribers"], 2)
+
+            feed.unsubscribe(slow)
+            feed.publish(event(6))
+            self.assertEqual(await drain(slow), [])
+            self.assertEqual([message["id"] for message in await drain(fast)], [5, 6])
+
+        asyncio.run(main())
+
+    def test_archiving_publishes_the_year(self):
+        account_id = self.add_account()
+        category_id = self.add_category("食費")
+        self.add_transactions(*[{"account_id": account_id, "category_id": category_id, "amount": -100,
+                                 "transaction_date": date} for date in ("2023-03-01", "2023-04-01", "2024-01-01")])
+
+        async def main():
+            subscriber = change_feed.feed.subscribe(self.ledger)
+            try:
+                self.assertTrue(archive.archive_year(self.db, 2023)["success"])
+                self.assertTrue(archive.restore_year(self.db, 2023)["success"])
+                return await drain(subscriber)
+            finally:
+                change_feed.feed.unsubscribe(subscriber)
+
+        messages = asyncio.run(main())
+        self.assertEqual([(message["type"], message["year"], message["count"]) for message in messages],
+                         [("year_archived", 2023, 2), ("year_restored", 2023, 2)])
+        for message in messages:
+            self.assertEqual((message["ledger"], message["table"]), (self.ledger, "transactions"))
+            self.assertIn(COMPONENT, message["components"])
+            self.assertNotIn("first_month", message)
+
+    def test_components_are_listed_until_one_changes(self):
+        name = f"test_change_feed_{self.ledger}"
+        self.addCleanup(db_access.delete_sql_component, name)
+        change_feed._forget_components(None)
+
+        with mock.patch.object(db_access, "get_sql_component", wraps=db_access.get_sql_component) as get:
+            self.assertIn(COMPONENT, change_feed._components_reading("transactions"))
+            self.assertNotIn(COMPONENT, change_feed._components_reading("tags"))
+            read = get.call_count
+            for _ in range(3):
+                change_feed._components_reading("transactions")
+            self.assertEqual(get.call_count, read)
+
+            self.assertTrue(db_access.save_sql_component({"name": name, "sql": "SELECT name FROM tags"})["success"])
+            self.assertIn(name, change_feed._components_reading("tags"))
+            self.assertGreater(get.call_count, read)
+
+            self.assertTrue(db_access.delete_sql_component(name)["success"])
+            self.assertNotIn(name, change_feed._components_reading("tags"))
+
+
+if __name__ == "__main__":
+    unittest.main()
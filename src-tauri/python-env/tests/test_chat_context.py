@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+import unittest
+
+from ledger_case import LedgerTestCase
+
+import archive
+import categorizer
+import chat_context
+from chat_context import tokenize
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_cjk_runs_are_split_into_bigrams(self):
+        self.assertEqual(tokenize("スーパー"), ["スー", "ーパ", "パー"])
+        self.assertEqual(tokenize("電気料金"), ["電気", "気料", "料金"])
+        # Single characters are kept as they are
+        self.assertEqual(tokenize("肉"), ["肉"])
+
+    def test_ascii_words_and_cjk_runs(self):
+        self.assertEqual(tokenize("Amazon.co.jp 書籍"), ["amazon", "co", "jp", "書籍"])
+        # Runs end at anything that is not kana or kanji
+        self.assertEqual(tokenize("コーヒー豆 2kg、牛乳"), ["2kg", "コー", "ーヒ", "ヒー", "ー豆", "牛乳"])
+        self.assertEqual(tokenize("ｽｰﾊﾟｰ"), ["ｽｰ", "ｰﾊ", "ﾊﾟ", "ﾟｰ"])
+        self.assertEqual(tokenize(""), [])
+        self.assertEqual(tokenize(None), [])
+
+
+class ChatContextTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account("銀行")
+        self.food = self.add_category("食費")
+        self.utilities = self.add_category("水道光熱費")
+        self.ids = self.add_transactions(*[
+            self.transaction(item_name, date, category_id) for item_name, date, category_id in (
+                ("スターバックス コーヒー", "2023-04-02", self.food),
+                ("ドトールコーヒー", "2024-04-03", self.food),
+                ("セブンイレブン", "2024-04-05", self.food),
+                ("東京電力 電気料金", "2024-04-27", self.utilities),
+                ("東京ガス", "2024-05-27", self.utilities),
+            )
+        ])
+        self.engine = chat_context.engine.get(self.ledger)
+
+    def transaction(self, item_name, date, category_id=None):
+        return {"account_id": self.account_id, "category_id": category_id or self.food, "amount": -500,
+                "transaction_date": date, "item_name": item_name}
+
+    def found(self, query):
+        return [row["item_name"] for row in self.engine.search(query)]
+
+    def assert_index_matches_a_rebuild(self):
+        rebuilt = chat_context.ChatContextEngine(self.db)
+        rebuilt.search("")
+        self.assertEqual(dict(self.engine._postings), dict(rebuilt._postings))
+        self.assertEqual(self.engine._doc_lengths, rebuilt._doc_lengths)
+        self.assertEqual(self.engine._documents, rebuilt._documents)
+        self.assertEqual(self.engine._total_length, rebuilt._total_length)
+
+    def test_japanese_item_names_are_found(self):
+        self.assertEqual(self.found("コーヒーにいくら使った？"), ["ドトールコーヒー", "スターバックス コーヒー"])
+        # 電気代 shares the bigram 電気 with 電気料金
+        self.assertEqual(self.found("先月の電気代"), ["東京電力 電気料金"])
+        self.assertEqual(set(self.found("水道光熱費")), {"東京電力 電気料金", "東京ガス"})
+        self.assertEqual(self.found("家賃"), [])
+
+        context = chat_context.get_chat_context("スタバのコーヒー", limit=1)
+        self.assertEqual([row["item_name"] for row in context["transactions"]], ["スターバックス コーヒー"])
+
+    def test_writes_reindex_only_the_rows_they_touched(self):
+        self.found("")
+        postings = self.engine._postings
+
+        self.add_transactions(self.transaction("ファミリーマート", "2024-05-01"))
+        self.assertEqual(self.found("ファミリーマート"), ["ファミリーマート"])
+
+        self.db.update_transactions([{"transaction_id": self.ids[2], "item_name": "ローソン"}])
+        self.assertEqual(self.found("セブンイレブン"), [])
+        self.assertEqual(self.found("ローソン"), ["ローソン"])
+
+        self.db.delete_transactions([self.ids[1]])
+        self.assertEqual(self.found("コーヒー"), ["スターバックス コーヒー"])
+        self.assert_index_matches_a_rebuild()
+
+        # Events without ids reindex their months
+        rules = categorizer.categorizer.get(self.ledger)
+        rules.add_rule(self.utilities, "keyword", "ファミリーマート")
+        self.assertGreater(rules.recategorize(only_uncategorized=False)["rows_updated"], 0)
+        self.assertIn("ファミリーマート", self.found("水道光熱費"))
+        self.assert_index_matches_a_rebuild()
+
+        archive.archive_year(self.db, 2023)
+        self.assertEqual(self.found("スターバックス"), [])
+        self.assert_index_matches_a_rebuild()
+        archive.restore_year(self.db, 2023)
+        self.assertEqual(self.found("スターバックス"), ["スターバックス コーヒー"])
+        self.assert_index_matches_a_rebuild()
+
+        # None of it rebuilt the whole index
+        self.assertIs(self.engine._postings, postings)
+
+
+if __name__ == "__main__":
+    unittest.main()
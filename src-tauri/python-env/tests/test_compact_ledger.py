@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import compact_ledger
+
+
+class CompactLedgerTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bank = self.add_account("Bank")
+        self.card = self.add_account("Card")
+        self.food = self.add_category("食費")
+        self.salary = self.add_category("給与", "income")
+        self.trip = self.db.add_tag("旅行")["tag_id"]
+        self.compact = compact_ledger.ledger.get(self.ledger)
+
+    def transaction(self, account_id, category_id, amount, date, item_name="", tags=()):
+        return {"account_id": account_id, "category_id": category_id, "amount": amount,
+                "item_name": item_name, "transaction_date": date, "tags": list(tags)}
+
+    def by_sql(self):
+        rows = self.db.execute_query("""
+            SELECT strftime('%Y-%m', transaction_date) AS month, account_id, category_id,
+                   SUM(amount_reporting) AS total, COUNT(*) AS count
+            FROM transactions GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+        """)
+        return [(row["month"], row["account_id"], row["category_id"], row["total"], row["count"]) for row in rows]
+
+    def by_compact(self, ledger=None):
+        rows = (ledger or self.compact).totals(("month", "account", "category"))
+        return [(row["month"], row["account_id"], row["category_id"], row["total"], row["count"]) for row in rows]
+
+    def assert_in_sync(self):
+        self.assertEqual(self.by_compact(), self.by_sql())
+        # Same as built from scratch, tags included
+        fresh = compact_ledger.CompactLedger(self.db)
+        self.assertEqual(self.by_compact(fresh), self.by_sql())
+        self.assertEqual(self.compact.totals(("tag",)), fresh.totals(("tag",)))
+
+    def test_totals_follow_writes(self):
+        ids = self.add_transactions(
+            self.transaction(self.bank, self.food, -1200, "2024-01-03", "スーパー", [self.trip]),
+            self.transaction(self.card, self.food, -800, "2024-01-20", "コンビニ"),
+            self.transaction(self.bank, self.salary, 300000, "2024-01-25", "給与"),
+            self.transaction(self.card, self.food, -450, "2024-02-02", "コンビニ", [self.trip]),
+        )
+        self.assert_in_sync()
+
+        with mock.patch.object(self.compact, "_query_rows", wraps=self.compact._query_rows) as query_rows:
+            self.add_transactions(self.transaction(self.bank, self.food, -90, "2024-03-01", "パン"))
+            self.db.update_transactions([{"transaction_id": ids[1], "amount": -850, "tags": [self.trip]},
+                                         {"transaction_id": ids[3], "transaction_date": "2024-03-15"}])
+            self.db.delete_transactions([ids[0]])
+            # Incremental: nothing was read from the start
+            self.assertTrue(all(call.args[0] != "1" for call in query_rows.call_args_list))
+        self.assert_in_sync()
+
+        self.assertEqual(self.compact.totals(("tag",)),
+                         [{"tag_id": self.trip, "tag_name": "旅行", "total": -850.0 - 450.0, "count": 2,
+                           "unconverted": 0}])
+        self.assertEqual(self.compact.totals((), category_type="expense")[0]["total"], -850.0 - 450.0 - 90.0)
+        self.assertEqual(self.compact.stats()["transactions"], 4)
+
+    def test_top_items(self):
+        self.add_transactions(
+            self.transaction(self.card, self.food, -500, "2024-01-02", "コンビニ"),
+            self.transaction(self.card, self.food, -700, "2024-02-02", "コンビニ"),
+            self.transaction(self.bank, self.food, -1000, "2024-01-05", "スーパー"),
+            self.transaction(self.bank, self.food, -5000, "2024-01-06", ""),
+        )
+        self.assertEqual(self.compact.top_items(), [
+            {"item_name": "コンビニ", "count": 2, "total": -1200.0, "last_date": "2024-02-02"},
+            {"item_name": "スーパー", "count": 1, "total": -1000.0, "last_date": "2024-01-05"},
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import threading
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import job_queue
+import csv_watcher
+
+HEADER = "transaction_date,account_name,category_type,category_name,amount,item_name,tags,description,memo\n"
+
+
+class CsvWatcherTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.jobs = job_queue.JobQueue(db_access.db)
+        self.watcher = csv_watcher.CsvFolderWatcher(self.jobs, db_access.ledgers, debounce_seconds=0)
+        self.watcher.backend = "polling"
+        self.csv_dir = self.db.get_csv_dir()
+
+    def drop(self, filename, rows, directory=None):
+        path = (directory or self.csv_dir) / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(HEADER + "".join(row + "\n" for row in rows), encoding="utf-8")
+        return path
+
+    def hold_worker(self):
+        """Keep the job queue busy until the returned event is set."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.jobs.submit("hold", "hold", lambda job: release.wait(10))
+        return release
+
+    def test_files_are_imported_once_into_their_ledger(self):
+        self.assertEqual(self.csv_dir, db_access.ledgers.get_data_dir() / "csv" / "ledgers" / self.ledger)
+        self.drop("bank_2024-05-01.csv", ["2024-05-01,Bank,expense,食費,-1200,スーパー,,,",
+                                          "2024-05-02,Bank,expense,食費,-300,パン,,,"])
+        release = self.hold_worker()
+
+        with mock.patch.object(self.jobs, "submit_import", wraps=self.jobs.submit_import) as submit_import:
+            self.watcher.poll()  # sees the file
+            self.watcher.poll()  # unchanged since: submits it
+            self.watcher.poll()  # still queued: nothing new
+            self.assertEqual(submit_import.call_count, 1)
+            job = self.watcher.status()["jobs"]
+            self.assertEqual([(entry["ledger"], entry["filename"]) for entry in job],
+                             [(self.ledger, "bank_2024-05-01.csv")])
+
+            release.set()
+            job = self.wait_for(self.jobs.get_job(job[0]["job_id"]))
+            self.assertEqual(job.status, "succeeded", job.errors)
+            self.watcher.poll()
+            self.watcher.poll()
+            self.assertEqual(submit_import.call_count, 1)
+
+        self.assertEqual(job.ledger, self.ledger)
+        self.assertEqual(self.db.execute_query("SELECT COUNT(*) AS n FROM transactions")[0]["n"], 2)
+        self.assertFalse((self.csv_dir / "bank_2024-05-01.csv").exists())
+        self.assertTrue((self.db.get_dust_dir() / "bank_2024-05-01.csv").exists())
+        self.assertEqual(self.watcher.status()["jobs"], [])
+
+    def test_failed_files_are_retried_only_when_changed(self):
+        path = self.drop("card_2024-05-01.csv", ["2024-05-01,Card,expense,食費,not a number,,,,"])
+        # Files outside the ledger folders are not picked up
+        self.drop("card_2024-05-01.csv", ["2024-05-01,Card,expense,食費,-100,,,,"],
+                  self.csv_dir.parent / "no_such_ledger")
+
+        with mock.patch.object(self.jobs, "submit_import", wraps=self.jobs.submit_import) as submit_import:
+            self.watcher.poll()
+            self.watcher.poll()
+            self.wait_for(self.jobs.list_jobs()[-1])
+            with self.assertLogs(level="ERROR"):
+                self.watcher.poll()
+            self.watcher.poll()
+            self.assertEqual(submit_import.call_count, 1)
+            self.assertEqual(self.watcher.status()["failed"], [{"ledger": self.ledger, "filename": path.name}])
+
+            self.drop(path.name, ["2024-05-01,Card,expense,食費,-100,,,,"])
+            self.watcher.poll()
+            self.watcher.poll()
+            self.assertEqual(submit_import.call_count, 2)
+        self.wait_for(self.jobs.list_jobs()[-1])
+        self.assertEqual(self.db.execute_query("SELECT SUM(amount) AS total FROM transactions")[0]["total"], -100)
+
+
+if __name__ == "__main__":
+    unittest.main()
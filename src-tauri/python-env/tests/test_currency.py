@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import budgets
+import compact_ledger
+import currency
+
+RATES = """date,currency,rate,base
+2024-01-01,USD,140,JPY
+2024-03-01,USD,150,JPY
+2024-05-01,JPY,0.00625,USD
+"""
+
+
+class CurrencyTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rates_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(rates_dir.cleanup)
+        (Path(rates_dir.name) / "rates.csv").write_text(RATES)
+        patcher = mock.patch.object(currency, "get_rates_dir", return_value=Path(rates_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.converter = currency.converter.get(self.ledger)
+        self.usd = self.add_account("Card (USD)", "USD")
+        self.eur = self.add_account("Card (EUR)", "EUR")
+        self.category_id = self.add_category("旅行")
+        self.budget_id = budgets.tracker.get(self.ledger).add_budget(
+            "USD", "account", self.usd, 100000, period="year")["budget_id"]
+        self.compact = compact_ledger.ledger.get(self.ledger)
+
+    def transaction(self, account_id, amount, date):
+        return {"account_id": account_id, "category_id": self.category_id, "amount": amount,
+                "transaction_date": date}
+
+    def converted(self):
+        return [row["amount_reporting"] for row in self.db.execute_query(
+            "SELECT amount_reporting FROM transactions ORDER BY transaction_id")]
+
+    def budget_spent(self):
+        return budgets.tracker.get(self.ledger).status("2024-01")["budgets"][0]["spent"]
+
+    def test_rates_as_of_the_transaction_date(self):
+        self.add_transactions(self.transaction(self.usd, -10, "2023-12-01"),
+                              self.transaction(self.usd, -10, "2024-02-29"),
+                              self.transaction(self.usd, -10, "2024-03-01"),
+                              self.transaction(self.usd, -10, "2024-06-30"),
+                              self.transaction(self.eur, -10, "2024-03-01"))
+        self.compact.totals(())
+        self.assertEqual(self.converted(), [None] * 5)
+        # Rows without a rate are left out of totals rather than added in their own currency
+        self.assertEqual(self.budget_spent(), 0)
+        self.assertEqual(self.compact.totals(()), [{"total": 0.0, "count": 0, "unconverted": 5}])
+
+        result = self.converter.load_rates("rates.csv")
+        self.assertTrue(result["success"], result)
+        self.assertEqual((result["rates_loaded"], result["unconverted"]), (3, 0))
+        # The earliest rate before the table starts, the inverted quote from May on; EUR has no rates
+        self.assertEqual(self.converted(), [-1400, -1400, -1500, -1600, None])
+        self.assertEqual(self.budget_spent(), 1400 + 1500 + 1600)
+        self.assertEqual(budgets.tracker.get(self.ledger).reconcile()["drift"], [])
+        self.assertEqual(self.compact.totals(()), [{"total": -5900.0, "count": 4, "unconverted": 1}])
+
+    def test_new_rows_are_converted_before_the_other_hooks_run(self):
+        self.converter.load_rates("rates.csv")
+        self.add_transactions(self.transaction(self.usd, -2, "2024-03-15"))
+        self.assertEqual(self.converted(), [-300])
+        # The budget hook read amount_reporting after the currency hook filled it in
+        self.assertEqual(self.budget_spent(), 300)
+        self.assertEqual(budgets.tracker.get(self.ledger).reconcile()["drift"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import ledger_case  # noqa: F401  (puts the modules under test on sys.path)
+import downsample
+
+
+class DownsampleTest(unittest.TestCase):
+
+    def test_lttb_keeps_the_ends_and_the_peaks(self):
+        x = np.arange(1000, dtype=float)
+        y = np.sin(x / 50)
+        y[437] = 25
+        indices = downsample.lttb_indices(x, y, 100)
+        self.assertEqual(len(indices), 100)
+        self.assertEqual((indices[0], indices[-1]), (0, 999))
+        self.assertIn(437, indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        # Nothing to reduce
+        self.assertEqual(downsample.lttb_indices(x[:50], y[:50], 100).tolist(), list(range(50)))
+
+    def test_minmax_keeps_the_extremes_of_each_bucket(self):
+        y = np.zeros(1000)
+        y[123], y[876] = -40, 40
+        indices = downsample.minmax_indices(y, 10)
+        self.assertLessEqual(len(indices), 22)
+        self.assertTrue({0, 123, 876, 999} <= set(indices.tolist()))
+
+    def test_series_are_reduced_separately(self):
+        dates = pd.date_range("2024-01-01", periods=500).strftime("%Y-%m-%d")
+        df = pd.concat([pd.DataFrame({"date": dates, "account": account, "amount": np.arange(500) * sign})
+                        for account, sign in (("Bank", 1), ("Card", -1))], ignore_index=True)
+        config = {"method": "lttb", "x": "date", "y": "amount", "series": "account", "points": 100}
+        reduced, info = downsample.apply(df, config)
+        self.assertEqual(info, {"method": "lttb", "rows_before": 1000, "rows_after": 100})
+        self.assertEqual(reduced.groupby("account").size().to_dict(), {"Bank": 50, "Card": 50})
+        self.assertEqual(reduced.groupby("account")["date"].agg(["min", "max"]).values.tolist(),
+                         [["2024-01-01", dates[-1]]] * 2)
+
+    def test_top_n_folds_the_rest_into_other(self):
+        df = pd.DataFrame({"category": list("abcdefghij"), "total": [10, 90, 30, 80, 20, 70, 40, 60, 50, 5]})
+        reduced, info = downsample.apply(df, {"method": "top_n", "label": "category", "value": "total", "n": 4})
+        self.assertEqual(reduced["category"].tolist(), ["b", "d", "f", downsample.OTHER_LABEL])
+        self.assertEqual(reduced["total"].tolist(), [90, 80, 70, 60 + 50 + 40 + 30 + 20 + 10 + 5])
+        self.assertEqual(reduced["total"].sum(), df["total"].sum())
+
+    def test_top_n_ranks_by_size_whatever_the_sign(self):
+        # Expenses are negative amounts: the largest ones are kept, not the smallest
+        df = pd.DataFrame({"category": list("abcdef"), "total": [-10, -90, -30, 80, -20, -5]})
+        reduced, info = downsample.apply(df, {"method": "top_n", "label": "category", "value": "total", "n": 3})
+        self.assertEqual(reduced["category"].tolist(), ["b", "d", downsample.OTHER_LABEL])
+        self.assertEqual(reduced["total"].tolist(), [-90, 80, -30 - 20 - 10 - 5])
+
+    def test_small_results_are_unchanged(self):
+        df = pd.DataFrame({"date": ["2024-01-01", "2024-01-02"], "amount": [1, 2]})
+        reduced, info = downsample.apply(df, {"method": "minmax", "x": "date", "y": "amount"})
+        self.assertEqual(reduced.to_dict("records"), df.to_dict("records"))
+        self.assertEqual((info["rows_before"], info["rows_after"]), (2, 2))
+
+    def test_config_is_validated(self):
+        self.assertIsNone(downsample.get_config({"sql": "SELECT 1"}))
+        with self.assertRaises(ValueError):
+            downsample.get_config({"downsample": {"method": "lttb", "x": "date"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import unittest
+
+from ledger_case import LedgerTestCase
+
+import budgets
+
+FILENAME = "bank_2024-05-31.csv"
+CSV = """transaction_date,account_name,category_type,category_name,amount,item_name,tags,description,memo
+2024-05-03,Bank,expense,食費,-1200,スーパー,[旅行|週末],,
+2024-05-10,Bank,expense,食費,-800,コンビニ,,,
+2024-05-25,Bank,income,給与,250000,給与,,,
+"""
+
+
+class ImportUndoTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        account_id = self.add_account("Bank")
+        self.food = self.add_category("食費")
+        self.add_transactions({"account_id": account_id, "category_id": self.food, "amount": -500,
+                               "transaction_date": "2024-05-01"})
+        self.tracker = budgets.tracker.get(self.ledger)
+        self.tracker.add_budget("食費", "category", self.food, 30000)
+        (self.db.get_csv_dir() / FILENAME).write_text(CSV, encoding="utf-8")
+
+    def state(self):
+        return {
+            "transactions": self.db.execute_query("SELECT transaction_id, amount FROM transactions ORDER BY 1"),
+            "tags": self.db.execute_query("SELECT * FROM transaction_tags"),
+            "spent": self.tracker.status("2024-05")["budgets"][0]["spent"],
+            "files": sorted(self.db.get_csv_files()),
+        }
+
+    def test_undo_restores_rows_counters_and_file(self):
+        before = self.state()
+        result = self.db.load_csv_file(FILENAME)
+        self.assertTrue(result["success"], result)
+        self.assertEqual((result["transactions_inserted"], result["tags_inserted"]), (3, 2))
+        self.assertEqual(self.state()["spent"], 500 + 1200 + 800)
+        self.assertEqual(self.state()["files"], [])
+        self.assertTrue((self.db.get_dust_dir() / FILENAME).exists())
+
+        result = self.db.delete_data_log(result["log_id"], restore_file=True)
+        self.assertEqual((result["transactions_deleted"], result["tags_deleted"], result["restored_file"]),
+                         (3, 2, FILENAME))
+        self.assertEqual(self.state(), before)
+        self.assertFalse((self.db.get_dust_dir() / FILENAME).exists())
+        self.assertEqual(self.db.get_data_logs(), [])
+        self.assertEqual(self.tracker.reconcile()["drift"], [])
+
+        # The restored file can be imported again
+        self.assertTrue(self.db.load_csv_file(FILENAME)["success"])
+        self.assertEqual(self.state()["spent"], 500 + 1200 + 800)
+
+    def test_undo_when_the_file_is_gone(self):
+        log_id = self.db.load_csv_file(FILENAME)["log_id"]
+        (self.db.get_dust_dir() / FILENAME).unlink()
+
+        result = self.db.delete_data_log(log_id, restore_file=True)
+        self.assertTrue(result["success"])
+        self.assertEqual(result["transactions_deleted"], 3)
+        self.assertIn("File not found", result["restore_error"])
+        self.assertNotIn("restored_file", result)
+        self.assertEqual(self.state()["spent"], 500)
+
+        self.assertFalse(self.db.delete_data_log(log_id)["success"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import threading
+import unittest
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import job_queue
+
+
+class JobQueueTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.jobs = job_queue.JobQueue(db_access.db)
+
+    def test_same_kind_and_key_reuses_the_active_job(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        first = self.jobs.submit("import", "a.csv", lambda job: release.wait(5))
+
+        self.assertIs(self.jobs.submit("import", "a.csv", lambda job: None), first)
+        other = self.jobs.submit("import", "b.csv", lambda job: None)
+        self.assertIsNot(other, first)
+
+        release.set()
+        self.wait_for(first)
+        self.wait_for(other)
+        # A finished job is not reused
+        self.assertIsNot(self.jobs.submit("import", "a.csv", lambda job: None), first)
+
+    def test_progress_and_result(self):
+        def work(job):
+            self.jobs.report_progress(job, 0, 3)
+            for rows in range(1, 4):
+                self.jobs.report_progress(job, rows)
+            return {"success": True, "rows": 3}
+
+        job = self.wait_for(self.jobs.submit("recategorize", "all", work))
+        self.assertEqual(job.status, "succeeded")
+        self.assertEqual((job.rows_processed, job.rows_total), (3, 3))
+        self.assertEqual(job.to_dict()["result"], {"success": True, "rows": 3})
+
+    def test_failures(self):
+        failed = self.wait_for(self.jobs.submit("x", "1", lambda job: {"success": False, "error": "bad file"}))
+        self.assertEqual((failed.status, failed.errors), ("failed", ["bad file"]))
+
+        def boom(job):
+            raise ValueError("boom")
+        raised = self.wait_for(self.jobs.submit("x", "2", boom))
+        self.assertEqual((raised.status, raised.errors), ("failed", ["boom"]))
+
+    def test_job_runs_on_the_ledger_it_was_submitted_on(self):
+        job = self.wait_for(self.jobs.submit("x", "ledger", lambda job: db_access.current_ledger.get()))
+        self.assertEqual(job.result, self.ledger)
+
+
+if __name__ == "__main__":
+    unittest.main()
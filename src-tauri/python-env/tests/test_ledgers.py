@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import io
+import threading
+import contextlib
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import categorizer
+import compact_ledger
+import api
+
+
+class LedgersTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = f"{self.ledger}_other"
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.other_db = db_access.ledgers.create(self.other)
+        self.addCleanup(self.other_db.close_all)
+
+    def account_names(self, db):
+        return [row["name"] for row in db.execute_query("SELECT name FROM accounts ORDER BY name")]
+
+    def test_requests_are_routed_by_ledger(self):
+        client = TestClient(api.app)
+        for ledger, name in ((self.ledger, "Bank"), (self.other, "Card")):
+            response = client.post("/accounts", json={"name": name, "account_type": "bank"},
+                                   headers={"X-Ledger": ledger})
+            self.assertTrue(response.json()["success"], response.json())
+        self.assertEqual(self.account_names(self.db), ["Bank"])
+        self.assertEqual(self.account_names(self.other_db), ["Card"])
+
+        # The query parameter wins over the header
+        response = client.get("/accounts", params={"ledger": self.other}, headers={"X-Ledger": self.ledger})
+        self.assertEqual([account["name"] for account in response.json()], ["Card"])
+
+        self.assertEqual(client.get("/accounts", headers={"X-Ledger": "no_such_ledger"}).status_code, 404)
+        self.assertEqual(client.get("/accounts", headers={"X-Ledger": "../default"}).status_code, 400)
+
+    def test_services_are_kept_per_ledger(self):
+        food = self.add_category("食費")
+        categorizer.categorizer.get(self.ledger).add_rule(food, "keyword", "スーパー")
+        self.assertEqual(len(categorizer.categorizer.get(self.ledger).get_rules()), 1)
+        self.assertEqual(categorizer.categorizer.get(self.other).get_rules(), [])
+
+        self.add_transactions({"account_id": self.add_account(), "category_id": food, "amount": -100,
+                               "transaction_date": "2024-01-01"})
+        self.assertEqual(compact_ledger.ledger.get(self.ledger).stats()["transactions"], 1)
+        self.assertEqual(compact_ledger.ledger.get(self.other).stats()["transactions"], 0)
+        self.assertIsNot(compact_ledger.ledger.get(self.ledger), compact_ledger.ledger.get(self.other))
+
+        # The global `db` and the per-ledger services follow the current ledger
+        with db_access.ledgers.use(self.other):
+            self.assertEqual(db_access.db.name, self.other)
+            self.assertIs(compact_ledger.ledger.get(), compact_ledger.ledger.get(self.other))
+            self.assertEqual(compact_ledger.ledger.stats()["transactions"], 0)
+        self.assertEqual(db_access.db.name, self.ledger)
+
+    def test_eviction_leaves_connections_of_running_queries_open(self):
+        self.add_account("Bank")
+        started, resume = threading.Event(), threading.Event()
+        results = []
+
+        def query():
+            # Reaches the ledger without use(), as background threads may
+            conn = self.other_db.connect()
+            cursor = conn.execute("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000) "
+                                  "SELECT i FROM n")
+            results.append(cursor.fetchone()[0])
+            started.set()
+            resume.wait(10)
+            try:
+                results.append(len(cursor.fetchall()))
+                results.append(self.account_names(self.other_db))
+            except Exception as e:
+                results.append(e)
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        self.assertTrue(started.wait(10))
+        self.other_db.connect()  # an idle connection of this thread
+
+        with mock.patch.object(db_access.ledgers, "max_open", 1):
+            # Using the test ledger makes the other ledger the least recently used one
+            with db_access.ledgers.use(self.ledger):
+                pass
+        resume.set()
+        thread.join()
+
+        self.assertEqual(results, [1, 999, []])
+        # The idle connection of this thread was closed, the running one only retired
+        with self.other_db._connections_lock:
+            threads = list(self.other_db._connections.values())
+        self.assertNotIn(threading.current_thread(), threads)
+        # ...and closed once its thread has ended
+        with mock.patch.object(db_access.ledgers, "max_open", 1):
+            with db_access.ledgers.use(self.ledger):
+                pass
+        self.assertFalse(self.other_db.has_connections)
+
+    def test_accessing_a_ledger_does_not_close_others(self):
+        with mock.patch.object(db_access.ledgers, "max_open", 1), \
+                mock.patch.object(db_access.DatabaseManager, "close_idle") as close_idle:
+            self.other_db.connect()
+            for _ in range(3):
+                db_access.db.execute_query("SELECT 1")
+                db_access.ledgers.get(self.other).execute_query("SELECT 1")
+            close_idle.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import io
+import json
+import random
+import contextlib
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import load_test
+
+
+class LoadTestFunctionsTest(unittest.TestCase):
+
+    def test_percentile_is_the_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([load_test.percentile(values, fraction) for fraction in (0.5, 0.95, 0.99, 1.0)],
+                         [50, 95, 99, 100])
+        self.assertEqual(load_test.percentile(values, 0.07), 7)
+        self.assertEqual(load_test.percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(load_test.percentile([7], 0.99), 7)
+        self.assertIsNone(load_test.percentile([], 0.5))
+
+    def test_summary_counts_errors_per_endpoint(self):
+        recorder = load_test.Recorder()
+        for seconds, ok in ((0.01, True), (0.02, True), (0.03, False), (0.04, True)):
+            recorder.record("GET /health", seconds, ok)
+        recorder.record("GET /transactions", 0.5, True)
+        summary = recorder.summary(2)
+        health = summary["endpoints"]["GET /health"]
+        self.assertEqual((health["count"], health["errors"], health["error_rate"], health["throughput"]),
+                         (4, 1, 0.25, 2.0))
+        self.assertEqual((health["p50_ms"], health["max_ms"]), (20.0, 40.0))
+        self.assertEqual((summary["total"]["count"], summary["total"]["errors"]), (5, 1))
+
+    def test_compare_reports_slower_and_failing_endpoints(self):
+        baseline = {"endpoints": {"a": {"p95_ms": 100, "error_rate": 0.0},
+                                  "b": {"p95_ms": 100, "error_rate": 0.1},
+                                  "c": {"p95_ms": 100, "error_rate": 0.0}}}
+        result = {"endpoints": {"a": {"p95_ms": 119, "error_rate": 0.0},
+                                "b": {"p95_ms": 130, "error_rate": 0.2},
+                                "c": {"p95_ms": 50, "error_rate": 0.0},
+                                "new": {"p95_ms": 999, "error_rate": 1.0}}}
+        self.assertEqual(load_test.compare(result, baseline),
+                         ["b: p95 100ms -> 130ms", "b: error rate 0.1 -> 0.2"])
+        self.assertEqual(load_test.compare(result, baseline, max_regression=0.1), ["a: p95 100ms -> 119ms",
+                                                                                   "b: p95 100ms -> 130ms",
+                                                                                   "b: error rate 0.1 -> 0.2"])
+
+    def test_unknown_operations_are_rejected(self):
+        with self.assertRaises(ValueError):
+            load_test.LoadTest("http://127.0.0.1:1", "x", {"no_such_op": 1}).run(duration=0)
+        self.assertEqual(load_test.parse_mix("health=2, import=0")["import"], 0)
+
+
+class LoadTestRunTest(LedgerTestCase):
+    """Runs the load test against the app started in-process, on the test ledger."""
+
+    def main(self, *args):
+        argv = ["load_test.py", "--ledger", self.ledger, "--transactions", "50", "--duration", "0.3",
+                "--concurrency", "2", *args]
+        output = io.StringIO()
+        with mock.patch("sys.argv", argv), contextlib.redirect_stdout(output):
+            code = load_test.main()
+        return code, output.getvalue()
+
+    def test_exit_code_follows_errors_and_regressions(self):
+        result_path = db_access.ledgers.get_data_dir() / "result.json"
+        code, output = self.main("--mix", "transactions=1,component=0,totals=1,health=1,import=0,chat=1",
+                                 "--output", str(result_path))
+        self.assertEqual(code, 0, output)
+        result = json.loads(result_path.read_text(encoding="utf-8"))
+        self.assertEqual(result["config"]["transactions"], 50)
+        self.assertEqual(self.db.execute_query("SELECT COUNT(*) AS n FROM transactions")[0]["n"], 50)
+        self.assertGreater(result["endpoints"]["GET /health"]["count"], 0)
+        self.assertEqual(result["total"]["errors"], 0)
+
+        # Every run of an unknown component fails
+        errors = ("--mix", "transactions=0,component=1,totals=0,health=0,import=0,chat=0",
+                  "--component", "no_such_component")
+        code, output = self.main(*errors)
+        self.assertEqual(code, 1)
+        self.assertIn("ERRORS POST /sql_components/{name}/run: error rate 1.0 (allowed 0.0)", output)
+        self.assertEqual(self.main(*errors, "--max-error-rate", "1")[0], 0)
+
+        # A baseline that was much faster
+        for stats in result["endpoints"].values():
+            stats["p95_ms"] = 0.001
+        result_path.write_text(json.dumps(result), encoding="utf-8")
+        code, output = self.main("--mix", "transactions=0,component=0,totals=0,health=1,import=0,chat=0",
+                                 "--baseline", str(result_path))
+        self.assertEqual(code, 1)
+        self.assertIn("REGRESSION GET /health: p95 0.001ms", output)
+
+    def test_imports_go_through_the_ledger_folder(self):
+        server, thread, base_url = load_test.start_server()
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(setattr, server, "should_exit", True)
+
+        test = load_test.LoadTest(base_url, self.ledger)
+        self.assertEqual(test.generate(transactions=10)["generated"], 10)
+        test.op_import(test._client(), random.Random(0))
+        self.assertEqual(test.recorder.summary(1)["endpoints"]["import (end to end)"]["errors"], 0)
+        self.assertEqual(self.db.execute_query("SELECT COUNT(*) AS n FROM transactions")[0]["n"], 210)
+        self.assertTrue((self.db.get_dust_dir() / test._csv_files[0]).exists())
+
+        test.cleanup()
+        self.assertEqual(list(self.db.get_dust_dir().iterdir()), [])
+        self.assertEqual(list(self.db.get_csv_dir().iterdir()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
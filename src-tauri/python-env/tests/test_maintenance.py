@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import shutil
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import archive
+import maintenance
+
+
+class SnapshotTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.backup_dir = db_access.ledgers.get_data_dir() / "backup"
+        patcher = mock.patch.object(maintenance, "get_backup_dir", return_value=self.backup_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.account_id = self.add_account()
+        self.category_id = self.add_category("食費")
+        self.add_transactions(*[{"account_id": self.account_id, "category_id": self.category_id, "amount": -100,
+                                 "transaction_date": f"{year}-{month:02d}-10"}
+                                for year in (2022, 2023, 2024) for month in range(1, 13)])
+
+    def restore(self, name):
+        """Copy a snapshot and its archives into a new directory, as a ledger would be laid out."""
+        directory = db_access.ledgers.get_data_dir() / "restored" / name
+        (directory / "archive").mkdir(parents=True)
+        shutil.copy(self.backup_dir / name, directory / f"{self.ledger}.sqlite")
+        for path in maintenance.get_archive_dir(name).glob("*.sqlite"):
+            shutil.copy(path, directory / "archive" / path.name)
+        restored = db_access.DatabaseManager(directory / f"{self.ledger}.sqlite", self.ledger)
+        self.addCleanup(restored.close_all)
+        return restored
+
+    def count(self, db):
+        return db.execute_query("SELECT COUNT(*) AS n FROM transactions")[0]["n"]
+
+    def test_restored_snapshot_has_the_archived_years(self):
+        for year in (2022, 2023):
+            self.assertTrue(archive.archive_year(self.db, year)["success"])
+        progress = []
+        result = maintenance.snapshot(self.db, pages_per_step=1,
+                                      progress_callback=lambda copied, total: progress.append((copied, total)))
+        self.assertEqual(result["archives"], [f"{self.ledger}_2022.sqlite", f"{self.ledger}_2023.sqlite"])
+        self.assertGreater(result["archive_size"], 0)
+        # Pages add up over the database and both archives
+        self.assertEqual(progress[-1][0], progress[-1][1])
+        self.assertEqual([copied for copied, total in progress], sorted(copied for copied, total in progress))
+
+        # Changes after the snapshot are not in it
+        archive.restore_year(self.db, 2022)
+        self.add_transactions({"account_id": self.account_id, "category_id": self.category_id, "amount": -1,
+                               "transaction_date": "2024-12-31"})
+
+        restored = self.restore(result["snapshot"])
+        self.assertEqual(self.count(restored), 12)
+        self.assertEqual([row["year"] for row in archive.get_archived_years(restored)], [2022, 2023])
+        with archive.history(restored, [2022, 2023]):
+            self.assertEqual(self.count(restored), 36)
+            self.assertEqual(restored.execute_query(
+                "SELECT COUNT(*) AS n FROM transactions WHERE transaction_date < '2023-01-01'")[0]["n"], 12)
+        self.assertTrue(archive.restore_year(restored, 2023)["success"])
+        self.assertEqual(self.count(restored), 24)
+
+    def test_without_archived_years(self):
+        result = maintenance.snapshot(self.db)
+        self.assertEqual(result["archives"], [])
+        self.assertFalse(maintenance.get_archive_dir(result["snapshot"]).exists())
+        self.assertEqual(self.count(self.restore(result["snapshot"])), 36)
+
+    def test_keep_prunes_the_oldest_snapshots(self):
+        archive.archive_year(self.db, 2022)
+        names = [maintenance.snapshot(self.db, keep=0)["snapshot"] for _ in range(3)]
+        self.assertEqual([item["name"] for item in maintenance.list_snapshots(self.ledger)], names[::-1])
+
+        result = maintenance.snapshot(self.db, keep=2)
+        self.assertCountEqual(result["removed"], names[:2])
+        self.assertEqual([item["name"] for item in maintenance.list_snapshots(self.ledger)],
+                         [result["snapshot"], names[2]])
+        for name in names[:2]:
+            self.assertFalse(maintenance.get_archive_dir(name).exists())
+        for name in (names[2], result["snapshot"]):
+            self.assertTrue((maintenance.get_archive_dir(name) / f"{self.ledger}_2022.sqlite").exists())
+        # Only the leftovers of this ledger's snapshots
+        self.assertEqual(sorted(path.name for path in self.backup_dir.iterdir()),
+                         sorted([names[2], result["snapshot"], f"{names[2][:-7]}.archive",
+                                 f"{result['snapshot'][:-7]}.archive"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import threading
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import job_queue
+import materialized
+
+COMPONENT = "all_monthly_expences"  # materialized, partitioned by month
+
+
+class MaterializedTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.component = db_access.get_sql_component(COMPONENT)["component"]
+        self.account_id = self.add_account()
+        self.add_category("除外")  # the component leaves out category 1
+        self.category_id = self.add_category("食費")
+
+    def transaction(self, amount, date):
+        return {"account_id": self.account_id, "category_id": self.category_id,
+                "amount": amount, "transaction_date": date}
+
+    def stored(self):
+        df, state = materialized.read(self.component)
+        if state.get("stale"):
+            # Built by a queued job; read again once it has finished
+            self.wait_for(job_queue.jobs.get_job(state["refresh_job_id"]))
+            df, state = materialized.read(self.component)
+        self.assertNotIn("stale", state)
+        return df.to_dict("records")
+
+    def table_exists(self):
+        return bool(self.db.execute_query("SELECT 1 FROM sqlite_master WHERE name = ?",
+                                          (materialized.table_name(COMPONENT),)))
+
+    def computed(self):
+        return self.db.execute_query(materialized._strip_sql(self.component["sql"]))
+
+    def test_writes_refresh_only_the_touched_months(self):
+        ids = self.add_transactions(self.transaction(-100, "2024-01-10"), self.transaction(-200, "2024-02-10"),
+                                    self.transaction(-300, "2024-03-10"))
+        self.assertEqual(self.stored(), self.computed())
+
+        with mock.patch.object(materialized, "refresh", wraps=materialized.refresh) as refresh:
+            self.db.update_transactions([{"transaction_id": ids[0], "amount": -150}])
+            self.add_transactions(self.transaction(-50, "2024-04-01"))
+            self.db.delete_transactions([ids[2]])
+        self.assertEqual([call.args for call in refresh.call_args_list],
+                         [(COMPONENT, ["2024-01"]), (COMPONENT, ["2024-04"]), (COMPONENT, ["2024-03"])])
+
+        self.assertEqual(self.stored(), self.computed())
+        self.assertEqual([row["month"] for row in self.stored()], ["2024-01", "2024-02", "2024-04"])
+
+    def test_changed_sql_is_rebuilt_in_full(self):
+        self.add_transactions(self.transaction(-100, "2024-01-10"))
+        self.stored()
+        changed = dict(self.component, sql=self.component["sql"].replace("ABS(amount_reporting)", "1"))
+        with mock.patch.object(db_access, "get_sql_component",
+                               return_value={"success": True, "component": changed}):
+            df, state = materialized.read(changed)
+            self.assertEqual(df["total_expense"].tolist(), [1])
+            self.wait_for(job_queue.jobs.get_job(state["refresh_job_id"]))
+            df, state = materialized.read(changed)
+        self.assertEqual(df["total_expense"].tolist(), [1])
+        self.assertNotIn("stale", state)
+
+    def test_reads_queue_the_refresh_instead_of_writing(self):
+        self.add_transactions(self.transaction(-100, "2024-01-10"), self.transaction(-200, "2024-02-10"))
+        release = threading.Event()
+        self.addCleanup(release.set)
+        job_queue.jobs.submit("hold", self.ledger, lambda job: release.wait(10))
+
+        # The SQL is run read-only while the refresh waits in the queue
+        df, state = materialized.read(self.component)
+        self.assertEqual(df.to_dict("records"), self.computed())
+        self.assertTrue(state["stale"])
+        self.assertEqual(materialized.read(self.component)[1]["refresh_job_id"], state["refresh_job_id"])
+        self.assertFalse(self.table_exists())
+
+        release.set()
+        job = self.wait_for(job_queue.jobs.get_job(state["refresh_job_id"]))
+        self.assertEqual((job.kind, job.ledger, job.status), ("materialize", self.ledger, "succeeded"))
+        self.assertTrue(self.table_exists())
+        self.assertEqual(self.stored(), self.computed())
+
+    def test_a_failed_refresh_marks_the_component_dirty(self):
+        self.add_transactions(self.transaction(-100, "2024-01-10"))
+        self.stored()
+
+        with mock.patch.object(materialized, "refresh", side_effect=RuntimeError("disk full")), \
+                self.assertLogs(level="ERROR") as logs:
+            self.add_transactions(self.transaction(-200, "2024-02-10"))
+        self.assertIn("disk full", logs.output[0])
+        self.assertEqual(materialized._get_state(COMPONENT)["dirty"], 1)
+
+        # Later writes leave it alone; the stored result is not served, but rebuilt in full
+        with mock.patch.object(materialized, "refresh", wraps=materialized.refresh) as refresh:
+            self.add_transactions(self.transaction(-300, "2024-03-10"))
+            refresh.assert_not_called()
+            df, state = materialized.read(self.component)
+            self.assertTrue(state["stale"])
+            self.assertEqual(df.to_dict("records"), self.computed())
+            self.assertEqual(self.stored(), self.computed())
+        refresh.assert_called_once_with(COMPONENT)
+        self.assertEqual(materialized._get_state(COMPONENT)["dirty"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import sqlite3
+import unittest
+
+from ledger_case import LedgerTestCase
+
+import archive
+
+
+class ReadOnlyQueryTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account()
+        self.category_id = self.add_category("食費")
+        self.add_transactions(*[{"account_id": self.account_id, "category_id": self.category_id,
+                                 "amount": -100, "transaction_date": f"{year}-01-10"} for year in (2023, 2024)])
+
+    def query(self, sql, params=None):
+        return self.db.execute_query(sql, params, read_only=True)
+
+    def count(self):
+        return self.db.execute_query("SELECT COUNT(*) AS n FROM transactions")[0]["n"]
+
+    def test_reads_are_allowed(self):
+        self.assertEqual(self.query("SELECT SUM(amount) AS total FROM transactions")[0]["total"], -200)
+        self.assertEqual(self.query("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 3) SELECT SUM(i) AS s FROM n
+        """)[0]["s"], 6)
+        self.assertIn("amount", [row["name"] for row in self.query("PRAGMA table_info(transactions)")])
+        self.assertTrue(self.query("PRAGMA user_version"))
+
+    def test_writes_and_attach_are_denied(self):
+        path = self.db.db_path.with_name("other.sqlite")
+        for sql in ("DELETE FROM transactions",
+                    "UPDATE transactions SET amount = 0",
+                    "INSERT INTO tags (name) VALUES ('x')",
+                    "CREATE TABLE t (x)",
+                    "CREATE TEMP VIEW v AS SELECT 1",
+                    "DROP TABLE transactions",
+                    f"ATTACH DATABASE '{path}' AS other",
+                    "PRAGMA journal_mode = DELETE",
+                    "SELECT * FROM transactions; DELETE FROM transactions"):
+            with self.subTest(sql=sql), self.assertRaises(sqlite3.Error):
+                self.query(sql)
+        self.assertEqual(self.count(), 2)
+        self.assertFalse(path.exists())
+
+    def test_archived_years_on_the_read_only_connection(self):
+        archive.archive_year(self.db, 2023)
+        with archive.history(self.db, [2023], read_only=True):
+            self.assertEqual(self.query("SELECT COUNT(*) AS n FROM transactions")[0]["n"], 2)
+            with self.assertRaises(sqlite3.Error):
+                self.query("DELETE FROM transactions")
+        # The authorizer applies again once the archive is detached
+        self.assertEqual(self.query("SELECT COUNT(*) AS n FROM transactions")[0]["n"], 1)
+        with self.assertRaises(sqlite3.Error):
+            self.query("CREATE TEMP VIEW v AS SELECT 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import unittest
+from unittest import mock
+
+from ledger_case import LedgerTestCase
+
+import recurring
+
+
+class RecurringTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account()
+        self.category_id = self.add_category("サブスク")
+        self.detector = recurring.detector.get(self.ledger)
+
+    def monthly(self, item_name, amount, months, year=2024):
+        return [{"account_id": self.account_id, "category_id": self.category_id, "amount": amount,
+                 "item_name": item_name, "transaction_date": f"{year}-{month:02d}-05"} for month in months]
+
+    def series(self):
+        return {row["series_key"]: (row["occurrences"], row["period"], row["average_amount"])
+                for row in self.db.execute_query("SELECT * FROM recurring_series")}
+
+    def assert_matches_rebuild(self):
+        live = self.series()
+        self.detector.rebuild()
+        self.assertEqual(live, self.series())
+
+    def test_new_rows_extend_their_series(self):
+        self.add_transactions(*self.monthly("Netflix 01", -990, range(1, 4)))
+        self.add_transactions(*self.monthly("ＮＥＴＦＬＩＸ　04", -990, range(4, 7)))
+        self.assertEqual(self.series(), {f"{self.account_id}:netflix": (6, "monthly", -990)})
+        series = recurring.get_recurring()["series"]
+        self.assertEqual([(row["display_name"], row["next_expected_date"]) for row in series],
+                         [("ＮＥＴＦＬＩＸ　04", "2024-07-05")])
+
+    def test_updates_and_deletes_recompute_only_their_series(self):
+        netflix = self.add_transactions(*self.monthly("Netflix", -990, range(1, 7)))
+        self.add_transactions(*self.monthly("Spotify", -980, range(1, 7)))
+
+        with mock.patch.object(recurring.RecurringDetector, "rebuild", side_effect=AssertionError("rebuild")):
+            # Renaming moves the row to another series; changing the amount changes the average
+            self.db.update_transactions([{"transaction_id": netflix[0], "item_name": "Spotify"},
+                                         {"transaction_id": netflix[1], "amount": -1990}])
+            self.assertEqual(self.series()[f"{self.account_id}:spotify"][0], 7)
+            self.assertEqual(self.series()[f"{self.account_id}:netflix"][0], 5)
+
+            self.db.delete_transactions(netflix[1:])
+            self.assertNotIn(f"{self.account_id}:netflix", self.series())
+        self.assertEqual(self.db.execute_query("SELECT COUNT(*) AS n FROM recurring_dirty")[0]["n"], 0)
+        self.assert_matches_rebuild()
+
+    def test_reads_do_not_update(self):
+        self.add_transactions(*self.monthly("Netflix", -990, range(1, 4)))
+        with mock.patch.object(recurring.RecurringDetector, "update", side_effect=AssertionError("update")):
+            self.assertTrue(recurring.get_recurring()["success"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import io
+import contextlib
+import unittest
+
+from fastapi.testclient import TestClient
+
+from ledger_case import LedgerTestCase
+
+import db_access
+import job_queue
+import materialized
+import api
+
+MATERIALIZED = "all_monthly_expences"
+
+
+class RunBatchTest(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.component = f"test_batch_{self.ledger}"
+        result = db_access.save_sql_component({
+            "name": self.component,
+            "sql": "SELECT COUNT(*) AS n, SUM(amount) AS total FROM transactions WHERE amount <= $max"
+        })
+        self.assertTrue(result["success"], result)
+        self.addCleanup(db_access.delete_sql_component, self.component)
+
+        self.other = f"{self.ledger}_other"
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.other_db = db_access.ledgers.create(self.other)
+        self.addCleanup(self.other_db.close_all)
+
+        for db, amounts in ((self.db, (-100, -300, 500)), (self.other_db, (-7000,))):
+            account_id = db.add_account("Bank", "bank")["account_id"]
+            db.add_category("除外", "expense")  # the materialized component leaves out category 1
+            category_id = db.add_category("食費", "expense")["category_id"]
+            result = db.add_transactions([{"account_id": account_id, "category_id": category_id, "amount": amount,
+                                           "transaction_date": "2024-05-10"} for amount in amounts])
+            self.assertTrue(result["success"], result)
+
+    def run_batch(self, ledger, *runs):
+        response = TestClient(api.app).post("/sql_components/run_batch", json={"components": list(runs)},
+                                            headers={"X-Ledger": ledger})
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def test_results_keep_the_request_order_and_share_identical_queries(self):
+        body = self.run_batch(
+            self.ledger,
+            {"name": self.component, "env_vars": {"max": "-200"}},
+            {"name": "no_such_component"},
+            {"name": self.component, "env_vars": {"max": "0"}},
+            {"name": self.component, "env_vars": {"max": "-200"}},
+        )
+        self.assertTrue(body["success"])
+        self.assertEqual(body["queries_executed"], 2)
+        results = body["results"]
+        self.assertEqual([result["name"] for result in results],
+                         [self.component, "no_such_component", self.component, self.component])
+        self.assertEqual(results[0]["data"], [{"n": 1, "total": -300}])
+        self.assertEqual(results[2]["data"], [{"n": 2, "total": -400}])
+        self.assertEqual(results[3]["data"], results[0]["data"])
+        self.assertFalse(results[1]["success"])
+        self.assertIn("not found", results[1]["error"])
+
+        self.assertEqual([timing["shared_with"] for timing in body["timings"]], [None, None, None, self.component])
+        self.assertEqual(results[0]["columns"], ["n", "total"])
+
+    def test_components_run_on_the_ledger_of_the_request(self):
+        runs = ({"name": self.component, "env_vars": {"max": "0"}}, {"name": MATERIALIZED})
+        body = self.run_batch(self.other, *runs)
+        self.assertEqual(body["results"][0]["data"], [{"n": 1, "total": -7000}])
+        self.assertEqual([row["total_expense"] for row in body["results"][1]["data"]], [7000])
+
+        # The refresh queued by the materialized read runs on that ledger too
+        job = self.wait_for(job_queue.jobs.get_job(body["results"][1]["materialized"]["refresh_job_id"]))
+        self.assertEqual((job.ledger, job.status), (self.other, "succeeded"))
+        table = materialized.table_name(MATERIALIZED)
+        for db, exists in ((self.other_db, True), (self.db, False)):
+            self.assertEqual(bool(db.execute_query("SELECT 1 FROM sqlite_master WHERE name = ?", (table,))), exists)
+
+        body = self.run_batch(self.ledger, *runs)
+        self.assertEqual(body["results"][0]["data"], [{"n": 2, "total": -400}])
+        self.assertEqual([row["total_expense"] for row in body["results"][1]["data"]], [400])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,8 @@
 export class ApiClient {
   private initializing_flag = false;
   private baseUrl: string | null = null;
+  // Ledger sent with every request (null for the default ledger)
+  private ledger: string | null = null;
   private isBrowser: boolean;
 
   // Constructor initializes the API client
@@ -102,9 +104,12 @@ export class ApiClient {
 
     const url = `${this.baseUrl}${endpoint}`;
     
-    const headers = {
+    const headers: Record<string, string> = {
       'Content-Type': 'application/json',
     };
+    if (this.ledger) {
+      headers['X-Ledger'] = this.ledger;
+    }
 
     const options: RequestInit = {
       method,
@@ -146,6 +151,23 @@ export class ApiClient {
     return this.request<T>('DELETE', endpoint);
   }
 
+  // API methods for ledgers
+  setLedger(name: string | null): void {
+    this.ledger = name;
+  }
+
+  getLedger(): string | null {
+    return this.ledger;
+  }
+
+  async getLedgers(): Promise<any[]> {
+    return this.get<any[]>('/ledgers');
+  }
+
+  async createLedger(name: string): Promise<any> {
+    return this.post<any>('/ledgers', { name });
+  }
+
   // API methods for accounts
   async getAccounts(): Promise<any[]> {
     return this.get<any[]>('/accounts');
@@ -172,6 +194,31 @@ export class ApiClient {
     return this.delete<any>(`/categories/${categoryId}`);
   }
 
+  // API methods for categorization rules
+  async getCategoryRules(): Promise<any[]> {
+    return this.get<any[]>('/category_rules');
+  }
+
+  async addCategoryRule(rule: {
+    category_id: number,
+    match_type?: string,
+    pattern?: string,
+    min_amount?: number,
+    max_amount?: number,
+    account_id?: number,
+    priority?: number
+  }): Promise<any> {
+    return this.post<any>('/category_rules', rule);
+  }
+
+  async deleteCategoryRule(ruleId: number): Promise<any> {
+    return this.delete<any>(`/category_rules/${ruleId}`);
+  }
+
+  async applyCategoryRules(onlyUncategorized: boolean = true, batchSize: number = 1000): Promise<any> {
+    return this.post<any>('/category_rules/apply', { only_uncategorized: onlyUncategorized, batch_size: batchSize });
+  }
+
   // API methods for tags
   async getTags(): Promise<any[]> {
     return this.get<any[]>('/tags');
@@ -210,6 +257,18 @@ export class ApiClient {
     });
   }
 
+  async addTransactions(transactions: any[]): Promise<any> {
+    return this.post<any>('/transactions/bulk', { transactions });
+  }
+
+  async updateTransactions(transactions: any[]): Promise<any> {
+    return this.put<any>('/transactions/bulk', { transactions });
+  }
+
+  async deleteTransactions(transactionIds: number[]): Promise<any> {
+    return this.post<any>('/transactions/bulk/delete', { transaction_ids: transactionIds });
+  }
+
   // API methods for CSV files
   async getCsvFiles(): Promise<string[]> {
     return this.get<any>('/csv_files');
@@ -219,6 +278,140 @@ export class ApiClient {
     return this.post<any>(`/csv_files/${filename}`);
   }
 
+  // API methods for import logs
+  async getDataLogs(): Promise<any[]> {
+    return this.get<any[]>('/data_logs');
+  }
+
+  async deleteDataLog(logId: number, restoreFile: boolean = false): Promise<any> {
+    return this.delete<any>(`/data_logs/${logId}?restore_file=${restoreFile}`);
+  }
+
+  // API methods for budgets (reconcile runs as a background job)
+  async getBudgets(): Promise<any[]> {
+    return this.get<any[]>('/budgets');
+  }
+
+  async addBudget(budget: { name: string; scope_type: string; scope_id: number; amount: number; period?: string; alert_threshold?: number }): Promise<any> {
+    return this.post<any>('/budgets', budget);
+  }
+
+  async updateBudget(budgetId: number, changes: { name?: string; amount?: number; alert_threshold?: number }): Promise<any> {
+    return this.put<any>(`/budgets/${budgetId}`, changes);
+  }
+
+  async deleteBudget(budgetId: number): Promise<any> {
+    return this.delete<any>(`/budgets/${budgetId}`);
+  }
+
+  async getBudgetStatus(month?: string): Promise<any> {
+    return this.get<any>(month ? `/budgets/status?month=${month}` : '/budgets/status');
+  }
+
+  async reconcileBudgets(budgetId?: number): Promise<any> {
+    return this.post<any>(budgetId !== undefined ? `/budgets/reconcile?budget_id=${budgetId}` : '/budgets/reconcile');
+  }
+
+  // API methods for exchange rates (loading and refreshing run as background jobs)
+  async getExchangeRates(): Promise<any> {
+    return this.get<any>('/exchange_rates');
+  }
+
+  async loadExchangeRates(filename: string): Promise<any> {
+    return this.post<any>(`/exchange_rates/${filename}`);
+  }
+
+  async refreshConversions(): Promise<any> {
+    return this.post<any>('/exchange_rates/refresh');
+  }
+
+  // API methods for the archive of closed years (archive and restore run as background jobs)
+  async getArchiveStatus(): Promise<any> {
+    return this.get<any>('/archive');
+  }
+
+  async archiveYear(year: number): Promise<any> {
+    return this.post<any>(`/archive/${year}`);
+  }
+
+  async restoreArchivedYear(year: number): Promise<any> {
+    return this.post<any>(`/archive/${year}/restore`);
+  }
+
+  // API methods for database maintenance (snapshots and optimize run as background jobs)
+  async getMaintenanceStatus(): Promise<any> {
+    return this.get<any>('/maintenance');
+  }
+
+  async takeSnapshot(keep: number = 10): Promise<any> {
+    return this.post<any>(`/maintenance/snapshot?keep=${keep}`);
+  }
+
+  async optimizeDatabase(analyze: boolean = false, enableIncrementalVacuum: boolean = false): Promise<any> {
+    return this.post<any>(`/maintenance/optimize?analyze=${analyze}&enable_incremental_vacuum=${enableIncrementalVacuum}`);
+  }
+
+  // API methods for the CSV folder watcher
+  async getCsvWatcherStatus(): Promise<any> {
+    return this.get<any>('/csv_watcher');
+  }
+
+  async startCsvWatcher(usePolling: boolean = false): Promise<any> {
+    return this.post<any>(`/csv_watcher/start?use_polling=${usePolling}`);
+  }
+
+  async stopCsvWatcher(): Promise<any> {
+    return this.post<any>('/csv_watcher/stop');
+  }
+
+  // API methods for background jobs
+  async getJobs(): Promise<any[]> {
+    return this.get<any[]>('/jobs');
+  }
+
+  async getJob(jobId: string): Promise<any> {
+    return this.get<any>(`/jobs/${jobId}`);
+  }
+
+  // Wait for a background job to finish, reporting progress along the way
+  async waitForJob(jobId: string, onProgress?: (job: any) => void, intervalMs: number = 500): Promise<any> {
+    while (true) {
+      const job = await this.getJob(jobId);
+      if (onProgress) {
+        onProgress(job);
+      }
+      if (job.status === 'succeeded' || job.status === 'failed') {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  }
+
+  // Subscribe to the change feed of the current ledger (server-sent events).
+  // Each event names its table, the months and accounts touched and the components reading the table;
+  // on a "reset" event everything should be reloaded. Returns a function that closes the subscription.
+  subscribeChanges(onChange: (event: any) => void, allLedgers: boolean = false): () => void {
+    if (!this.baseUrl) {
+      throw new Error('API client not initialized');
+    }
+    // EventSource cannot send headers, so the ledger goes in the query string
+    const params = new URLSearchParams();
+    if (allLedgers) {
+      params.set('all_ledgers', 'true');
+    }
+    if (this.ledger) {
+      params.set('ledger', this.ledger);
+    }
+    const source = new EventSource(`${this.baseUrl}/changes?${params.toString()}`);
+    source.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      if (event.type !== 'connected') {
+        onChange(event);
+      }
+    };
+    return () => source.close();
+  }
+
   // API methods for SQL components
   async getSqlComponents(): Promise<any[]> {
     return this.get<any[]>('/sql_components');
@@ -236,8 +429,50 @@ export class ApiClient {
     return this.delete<any>(`/sql_components/${name}`);
   }
 
-  async runSqlComponent(name: string, envVars?: any): Promise<any> {
-    return this.post<any>(`/sql_components/${name}/run`, envVars || {});
+  // maxPoints overrides the number of points of a downsampled component (e.g. the chart width)
+  async runSqlComponent(name: string, envVars?: any, maxPoints?: number): Promise<any> {
+    const query = maxPoints ? `?max_points=${maxPoints}` : '';
+    return this.post<any>(`/sql_components/${name}/run${query}`, envVars || {});
+  }
+
+  async runSqlComponents(components: { name: string, env_vars?: Record<string, string>, max_points?: number }[]): Promise<any> {
+    return this.post<any>('/sql_components/run_batch', { components });
+  }
+
+  async refreshSqlComponent(name: string): Promise<any> {
+    return this.post<any>(`/sql_components/${name}/refresh`);
+  }
+
+  // API methods for analytics on the in-memory ledger
+  async getTotals(groupBy: string[] = ['month', 'category'], start?: string, end?: string, categoryType?: string): Promise<any> {
+    const params = new URLSearchParams({ group_by: groupBy.join(',') });
+    if (start) params.append('start', start);
+    if (end) params.append('end', end);
+    if (categoryType) params.append('category_type', categoryType);
+    return this.get<any>(`/analytics/totals?${params.toString()}`);
+  }
+
+  async getLedgerStats(): Promise<any> {
+    return this.get<any>('/analytics/ledger');
+  }
+
+  // API methods for recurring transactions (rebuilding runs as a background job)
+  async getRecurring(period?: string, minConfidence: number = 0, limit: number = 100): Promise<any> {
+    const periodParam = period ? `&period=${period}` : '';
+    return this.get<any>(`/recurring?min_confidence=${minConfidence}&limit=${limit}${periodParam}`);
+  }
+
+  async rebuildRecurring(): Promise<any> {
+    return this.post<any>('/recurring/rebuild');
+  }
+
+  // API methods for the AI chat
+  async chat(message: string, limit: number = 200): Promise<any> {
+    return this.post<any>('/chat', { message, limit });
+  }
+
+  async getChatContext(message: string, limit: number = 200): Promise<any> {
+    return this.post<any>('/chat/context', { message, limit });
   }
 
   // Execute custom SQL query